@@ -1,74 +1,105 @@
-import networkx as nx
-from warehouse import Warehouse
+from planner import DijkstraPlanner
+from profiling import timed
 
 class Agent:
   '''
   Holds the behavior of an agent that would perform a task.
+
+  It is a view of the agent with index i in an AgentPool, which holds the
+  state of all the agents in arrays; views are created by AgentPool.add().
+
+  Paths are computed by a planner, an object with a
+  plan(w, source, target, max_cost, reservations, forecast) -> (path, cost)
+  method. Dijkstra is used by default.
   '''
-  def __init__(self, name, pos):
-    self._name = name
-    self._pos = pos
-    self._path = []
+  def __init__(self, pool, i):
+    self._pool = pool
+    self._i = i
+    planner = pool.planner(i)
+    self._planner = planner if planner is not None else DijkstraPlanner()
+
+  def index(self):
+    '''
+    Returns its index in the pool.
+    '''
+    return self._i
 
   def name(self):
-    return self._name
+    return self._pool.name(self._i)
 
   def pos(self):
-    return self._pos
+    return self._pool.pos(self._i)
+
+  def path(self, start=0, stop=None):
+    '''
+    Returns the nodes that remain to be traversed, sliced as path[start:stop].
+    '''
+    return self._pool.path(self._i, start, stop)
 
-  def path_and_cost_to(self, node, w):
+  def remaining_ticks(self):
+    '''
+    Returns the number of ticks until the agent is idle again. An assignment
+    with no nodes to traverse still takes one tick.
+    '''
+    return max(self._pool.path_length(self._i), 1)
+
+  @timed('Agent.path_and_cost_to')
+  def path_and_cost_to(self, node, w, max_cost=None, reservations=None, forecast=None):
     '''
     Returns the path and the cost of going from its position to node given a 
-    Warehouse w.
+    Warehouse w. When max_cost is given, returns None if the path is not
+    cheaper than that. When a ReservationTable is given, the path respects the
+    node capacities and None is returned if there is no such path. When an
+    OccupancyForecast is given, edges are priced for the tick the agent would
+    traverse them.
     '''
-    class WeightFn:
-      def __init__(self, w):
-        self._w = w
-      def __call__(self, u, v, d):
-        return w.get_edge_cost(u, v)
-    weight_fn = WeightFn(w)
-    path = nx.dijkstra_path(w.graph(), self._pos, node, weight=weight_fn)
-    return path[1:], w.path_cost(path)
+    return self._planner.plan(w, self.pos(), node, max_cost, reservations, forecast)
 
   def is_assigned(self):
     '''
     Returns True when it has nodes to cover from its assignment.
     '''
-    return False if not self._path else True
+    return self._pool.path_length(self._i) > 0
 
   def assign_mission(self, path):
     '''
     Sets a list of nodes to traverse.
     '''
-    self._path = path
+    self._pool.assign(self._i, path)
 
   def next_move(self):
     '''
     Returns the next edge to traverse when it is assigned
     '''
-    return (self._pos, self._path[0]) if self.is_assigned() else None
+    next_node = self._pool.next_node(self._i)
+    return (self.pos(), next_node) if next_node is not None else None
 
   def tick(self, w):
     '''
     When it has an assignment, it moves to the next node.
     '''
-    if self.is_assigned():
-      # Computes the step cost
-      p_s = self._pos
-      p_f = self._path.pop(0)
-      # Updates the position
-      self._pos = p_f
+    self._pool.step(self._i)
+
+  def advance(self, n_ticks):
+    '''
+    Same as calling tick() n_ticks times.
+    '''
+    for i in range(0, min(n_ticks, self._pool.path_length(self._i))):
+      self._pool.step(self._i)
 
   def __repr__(self):
-    return '[name: {}, position: {}, is_assigned: {}, path: {}]'.format(self._name, self._pos, self.is_assigned(), self._path)
+    return '[name: {}, position: {}, is_assigned: {}, path: {}]'.format(self.name(), self.pos(), self.is_assigned(), self.path())
 
 if __name__ == "__main__":
+  from agent_pool import AgentPool
+  from warehouse import Warehouse
+
   ROWS=4
   COLS=8
   NODE_CAPACITY=2
   w = Warehouse(ROWS, COLS, NODE_CAPACITY, edge_base_cost=1., occupancy_cost=0.1)
   n_0 = '1_1'
-  agent = Agent('dut', '1_1')
+  agent = AgentPool(w).add('dut', '1_1')
   print('Agent {} is at <{}>'.format(agent.name(), agent.pos()))
   target = '2_7'
   path, cost = agent.path_and_cost_to(target, w)
@@ -79,4 +110,3 @@ if __name__ == "__main__":
     agent.tick(w)
     print('Iter {}: agent position: {}'.format(i, agent.pos()))
     i += 1
-
@@ -0,0 +1,81 @@
+import numpy as np
+
+class AgentIndex:
+  '''
+  Spatial index of agents over a warehouse grid.
+
+  The grid is split in square buckets of bucket_size x bucket_size nodes and
+  every agent is kept in the bucket of its node. Agents are then visited by
+  rings of buckets around a node, together with a lower bound of the number of
+  hops to reach them, so far agents can be discarded without looking at them.
+  Agents are expected not to move while they are indexed.
+  '''
+  def __init__(self, w, bucket_size=8):
+    self._w = w
+    self._bucket_size = bucket_size
+    rows, cols = w.shape()
+    self._n_bucket_rows = (rows + bucket_size - 1) // bucket_size
+    self._n_bucket_cols = (cols + bucket_size - 1) // bucket_size
+    # Bucket -> agents in insertion order (dicts are used as ordered sets)
+    self._buckets = dict()
+    self._agent_buckets = dict()
+
+  def add(self, agent):
+    bucket = self._bucket(agent.pos())
+    self._buckets.setdefault(bucket, dict())[agent] = None
+    self._agent_buckets[agent] = bucket
+
+  def remove(self, agent):
+    bucket = self._agent_buckets.pop(agent)
+    del self._buckets[bucket][agent]
+    if not self._buckets[bucket]:
+      del self._buckets[bucket]
+
+  def __len__(self):
+    return len(self._agent_buckets)
+
+  def state(self):
+    '''
+    Returns the indices of the indexed agents in insertion order, which is
+    also their order within each bucket.
+    '''
+    return {'agents': np.array([agent.index() for agent in self._agent_buckets], dtype=np.int64)}
+
+  def load_state(self, state, agents):
+    '''
+    Indexes again the agents of a state(), given the Agent views by index.
+    '''
+    self._buckets = dict()
+    self._agent_buckets = dict()
+    for i in state['agents'].tolist():
+      self.add(agents[i])
+
+  def rings(self, node):
+    '''
+    Yields (lower_bound, agents) for the rings of buckets around node, from
+    the closest to the farthest, skipping the empty ones. lower_bound is the
+    least number of hops from node to any node of the ring.
+    '''
+    b_row, b_col = self._bucket(node)
+    max_ring = max(b_row, self._n_bucket_rows - 1 - b_row, b_col, self._n_bucket_cols - 1 - b_col)
+    for ring in range(0, max_ring + 1):
+      agents = []
+      for bucket in self._ring_buckets(b_row, b_col, ring):
+        agents.extend(self._buckets.get(bucket, ()))
+      if agents:
+        yield (0 if ring == 0 else (ring - 1) * self._bucket_size + 1), agents
+
+  def _ring_buckets(self, b_row, b_col, ring):
+    if ring == 0:
+      yield (b_row, b_col)
+      return
+    for col in range(b_col - ring, b_col + ring + 1):
+      yield (b_row - ring, col)
+      yield (b_row + ring, col)
+    for row in range(b_row - ring + 1, b_row + ring):
+      yield (row, b_col - ring)
+      yield (row, b_col + ring)
+
+  def _bucket(self, node):
+    row, col = self._w.node_index(node)
+    return (row // self._bucket_size, col // self._bucket_size)
@@ -0,0 +1,222 @@
+import numpy as np
+
+from agent import Agent
+
+class AgentPool:
+  '''
+  Holds the state of a set of agents as a struct of NumPy arrays.
+
+  Every agent has an index. Its node (as an offset, see
+  Warehouse.node_offset()), whether it is busy with a mission and the range
+  [cursor, end) of its remaining path in a flat int32 buffer of node offsets
+  live in arrays indexed by it, so all the agents move in a single vectorized
+  step. Paths are appended at the tail of the buffer, which is compacted when
+  it is full.
+
+  Agents are handled through Agent views, one per index, which keep the
+  original Agent interface.
+  '''
+  def __init__(self, w):
+    self._w = w
+    self._n_agents = 0
+    self._names = []
+    self._planners = []
+    self._views = []
+    self._pos = np.zeros(0, dtype=np.int32)
+    self._cursor = np.zeros(0, dtype=np.int64)
+    self._end = np.zeros(0, dtype=np.int64)
+    self._busy = np.zeros(0, dtype=bool)
+    # Order in which the agents got their current missions
+    self._sequence = np.zeros(0, dtype=np.int64)
+    self._next_sequence = 0
+    self._paths = np.zeros(1024, dtype=np.int32)
+    self._tail = 0
+
+  def add(self, name, pos, planner=None):
+    '''
+    Adds an idle agent at node pos and returns its Agent view.
+    '''
+    i = self._n_agents
+    if i == len(self._pos):
+      size = max(2 * i, 16)
+      self._pos = np.resize(self._pos, size)
+      self._cursor = np.resize(self._cursor, size)
+      self._end = np.resize(self._end, size)
+      self._busy = np.resize(self._busy, size)
+      self._sequence = np.resize(self._sequence, size)
+    self._pos[i] = self._w.node_offset(pos)
+    self._cursor[i] = self._end[i] = 0
+    self._busy[i] = False
+    self._sequence[i] = 0
+    self._names.append(name)
+    self._planners.append(planner)
+    self._views.append(Agent(self, i))
+    self._n_agents += 1
+    return self._views[i]
+
+  def __len__(self):
+    return self._n_agents
+
+  def agents(self):
+    '''
+    Returns the Agent views, by index.
+    '''
+    return self._views
+
+  def warehouse(self):
+    return self._w
+
+  def name(self, i):
+    return self._names[i]
+
+  def planner(self, i):
+    return self._planners[i]
+
+  def pos(self, i):
+    return self._w.node_from_offset(self._pos.item(i))
+
+  def path_length(self, i):
+    return self._end.item(i) - self._cursor.item(i)
+
+  def path(self, i, start=0, stop=None):
+    '''
+    Returns the nodes of the remaining path of agent i, sliced as
+    path[start:stop].
+    '''
+    cursor = self._cursor.item(i)
+    end = self._end.item(i)
+    stop = end if stop is None else min(cursor + stop, end)
+    return [self._w.node_from_offset(o) for o in self._paths[cursor + start:stop].tolist()]
+
+  def next_node(self, i):
+    '''
+    Returns the next node of agent i or None when it has no path left.
+    '''
+    cursor = self._cursor.item(i)
+    return self._w.node_from_offset(self._paths.item(cursor)) if cursor < self._end.item(i) else None
+
+  def next_moves(self, indices):
+    '''
+    Returns an array with a row per agent in indices that holds the offsets of
+    its node and its next node, or -1s when it has no path left.
+    '''
+    cursor = self._cursor[indices]
+    moving = cursor < self._end[indices]
+    moves = np.full((len(indices), 2), -1, dtype=np.int64)
+    moves[moving, 0] = self._pos[indices[moving]]
+    moves[moving, 1] = self._paths[cursor[moving]]
+    return moves
+
+  def is_busy(self, i):
+    return self._busy.item(i)
+
+  def assign(self, i, path):
+    '''
+    Replaces the remaining path of agent i. When it was not busy, it becomes
+    busy and its mission is ordered after the others.
+    '''
+    n = len(path)
+    if self._tail + n > len(self._paths):
+      self._compact(n)
+    self._paths[self._tail:self._tail + n] = [self._w.node_offset(node) for node in path]
+    self._cursor[i] = self._tail
+    self._end[i] = self._tail + n
+    self._tail += n
+    if not self._busy[i]:
+      self._busy[i] = True
+      self._sequence[i] = self._next_sequence
+      self._next_sequence += 1
+
+  def step(self, i):
+    '''
+    Same as tick() for agent i alone.
+    '''
+    if self._cursor[i] < self._end[i]:
+      self._pos[i] = self._paths[self._cursor[i]]
+      self._cursor[i] += 1
+    if self._cursor[i] == self._end[i]:
+      self._busy[i] = False
+
+  def tick(self):
+    '''
+    Moves every agent with a path left to its next node. Busy agents with no
+    path left become idle. Returns their views in the order they got their
+    missions.
+    '''
+    n = self._n_agents
+    cursor = self._cursor[:n]
+    moving = np.flatnonzero(cursor < self._end[:n])
+    self._pos[moving] = self._paths[cursor[moving]]
+    cursor[moving] += 1
+    finished = np.flatnonzero(self._busy[:n] & (cursor == self._end[:n]))
+    return self._finish(finished[np.argsort(self._sequence[finished], kind='stable')])
+
+  def advance(self, n_ticks):
+    '''
+    Same as calling tick() n_ticks times in a row, but returns the agents that
+    became idle ordered by the tick they did and then by the order they got
+    their missions.
+    '''
+    n = self._n_agents
+    cursor = self._cursor[:n]
+    end = self._end[:n]
+    remaining = end - cursor
+    moving = np.flatnonzero(remaining > 0)
+    steps = np.minimum(remaining[moving], n_ticks)
+    self._pos[moving] = self._paths[cursor[moving] + steps - 1]
+    cursor[moving] += steps
+    # An assignment with no nodes takes one tick
+    finished = np.flatnonzero(self._busy[:n] & (cursor == end))
+    finished = finished[np.lexsort((self._sequence[finished], np.maximum(remaining[finished], 1)))]
+    return self._finish(finished)
+
+  def state(self):
+    '''
+    Returns the arrays of the agents and their paths, see load_state().
+    '''
+    n = self._n_agents
+    return {
+      'pos': self._pos[:n],
+      'cursor': self._cursor[:n],
+      'end': self._end[:n],
+      'busy': self._busy[:n],
+      'sequence': self._sequence[:n],
+      'next_sequence': np.int64(self._next_sequence),
+      'paths': self._paths[:self._tail],
+      'paths_size': np.int64(len(self._paths)),
+    }
+
+  def load_state(self, state):
+    '''
+    Restores a state() of a pool with the same agents.
+    '''
+    if len(state['pos']) != self._n_agents:
+      raise ValueError('State of {} agents for a pool of {}'.format(len(state['pos']), self._n_agents))
+    n = self._n_agents
+    self._pos[:n] = state['pos']
+    self._cursor[:n] = state['cursor']
+    self._end[:n] = state['end']
+    self._busy[:n] = state['busy']
+    self._sequence[:n] = state['sequence']
+    self._next_sequence = state['next_sequence'].item()
+    self._tail = len(state['paths'])
+    self._paths = np.zeros(state['paths_size'].item(), dtype=np.int32)
+    self._paths[:self._tail] = state['paths']
+
+  def _finish(self, finished):
+    self._busy[finished] = False
+    return [self._views[i] for i in finished.tolist()]
+
+  def _compact(self, n):
+    # Moves the remaining paths to the head of a buffer with room for n more
+    live = np.flatnonzero(self._cursor[:self._n_agents] < self._end[:self._n_agents])
+    lengths = self._end[live] - self._cursor[live]
+    total = int(lengths.sum())
+    starts = np.cumsum(lengths) - lengths
+    paths = np.zeros(max(2 * (total + n), 1024), dtype=np.int32)
+    paths[:total] = self._paths[np.repeat(self._cursor[live] - starts, lengths) + np.arange(total)]
+    self._cursor[:self._n_agents] = self._end[:self._n_agents] = 0
+    self._cursor[live] = starts
+    self._end[live] = starts + lengths
+    self._paths = paths
+    self._tail = total
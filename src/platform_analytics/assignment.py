@@ -0,0 +1,71 @@
+import numpy as np
+
+# SciPy's solver, imported on the first call as scipy.optimize is slow to
+# import: None until then and False when SciPy is not installed
+_scipy_linear_sum_assignment = None
+
+def linear_sum_assignment(costs):
+  '''
+  Solves the linear sum assignment problem for a (possibly rectangular) cost
+  matrix: every row (or column, when there are fewer of them) is matched to a
+  distinct column (row) minimizing the total cost.
+
+  Returns (rows, cols) arrays with the matched pairs sorted by row. Uses SciPy
+  when it is installed and the Hungarian algorithm otherwise.
+  '''
+  global _scipy_linear_sum_assignment
+  if _scipy_linear_sum_assignment is None:
+    try:
+      from scipy.optimize import linear_sum_assignment as _scipy_linear_sum_assignment
+    except ImportError:
+      _scipy_linear_sum_assignment = False
+  costs = np.asarray(costs, dtype=np.float64)
+  if _scipy_linear_sum_assignment:
+    return _scipy_linear_sum_assignment(costs)
+  if costs.shape[0] > costs.shape[1]:
+    cols, rows = _hungarian(costs.T)
+    order = np.argsort(rows)
+    return rows[order], cols[order]
+  return _hungarian(costs)
+
+def _hungarian(costs):
+  '''
+  Shortest augmenting path Hungarian algorithm for n rows <= m columns, with
+  the inner loop vectorized over the columns. O(n^2 m).
+  '''
+  n, m = costs.shape
+  # Potentials and matching, 1-based with column 0 as a sentinel
+  u = np.zeros(n + 1)
+  v = np.zeros(m + 1)
+  match = np.zeros(m + 1, dtype=np.int64)
+  way = np.zeros(m + 1, dtype=np.int64)
+  for i in range(1, n + 1):
+    match[0] = i
+    j0 = 0
+    min_v = np.full(m + 1, np.inf)
+    used = np.zeros(m + 1, dtype=bool)
+    while True:
+      used[j0] = True
+      i0 = match[j0]
+      reduced = costs[i0 - 1] - u[i0] - v[1:]
+      improves = ~used[1:] & (reduced < min_v[1:])
+      min_v[1:][improves] = reduced[improves]
+      way[1:][improves] = j0
+      free = np.flatnonzero(~used[1:]) + 1
+      j1 = free[np.argmin(min_v[free])]
+      delta = min_v[j1]
+      u[match[used]] += delta
+      v[used] -= delta
+      min_v[free] -= delta
+      j0 = j1
+      if match[j0] == 0:
+        break
+    # Flips the augmenting path
+    while j0 != 0:
+      j1 = way[j0]
+      match[j0] = match[j1]
+      j0 = j1
+  cols = np.flatnonzero(match[1:])
+  rows = match[1:][cols] - 1
+  order = np.argsort(rows)
+  return rows[order], cols[order]
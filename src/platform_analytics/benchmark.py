@@ -0,0 +1,203 @@
+import argparse
+import json
+import logging
+from multiprocessing import Pool
+import re
+import resource
+import time
+
+import numpy as np
+
+from planner import PLANNERS
+from simulation_sample import SIMULATION_CASES
+from simulator import WAREHOUSE_BACKENDS, Simulator
+from task_creator import draw_nodes
+from warehouse_manager import WarehouseManager
+
+GRID_SIZES = (10, 50, 100, 250, 500)
+AGENT_COUNTS = (10, 100, 1000, 5000)
+LAMS = tuple(sorted(set(case['lam'] for case in SIMULATION_CASES.values())))
+
+# Options of the manager under benchmark. 'default' is the configuration of
+# SIMULATION_CASES and 'scaled' the one meant for large grids.
+CONFIGURATIONS = {
+  'default': {'backend': 'networkx', 'planner': 'dijkstra', 'spatial_index': 0},
+  'scaled': {'backend': 'grid', 'planner': 'astar', 'spatial_index': 8},
+}
+# Largest grid and number of agents the default configuration is run with:
+# every bid runs a full Dijkstra per idle agent.
+DEFAULT_MAX_SIZE = 50
+DEFAULT_MAX_AGENTS = 10
+
+TICKS = 50
+OCCUPANCY_COST = 0.1
+
+def benchmark_cases(quick=False):
+  '''
+  Returns the list of benchmark cases, dicts with the benchmark name, the
+  configuration and the grid size, and the number of agents and lam when the
+  benchmark uses them. Agents fill at most a quarter of the nodes. quick only
+  keeps grids and agent counts up to 50 and 100.
+  '''
+  sizes = [size for size in GRID_SIZES if not quick or size <= 50]
+  agent_counts = [n for n in AGENT_COUNTS if not quick or n <= 100]
+  cases = []
+  for config in CONFIGURATIONS:
+    for size in sizes:
+      if config == 'default' and size > DEFAULT_MAX_SIZE:
+        continue
+      cases.append({'benchmark': 'warehouse_init', 'config': config, 'size': size})
+      for n_agents in agent_counts:
+        if n_agents > size * (size + 1) // 4 or (config == 'default' and n_agents > DEFAULT_MAX_AGENTS):
+          continue
+        cases.append({'benchmark': 'process_task', 'config': config, 'size': size, 'n_agents': n_agents})
+        cases.append({'benchmark': 'tick', 'config': config, 'size': size, 'n_agents': n_agents})
+        for lam in LAMS:
+          cases.append({'benchmark': 'simulator_run', 'config': config, 'size': size, 'n_agents': n_agents, 'lam': lam})
+  return cases
+
+def case_id(case):
+  parts = [case['benchmark'], case['config'], '{0}x{0}'.format(case['size'])]
+  if 'n_agents' in case:
+    parts.append('a{}'.format(case['n_agents']))
+  if 'lam' in case:
+    parts.append('lam{}'.format(case['lam']))
+  return '/'.join(parts)
+
+def _manager(case, rng):
+  # Warehouse and manager with the agents at distinct random nodes
+  options = CONFIGURATIONS[case['config']]
+  w = WAREHOUSE_BACKENDS[options['backend']](case['size'], case['size'], occupancy_cost=OCCUPANCY_COST)
+  nodes = list(w.graph().nodes)
+  agent_nodes = [nodes[i] for i in draw_nodes(rng, len(nodes), case['n_agents'], replace=False).tolist()]
+  manager = WarehouseManager(w, case['n_agents'], planner=PLANNERS[options['planner']](), agent_nodes=agent_nodes, spatial_index=options['spatial_index'])
+  tasks = [nodes[i] for i in draw_nodes(rng, len(nodes), case['n_agents']).tolist()]
+  return manager, tasks
+
+def _time_warehouse_init(case, rng):
+  backend = WAREHOUSE_BACKENDS[CONFIGURATIONS[case['config']]['backend']]
+  start = time.perf_counter()
+  backend(case['size'], case['size'])
+  return time.perf_counter() - start, {'nodes/s': case['size'] * (case['size'] + 1)}
+
+def _time_process_task(case, rng):
+  # One task per agent, so every task is assigned
+  manager, tasks = _manager(case, rng)
+  start = time.perf_counter()
+  for task in tasks:
+    manager.process_task(task)
+  return time.perf_counter() - start, {'tasks/s': len(tasks)}
+
+def _time_tick(case, rng):
+  manager, tasks = _manager(case, rng)
+  for task in tasks:
+    manager.process_task(task)
+  start = time.perf_counter()
+  for i in range(0, TICKS):
+    manager.tick()
+  return time.perf_counter() - start, {'ticks/s': TICKS}
+
+def _time_simulator_run(case, rng):
+  options = CONFIGURATIONS[case['config']]
+  n_tasks = max(200, case['n_agents'])
+  start = time.perf_counter()
+  sim = Simulator(case['size'], case['size'], occupancy_cost=OCCUPANCY_COST, n_agents=case['n_agents'], n_tasks=n_tasks, lam=case['lam'],
+                  seed=int(rng.integers(0, 2 ** 31)), workload='vectorized', **options)
+  sim.run()
+  return time.perf_counter() - start, {'tasks/s': n_tasks, 'ticks/s': sim.processed_ticks()}
+
+BENCHMARKS = {
+  'warehouse_init': _time_warehouse_init,
+  'process_task': _time_process_task,
+  'tick': _time_tick,
+  'simulator_run': _time_simulator_run,
+}
+
+def run_benchmark(case, repeat=3, seed=0):
+  '''
+  Runs a benchmark case repeat times and returns the best time, the
+  throughput of each unit (units per second of the best time), the peak
+  resident memory of the process and how much it grew while running the
+  case, in MB. Run it in a fresh process so the peak belongs to the case.
+  '''
+  start_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  rng = np.random.default_rng(seed)
+  best = None
+  for i in range(0, repeat):
+    seconds, units = BENCHMARKS[case['benchmark']](case, rng)
+    best = seconds if best is None else min(best, seconds)
+  # ru_maxrss is in KB on Linux
+  peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  result = {'seconds': best, 'peak_rss_mb': peak_rss / 1024, 'rss_growth_mb': (peak_rss - start_rss) / 1024}
+  for unit, n in units.items():
+    result[unit] = n / best
+  return result
+
+def _run_benchmark(args):
+  case, repeat, seed = args
+  logging.info('Benchmark: {}'.format(case_id(case)))
+  return case_id(case), run_benchmark(case, repeat, seed)
+
+def run_benchmarks(cases, repeat=3, seed=0):
+  '''
+  Runs every case in its own worker process and returns a dict of results by
+  case id, in the order of cases.
+  '''
+  # A worker per case, so that peak memory is measured per case
+  with Pool(1, maxtasksperchild=1) as pool:
+    return dict(pool.imap(_run_benchmark, [(case, repeat, seed) for case in cases]))
+
+def compare(results, baseline, tolerance=0.2):
+  '''
+  Compares results with a baseline of the same form. Returns the list of
+  regressions as (case id, metric, baseline value, value): a throughput more
+  than tolerance below the baseline or a memory more than tolerance above it.
+  Memory growths under 1 MB are ignored.
+  '''
+  regressions = []
+  for key, result in results.items():
+    if key not in baseline:
+      continue
+    for metric, value in result.items():
+      base = baseline[key].get(metric)
+      if base is None or metric == 'seconds':
+        continue
+      if metric in ('peak_rss_mb', 'rss_growth_mb'):
+        regressed = value > base * (1 + tolerance) and value - base > 1
+      else:
+        regressed = value < base * (1 - tolerance)
+      if regressed:
+        regressions.append((key, metric, base, value))
+  return regressions
+
+def main():
+  parser = argparse.ArgumentParser(description='Benchmarks the warehouse, the manager and the simulator.')
+  parser.add_argument('--quick', action='store_true', help='Only grids up to 50x50 and up to 100 agents.')
+  parser.add_argument('--filter', default=None, help='Regular expression the case ids must match.')
+  parser.add_argument('--repeat', type=int, default=3, help='Runs of each case, the best time is kept.')
+  parser.add_argument('--seed', type=int, default=0, help='Seed of the random tasks and agent nodes.')
+  parser.add_argument('--output', default=None, help='Writes the results to this JSON file, e.g. to be used as baseline.')
+  parser.add_argument('--baseline', default=None, help='JSON file of a previous run to compare with.')
+  parser.add_argument('--tolerance', type=float, default=0.2, help='Relative change beyond which a metric regressed.')
+  args = parser.parse_args()
+
+  logging.basicConfig(level=logging.INFO)
+  cases = [case for case in benchmark_cases(args.quick) if args.filter is None or re.search(args.filter, case_id(case))]
+  results = run_benchmarks(cases, args.repeat, args.seed)
+  for key, result in results.items():
+    print('{:45s} {}'.format(key, '  '.join('{}: {:.4g}'.format(metric, value) for metric, value in result.items())))
+  if args.output is not None:
+    with open(args.output, 'w') as f:
+      json.dump(results, f, indent=2)
+
+  if args.baseline is not None:
+    with open(args.baseline) as f:
+      baseline = json.load(f)
+    regressions = compare(results, baseline, args.tolerance)
+    for key, metric, base, value in regressions:
+      print('REGRESSION {} {}: {:.4g} -> {:.4g}'.format(key, metric, base, value))
+    if regressions:
+      raise SystemExit(1)
+
+if __name__ == '__main__':
+  main()
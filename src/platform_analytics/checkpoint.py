@@ -0,0 +1,61 @@
+import os
+
+import numpy as np
+
+# Version of the layout of the snapshots, bumped when a state changes
+FORMAT_VERSION = 2
+
+def save(path, state):
+  '''
+  Writes state, a dict of NumPy arrays and scalars, to an uncompressed .npz
+  file at path. It is written to a temporary name and then renamed, so a
+  process that dies while writing leaves the previous snapshot in place.
+  '''
+  tmp = path + '.tmp'
+  with open(tmp, 'wb') as f:
+    np.savez(f, **state)
+  os.replace(tmp, path)
+
+def load(path):
+  '''
+  Returns the dict of arrays saved by save().
+  '''
+  with np.load(path) as data:
+    return {name: data[name] for name in data.files}
+
+def nest(prefix, state):
+  '''
+  Returns state with its names prefixed by prefix and a dot, so the states
+  of several objects fit in a single dict.
+  '''
+  return {'{}.{}'.format(prefix, name): value for name, value in state.items()}
+
+def section(state, prefix):
+  '''
+  Returns the entries of state nested under prefix (see nest()), without it.
+  '''
+  start = prefix + '.'
+  return {name[len(start):]: value for name, value in state.items() if name.startswith(start)}
+
+def pack(states, names):
+  '''
+  Returns a single state with the values of names of every state in states
+  concatenated, and their lengths under <name>.lengths, so a list of objects
+  is saved as a few arrays rather than a few arrays per object.
+  '''
+  packed = dict()
+  for name in names:
+    values = [np.atleast_1d(state[name]) for state in states]
+    packed[name + '.lengths'] = np.array([len(v) for v in values], dtype=np.int64)
+    packed[name] = np.concatenate(values) if values else np.zeros(0)
+  return packed
+
+def unpack(packed, names):
+  '''
+  Returns the list of states that pack() concatenated.
+  '''
+  columns = []
+  for name in names:
+    lengths = packed[name + '.lengths']
+    columns.append(np.split(packed[name], np.cumsum(lengths)[:-1]) if len(lengths) else [])
+  return [dict(zip(names, values)) for values in zip(*columns)]
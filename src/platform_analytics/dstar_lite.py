@@ -0,0 +1,178 @@
+import heapq
+
+import numpy as np
+
+from profiling import count_search
+
+class DStarLite:
+  '''
+  Incremental shortest paths to a fixed goal on a Warehouse (D* Lite, Koenig
+  and Likhachev 2002).
+
+  The search runs backwards from goal and keeps its g and rhs values between
+  calls. The edges whose cost changed in between are found with the
+  warehouse edge versions, only among the edges incident to the nodes the
+  search reached, and only the nodes whose distance to goal is affected are
+  expanded again.
+
+  The heuristic is the Manhattan distance times the edge base cost, which is
+  consistent as long as every edge costs at least its base cost.
+  '''
+  # Arrays of state(), nodes as offsets (see Warehouse.node_offset())
+  STATE = ('goal', 'start', 'version', 'km', 'g_nodes', 'g', 'rhs_nodes', 'rhs', 'heap_keys', 'heap_ties', 'heap_nodes', 'key_nodes', 'keys', 'tie')
+
+  def __init__(self, w, goal):
+    self._w = w
+    self._goal = goal
+    self._start = None
+    self._version = None
+    self._km = 0
+    self._g = dict()
+    self._rhs = {goal: 0}
+    # Lazy priority queue: only the entries matching _keys are alive
+    self._heap = []
+    self._keys = dict()
+    # Pushes so far, which break the ties of the heap in push order
+    self._tie = 0
+
+  def goal(self):
+    return self._goal
+
+  def expanded(self):
+    '''
+    Returns the number of nodes with a g value, i.e. ever expanded.
+    '''
+    return len(self._g)
+
+  def state(self):
+    '''
+    Returns the search as arrays, see from_state(). The dicts and the heap
+    keep their order, so a restored search expands the same nodes. A start
+    or version that is not set yet is -1.
+    '''
+    w = self._w
+    offsets = lambda nodes: np.array([w.node_offset(n) for n in nodes], dtype=np.int64)
+    return {
+      'goal': np.int64(w.node_offset(self._goal)),
+      'start': np.int64(w.node_offset(self._start) if self._start is not None else -1),
+      'version': np.int64(self._version if self._version is not None else -1),
+      'km': np.float64(self._km),
+      'g_nodes': offsets(self._g),
+      'g': np.array(list(self._g.values()), dtype=np.float64),
+      'rhs_nodes': offsets(self._rhs),
+      'rhs': np.array(list(self._rhs.values()), dtype=np.float64),
+      'heap_keys': np.array([key for key, _, _ in self._heap], dtype=np.float64).reshape(-1),
+      'heap_ties': np.array([tie for _, tie, _ in self._heap], dtype=np.int64),
+      'heap_nodes': offsets(n for _, _, n in self._heap),
+      'key_nodes': offsets(self._keys),
+      'keys': np.array(list(self._keys.values()), dtype=np.float64).reshape(-1),
+      'tie': np.int64(self._tie),
+    }
+
+  def from_state(w, state):
+    '''
+    Returns the DStarLite search of Warehouse w saved by state().
+    '''
+    nodes = lambda offsets: [w.node_from_offset(o) for o in offsets.tolist()]
+    search = DStarLite(w, w.node_from_offset(state['goal'].item()))
+    start = state['start'].item()
+    search._start = w.node_from_offset(start) if start >= 0 else None
+    version = state['version'].item()
+    search._version = version if version >= 0 else None
+    search._km = state['km'].item()
+    search._g = dict(zip(nodes(state['g_nodes']), state['g'].tolist()))
+    search._rhs = dict(zip(nodes(state['rhs_nodes']), state['rhs'].tolist()))
+    heap_keys = [tuple(key) for key in state['heap_keys'].reshape(-1, 2).tolist()]
+    search._heap = list(zip(heap_keys, state['heap_ties'].tolist(), nodes(state['heap_nodes'])))
+    search._keys = dict(zip(nodes(state['key_nodes']), [tuple(key) for key in state['keys'].reshape(-1, 2).tolist()]))
+    search._tie = state['tie'].item()
+    return search
+
+  def plan(self, start):
+    '''
+    Returns the path (without start) and the cost of going from start to the
+    goal given the current edge costs.
+    '''
+    if self._start is None:
+      self._start = start
+      self._push(self._goal)
+    else:
+      self._km += self._h(self._start, start)
+      self._start = start
+      # A node the search never reached has no neighbor with a g value, so
+      # its rhs stays infinite whatever the edge costs
+      for edge in self._w.changed_edges(self._rhs, self._version):
+        for n in edge:
+          if n in self._rhs:
+            self._update_node(n)
+    self._compute_shortest_path()
+    self._version = self._w.version()
+
+    path = []
+    n = start
+    while n != self._goal:
+      n = min(self._w.neighbors(n), key=lambda m: self._w.get_edge_cost(n, m) + self._g.get(m, float('inf')))
+      path.append(n)
+    return path, self._g.get(start, self._rhs.get(start))
+
+  def _h(self, n_i, n_j):
+    return self._w.edge_base_cost() * self._w.manhattan_distance(n_i, n_j)
+
+  def _key(self, n):
+    k = min(self._g.get(n, float('inf')), self._rhs.get(n, float('inf')))
+    return (k + self._h(self._start, n) + self._km, k)
+
+  def _push(self, n):
+    key = self._key(n)
+    self._keys[n] = key
+    heapq.heappush(self._heap, (key, self._tie, n))
+    self._tie += 1
+
+  def _top(self):
+    # Drops the stale entries
+    while self._heap and self._keys.get(self._heap[0][2]) != self._heap[0][0]:
+      heapq.heappop(self._heap)
+    return self._heap[0] if self._heap else None
+
+  def _update_node(self, n):
+    if n != self._goal:
+      self._rhs[n] = min(self._w.get_edge_cost(n, m) + self._g.get(m, float('inf')) for m in self._w.neighbors(n))
+    self._keys.pop(n, None)
+    if self._g.get(n, float('inf')) != self._rhs.get(n, float('inf')):
+      self._push(n)
+
+  def _compute_shortest_path(self):
+    inf = float('inf')
+    expanded = 0
+    while True:
+      top = self._top()
+      if top is None:
+        break
+      start_key = self._key(self._start)
+      if top[0] >= start_key and self._rhs.get(self._start, inf) == self._g.get(self._start, inf):
+        break
+      key, _, n = top
+      new_key = self._key(n)
+      if key < new_key:
+        self._push(n)
+        continue
+      heapq.heappop(self._heap)
+      expanded += 1
+      del self._keys[n]
+      g = self._g.get(n, inf)
+      rhs = self._rhs.get(n, inf)
+      if g > rhs:
+        self._g[n] = rhs
+        for m in self._w.neighbors(n):
+          if m != self._goal:
+            c = rhs + self._w.get_edge_cost(m, n)
+            if c < self._rhs.get(m, inf):
+              self._rhs[m] = c
+            self._keys.pop(m, None)
+            if self._g.get(m, inf) != self._rhs.get(m, inf):
+              self._push(m)
+      else:
+        self._g[n] = inf
+        for m in list(self._w.neighbors(n)) + [n]:
+          self._update_node(m)
+    count_search('dstar_lite', expanded)
@@ -0,0 +1,208 @@
+import argparse
+from collections import Counter
+
+import numpy as np
+
+# Fixed size binary record of an event. agent is an AgentPool index and node a
+# node offset (see Warehouse.node_offset()), -1 when the event has none.
+RECORD = np.dtype([('tick', '<i8'), ('event', 'u1'), ('agent', '<i4'), ('node', '<i4'), ('cost', '<f8')])
+
+# Event types, by their code in the records
+EVENTS = (
+  'arrival',        # Tasks arrived at node, cost is how many
+  'assign',         # agent won the task at node with a bid of cost
+  'no_idle_agent',  # The task at node waits: every agent is busy
+  'node_full',      # The task at node waits: its node is full
+  'unreachable',    # The task at node waits: no idle agent can reach it
+  'finish',         # agent is idle at node, cost is the completion time
+  'tick',           # cost is the flow cost of the tick
+  'reroute',        # agent was rerouted to node, cost is its new path cost
+)
+ARRIVAL, ASSIGN, NO_IDLE_AGENT, NODE_FULL, UNREACHABLE, FINISH, TICK, REROUTE = range(len(EVENTS))
+
+# Header of a trace file: magic, version, capacity and number of records ever
+# written, as int64
+_MAGIC = 0x45434152545645
+_VERSION = 1
+_HEADER = 4
+
+class EventTrace:
+  '''
+  Trace of the events of a run in a preallocated ring buffer of capacity
+  fixed size binary records (see RECORD), so a record is a handful of stores
+  and no string is formatted while the run goes on. Once full, the oldest
+  records are overwritten.
+
+  When path is given the buffer is a memory-mapped file, with a header that
+  counts the records, so it can be decoded even when the process died before
+  closing it. EventTrace.open() reads it back and decode() or replay() make
+  sense of the records.
+  '''
+  def __init__(self, capacity=1 << 20, path=None):
+    if capacity <= 0:
+      raise ValueError('A trace needs room for some records: {}'.format(capacity))
+    self._path = path
+    if path is None:
+      self._header = np.zeros(_HEADER, dtype=np.int64)
+      self._records = np.zeros(capacity, dtype=RECORD)
+    else:
+      self._header = np.memmap(path, dtype=np.int64, mode='w+', shape=(_HEADER,))
+      self._records = np.memmap(path, dtype=RECORD, mode='r+', offset=_HEADER * 8, shape=(capacity,))
+    self._header[:] = (_MAGIC, _VERSION, capacity, 0)
+    self._capacity = capacity
+    self._n = 0
+
+  def open(path):
+    '''
+    Returns the read-only EventTrace of a trace file.
+    '''
+    header = np.fromfile(path, dtype=np.int64, count=_HEADER)
+    if len(header) < _HEADER or header[0] != _MAGIC:
+      raise ValueError('Not a trace file: {}'.format(path))
+    if header[1] != _VERSION:
+      raise ValueError('Unknown trace version {} in {}'.format(header[1], path))
+    trace = EventTrace.__new__(EventTrace)
+    trace._path = path
+    trace._header = header
+    trace._capacity = int(header[2])
+    trace._records = np.memmap(path, dtype=RECORD, mode='r', offset=_HEADER * 8, shape=(trace._capacity,))
+    trace._n = int(header[3])
+    return trace
+
+  def record(self, tick, event, agent=-1, node=-1, cost=0.):
+    self._records[self._n % self._capacity] = (tick, event, agent, node, cost)
+    self._n += 1
+    self._header[3] = self._n
+
+  def __len__(self):
+    '''
+    Returns the number of records kept.
+    '''
+    return min(self._n, self._capacity)
+
+  def capacity(self):
+    return self._capacity
+
+  def total(self):
+    '''
+    Returns the number of records ever written, kept or overwritten.
+    '''
+    return self._n
+
+  def dropped(self):
+    return self._n - len(self)
+
+  def records(self):
+    '''
+    Returns a copy of the records kept, from the oldest to the newest.
+    '''
+    if self._n <= self._capacity:
+      return np.array(self._records[:self._n])
+    start = self._n % self._capacity
+    return np.concatenate((self._records[start:], self._records[:start]))
+
+  def state(self):
+    '''
+    Returns the ring buffer as is and the number of records ever written, see
+    load_state().
+    '''
+    return {'records': self._records[:len(self)], 'n': np.int64(self._n)}
+
+  def load_state(self, state):
+    '''
+    Restores a state() of a trace of the same capacity.
+    '''
+    if len(state['records']) > self._capacity:
+      raise ValueError('State of {} records for a trace of {}'.format(len(state['records']), self._capacity))
+    self._records[:len(state['records'])] = state['records']
+    self._n = state['n'].item()
+    self._header[3] = self._n
+
+  def flush(self):
+    if self._path is not None and isinstance(self._records, np.memmap) and self._records.mode != 'r':
+      self._header.flush()
+      self._records.flush()
+
+  def save(self, path):
+    '''
+    Writes the records kept to a trace file.
+    '''
+    records = self.records()
+    saved = EventTrace(max(len(records), 1), path)
+    saved._records[:len(records)] = records
+    saved._n = len(records)
+    saved._header[3] = saved._n
+    saved.flush()
+
+def decode(records, cols=None, names=None):
+  '''
+  Yields the records as dicts with the event name. When cols (the columns of
+  nodes, see Warehouse.shape()) is given, nodes are (row, col) tuples, and
+  when names (a function of the agent index, like AgentPool.name()) is given,
+  agents are names.
+  '''
+  for tick, event, agent, node, cost in records.tolist():
+    yield {
+      'tick': tick,
+      'event': EVENTS[event],
+      'agent': agent if agent < 0 or names is None else names(agent),
+      'node': node if node < 0 or cols is None else divmod(node, cols),
+      'cost': cost,
+    }
+
+def replay(records):
+  '''
+  Rebuilds the outcome of a run from its records: the utilitarian cost (the
+  sum of the tick costs), the number of ticks and of each event, and the tasks
+  and busy ticks of every agent. It only matches the run when no record was
+  dropped.
+  '''
+  events = Counter(EVENTS[e] for e in records['event'].tolist())
+  ticks = records[records['event'] == TICK]
+  agents = dict()
+  assign_ticks = dict()
+  for tick, event, agent in zip(records['tick'].tolist(), records['event'].tolist(), records['agent'].tolist()):
+    if event == ASSIGN:
+      agents.setdefault(agent, {'tasks': 0, 'busy_ticks': 0})['tasks'] += 1
+      assign_ticks[agent] = tick
+    elif event == FINISH and agent in assign_ticks:
+      # The agent completed the task on tick
+      agents[agent]['busy_ticks'] += tick + 1 - assign_ticks.pop(agent)
+  completions = records['cost'][records['event'] == FINISH]
+  return {
+    'cost': float(ticks['cost'].sum()),
+    'ticks': len(ticks),
+    'events': dict(events),
+    'average_completion_time': float(completions.mean()) if len(completions) else None,
+    'agents': dict(sorted(agents.items())),
+  }
+
+def main():
+  parser = argparse.ArgumentParser(description='Decodes a trace file of a simulation.')
+  parser.add_argument('path', help='Trace file.')
+  parser.add_argument('--cols', type=int, default=None, help='Columns of nodes of the warehouse (cols + 1), to print nodes as (row, col).')
+  parser.add_argument('--event', action='append', default=None, help='Only print events of this type, can be repeated.')
+  parser.add_argument('--agent', type=int, default=None, help='Only print events of this agent index.')
+  parser.add_argument('--ticks', type=int, nargs=2, default=None, help='Only print events between these ticks, both included.')
+  parser.add_argument('--replay', action='store_true', help='Print what replay() rebuilds instead of the events.')
+  args = parser.parse_args()
+
+  trace = EventTrace.open(args.path)
+  records = trace.records()
+  print('{} records, {} dropped'.format(len(trace), trace.dropped()))
+  if args.replay:
+    for name, value in replay(records).items():
+      print('{}: {}'.format(name, value))
+    return
+  keep = np.ones(len(records), dtype=bool)
+  if args.event is not None:
+    keep &= np.isin(records['event'], [EVENTS.index(e) for e in args.event])
+  if args.agent is not None:
+    keep &= records['agent'] == args.agent
+  if args.ticks is not None:
+    keep &= (records['tick'] >= args.ticks[0]) & (records['tick'] <= args.ticks[1])
+  for e in decode(records[keep], args.cols):
+    print('{tick:>8} {event:<14} agent={agent} node={node} cost={cost:g}'.format(**e))
+
+if __name__ == '__main__':
+  main()
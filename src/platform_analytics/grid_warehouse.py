@@ -0,0 +1,387 @@
+import networkx as nx
+import numpy as np
+
+class GridWarehouse:
+  '''
+  Builds and holds a grid graph backed by contiguous arrays.
+
+  It offers the same interface as Warehouse but nodes are integers
+  (row * (cols + 1) + col), the adjacency is kept in CSR form and the edge
+  weight, edge occupancy and node capacity live in NumPy arrays.
+
+  As in Warehouse, the set of occupied edge ids, the flow cost and the edge
+  versions are kept up to date on every occupancy change.
+
+  Edges are numbered as follows:
+  - Row edges first: row * cols + col joins (row, col) with (row, col + 1).
+  - Column edges next: rows * cols + row * (cols + 1) + col joins (row, col)
+    with (row + 1, col).
+  '''
+  def __init__(self, rows, cols, node_capacity=-1, edge_base_cost=1., occupancy_cost=0.):
+    self._rows = rows
+    self._cols = cols
+    self._row_size = cols + 1
+    self._n_nodes = rows * self._row_size
+    self._n_row_edges = rows * cols
+    self._edge_base_cost = edge_base_cost
+    self._occupancy_cost = occupancy_cost
+
+    # Edge end points, row edges first and then column edges
+    node_ids = np.arange(self._n_nodes, dtype=np.int64).reshape(rows, self._row_size)
+    row_u = node_ids[:, :-1].ravel()
+    col_u = node_ids[:-1, :].ravel()
+    self._edge_u = np.concatenate((row_u, col_u))
+    self._edge_v = np.concatenate((row_u + 1, col_u + self._row_size))
+    n_edges = len(self._edge_u)
+
+    self._weight = np.full(n_edges, edge_base_cost, dtype=np.float64)
+    self._occupancy = np.zeros(n_edges, dtype=np.int64)
+    self._capacity = np.full(self._n_nodes, node_capacity, dtype=np.int64)
+    self._available_capacity = self._capacity.copy()
+    self._occupied_edges = set()
+    self._occupied_weight = 0.
+    self._total_occupancy = 0
+    self._version = 0
+    self._edge_version = np.zeros(n_edges, dtype=np.int64)
+
+    # CSR adjacency: neighbors of n are _indices[_indptr[n]:_indptr[n+1]] and
+    # the edges that join them are in _edge_index at the same positions. They
+    # are sorted by edge id, which is the order Warehouse adds the edges to its
+    # graph, so both list neighbors alike (left, right, up, down) and searches
+    # break ties the same way.
+    heads = np.concatenate((self._edge_u, self._edge_v))
+    tails = np.concatenate((self._edge_v, self._edge_u))
+    edges = np.concatenate((np.arange(n_edges), np.arange(n_edges)))
+    order = np.lexsort((edges, heads))
+    self._indices = tails[order]
+    self._edge_index = edges[order]
+    self._indptr = np.zeros(self._n_nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(heads, minlength=self._n_nodes), out=self._indptr[1:])
+
+    self._graph = None
+
+  def graph(self):
+    '''
+    Returns a networkx view of the topology. It is built once on demand and
+    holds no edge attributes: costs must be queried with get_edge_cost().
+    '''
+    if self._graph is None:
+      self._graph = nx.Graph()
+      self._graph.add_nodes_from(range(self._n_nodes))
+      self._graph.add_edges_from(zip(self._edge_u.tolist(), self._edge_v.tolist()))
+    return self._graph
+
+  def shape(self):
+    '''
+    Returns the number of rows and columns of nodes: (rows, cols + 1)
+    '''
+    return (self._rows, self._row_size)
+
+  def node_id(self, row, col):
+    '''
+    Returns the node id of (row, col).
+    '''
+    return row * self._row_size + col
+
+  def node_index(self, n):
+    '''
+    Returns a tuple from a node id: (row, col)
+    '''
+    return divmod(n, self._row_size)
+
+  def edge_base_cost(self):
+    return self._edge_base_cost
+
+  def occupancy_cost(self):
+    return self._occupancy_cost
+
+  def manhattan_distance(self, n_i, n_j):
+    '''
+    Returns the number of hops between two nodes of the grid.
+    '''
+    r_i, c_i = divmod(n_i, self._row_size)
+    r_j, c_j = divmod(n_j, self._row_size)
+    return abs(r_i - r_j) + abs(c_i - c_j)
+
+  def node_offset(self, n):
+    '''
+    Returns a dense integer index of the node, i.e. the node itself. It is
+    the same as Warehouse.node_offset().
+    '''
+    return n
+
+  def node_from_offset(self, offset):
+    '''
+    Returns the node whose offset is offset, i.e. the offset itself.
+    '''
+    return offset
+
+  def edge_offset(self, n_i, n_j):
+    '''
+    Returns a dense integer index of the edge as Warehouse.edge_offset()
+    does. Use edge_id() to index the edge arrays.
+    '''
+    a, b = (n_i, n_j) if n_i < n_j else (n_j, n_i)
+    return 2 * a + (0 if b - a == 1 else 1)
+
+  def edge_id(self, n_i, n_j):
+    '''
+    Returns the id of the edge that joins n_i and n_j. Raises KeyError when
+    the nodes are not adjacent.
+    '''
+    a, b = (n_i, n_j) if n_i < n_j else (n_j, n_i)
+    if a >= 0 and b < self._n_nodes:
+      if b - a == self._row_size:
+        return self._n_row_edges + a
+      if b - a == 1 and b % self._row_size != 0:
+        return a - a // self._row_size
+    raise KeyError('There is no edge between {} and {}'.format(n_i, n_j))
+
+  def edge_ids(self, us, vs):
+    '''
+    Vectorized edge_id() over two arrays of end points.
+    '''
+    us = np.asarray(us, dtype=np.int64)
+    vs = np.asarray(vs, dtype=np.int64)
+    a = np.minimum(us, vs)
+    b = np.maximum(us, vs)
+    is_col = (b - a) == self._row_size
+    is_row = ~is_col & ((b - a) == 1) & (b % self._row_size != 0)
+    if not np.all((is_col | is_row) & (a >= 0) & (b < self._n_nodes)):
+      raise KeyError('Some of the node pairs are not adjacent')
+    return np.where(is_col, self._n_row_edges + a, a - a // self._row_size)
+
+  def neighbors(self, n):
+    '''
+    Returns the list of adjacent nodes of n.
+    '''
+    return self._indices[self._indptr.item(n):self._indptr.item(n+1)].tolist()
+
+  def node_capacity(self, n):
+    '''
+    Returns the node capacity.
+    '''
+    return int(self._available_capacity[n])
+
+  def clear_edges_occupancy(self):
+    '''
+    Clears the occupancy of all edges.
+    '''
+    self._version += 1
+    self._edge_version[self._occupancy > 0] = self._version
+    self._occupancy.fill(0)
+    self._occupied_edges.clear()
+    self._occupied_weight = 0.
+    self._total_occupancy = 0
+
+  def increase_edge_occupancy(self, edge):
+    '''
+    Increases by 1 the occupancy of an edge.
+    '''
+    e = self.edge_id(*edge)
+    self._occupancy[e] += 1
+    self._total_occupancy += 1
+    self._stamp(e)
+    if self._occupancy.item(e) == 1:
+      self._occupied_edges.add(e)
+      self._occupied_weight += self._weight.item(e)
+
+  def decrease_edge_occupancy(self, edge):
+    '''
+    Decreases by 1 the occupancy of an edge.
+    '''
+    e = self.edge_id(*edge)
+    if self._occupancy.item(e) == 0:
+      return
+    self._occupancy[e] -= 1
+    self._total_occupancy -= 1
+    self._stamp(e)
+    if self._occupancy.item(e) == 0:
+      self._occupied_edges.discard(e)
+      # Resets the accumulator when possible so it does not drift
+      self._occupied_weight = self._occupied_weight - self._weight.item(e) if self._occupied_edges else 0.
+
+  def update_edges_occupancy(self, us, vs, delta):
+    '''
+    Vectorized increase_edge_occupancy() (delta = 1) or
+    decrease_edge_occupancy() (delta = -1) over the edges joining us[k] and
+    vs[k].
+    '''
+    if len(us) == 0:
+      return
+    edges, counts = np.unique(self.edge_ids(us, vs), return_counts=True)
+    before = self._occupancy[edges]
+    if delta < 0:
+      counts = np.minimum(counts, before)
+    after = before + delta * counts
+    self._occupancy[edges] = after
+    self._total_occupancy += delta * int(counts.sum())
+    if self._occupancy_cost != 0:
+      self._version += 1
+      self._edge_version[edges[counts > 0]] = self._version
+    opened = edges[(before == 0) & (after > 0)]
+    closed = edges[(before > 0) & (after == 0)]
+    self._occupied_edges.update(opened.tolist())
+    self._occupied_edges.difference_update(closed.tolist())
+    self._occupied_weight += float(self._weight[opened].sum() - self._weight[closed].sum())
+    if not self._occupied_edges:
+      self._occupied_weight = 0.
+
+  def version(self):
+    '''
+    Returns a counter that increases every time an edge cost changes.
+    '''
+    return self._version
+
+  def edge_key(self, n_i, n_j):
+    '''
+    Returns a hashable key of the edge that does not depend on its direction,
+    i.e. its id.
+    '''
+    return self.edge_id(n_i, n_j)
+
+  def edge_key_offsets(self, keys):
+    '''
+    Returns an array with the offsets (see edge_offset()) of the edges whose
+    keys (see edge_key()) are keys.
+    '''
+    keys = np.asarray(keys, dtype=np.int64)
+    return 2 * self._edge_u[keys] + (self._edge_v[keys] - self._edge_u[keys] != 1)
+
+  def edge_keys_from_offsets(self, offsets):
+    '''
+    Returns the keys of the edges whose offsets are offsets, as an array.
+    '''
+    a, kind = np.divmod(np.asarray(offsets, dtype=np.int64), 2)
+    return self.edge_ids(a, a + np.where(kind == 0, 1, self._row_size))
+
+  def incident_edges(self, nodes):
+    '''
+    Returns an array with the ids of all the edges incident to nodes.
+    '''
+    nodes = np.fromiter(nodes, dtype=np.int64)
+    starts = self._indptr[nodes]
+    lengths = self._indptr[nodes + 1] - starts
+    offsets = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+    return self._edge_index[np.arange(lengths.sum()) + offsets]
+
+  def edges_changed_since(self, edges, version):
+    '''
+    Returns True when the cost of any of the edges (given as ids) changed after
+    version.
+    '''
+    return bool(np.any(self._edge_version[edges] > version))
+
+  def changed_edges(self, nodes, version):
+    '''
+    Returns the end points of the edges incident to nodes whose cost changed
+    after version.
+    '''
+    edges = self.incident_edges(nodes)
+    edges = np.unique(edges[self._edge_version[edges] > version])
+    return list(zip(self._edge_u[edges].tolist(), self._edge_v[edges].tolist()))
+
+  def _stamp(self, e):
+    # Occupancy only changes the cost when it is priced
+    if self._occupancy_cost != 0:
+      self._version += 1
+      self._edge_version[e] = self._version
+
+  def occupied_edges(self):
+    '''
+    Returns the set of ids of the edges with at least one agent.
+    '''
+    return self._occupied_edges
+
+  def flow_cost(self):
+    '''
+    Returns the sum of the cost of all the occupied edges.
+    '''
+    return self._occupied_weight + self._occupancy_cost * self._total_occupancy
+
+  def edge_occupancy(self, n_i, n_j):
+    '''
+    Returns the number of agents traversing the edge.
+    '''
+    return self._occupancy.item(self.edge_id(n_i, n_j))
+
+  def edge_occupancies(self):
+    '''
+    Returns an array with the occupancy of every edge, indexed by edge offset
+    (see edge_offset()) rather than by edge id.
+    '''
+    occupancy = np.zeros(2 * self._n_nodes, dtype=np.int64)
+    # _edge_u < _edge_v and row edges join consecutive nodes
+    occupancy[2 * self._edge_u + (self._edge_v - self._edge_u != 1)] = self._occupancy
+    return occupancy
+
+  def state(self):
+    '''
+    Returns the edge occupancy and versions and the running flow cost terms,
+    see load_state().
+    '''
+    return {
+      'occupancy': self._occupancy,
+      'edge_version': self._edge_version,
+      'version': np.int64(self._version),
+      'occupied_weight': np.float64(self._occupied_weight),
+      'total_occupancy': np.int64(self._total_occupancy),
+    }
+
+  def load_state(self, state):
+    '''
+    Restores a state() of a warehouse of the same shape.
+    '''
+    if len(state['occupancy']) != len(self._occupancy):
+      raise ValueError('State of {} edges for a warehouse of {}'.format(len(state['occupancy']), len(self._occupancy)))
+    self._occupancy[:] = state['occupancy']
+    self._edge_version[:] = state['edge_version']
+    self._version = state['version'].item()
+    # Restored as is rather than summed again, so the costs keep their bits
+    self._occupied_weight = state['occupied_weight'].item()
+    self._total_occupancy = state['total_occupancy'].item()
+    self._occupied_edges = set(np.flatnonzero(self._occupancy).tolist())
+
+  def edge_costs(self):
+    '''
+    Returns an array with the current cost of every edge, indexed by edge id.
+    '''
+    return self._weight + self._occupancy_cost * self._occupancy
+
+  def path_cost(self, path):
+    '''
+    Returns the cost of traversing path which is given as a list of adjacent
+    nodes taken in pairs.
+    '''
+    if len(path) < 2:
+      return 0
+    e = self.edge_ids(path[:-1], path[1:])
+    return float(np.sum(self._weight[e] + self._occupancy_cost * self._occupancy[e]))
+
+  def plot(self, path=None):
+    '''
+    Plots the warehouse, see visualization.plot().
+    '''
+    # Imported here so the simulation does not depend on matplotlib
+    import visualization
+    visualization.plot(self, path)
+
+  def get_edge_cost_at(self, n_i, n_j, occupancy):
+    '''
+    Returns the edge cost if it had occupancy agents traversing it.
+    '''
+    return self._weight.item(self.edge_id(n_i, n_j)) + self._occupancy_cost * occupancy
+
+  def get_edge_cost(self, n_i, n_j):
+    '''
+    Returns the edge cost based on its occupancy
+    '''
+    e = self.edge_id(n_i, n_j)
+    return self._weight.item(e) + self._occupancy_cost * self._occupancy.item(e)
+
+if __name__ == "__main__":
+  ROWS=4
+  COLS=8
+  NODE_CAPACITY=2
+  w = GridWarehouse(ROWS, COLS, NODE_CAPACITY)
+  w.plot()
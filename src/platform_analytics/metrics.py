@@ -0,0 +1,310 @@
+import copy
+
+import numpy as np
+
+import checkpoint
+
+class LogHistogram:
+  '''
+  Histogram of non-negative integers with log-linear buckets, as HDR
+  histograms do.
+
+  Values below 2 ** sub_bits have a bucket each. Larger values share buckets
+  that keep their sub_bits most significant bits, so percentiles have a
+  relative error below 2 ** -(sub_bits - 1) whatever the range. Memory is a
+  fixed array of counts, so it is bounded on runs of any length, and two
+  histograms with the same sub_bits merge by adding their counts.
+  '''
+  def __init__(self, sub_bits=7):
+    self._sub_bits = sub_bits
+    self._half = 1 << (sub_bits - 1)
+    # Values up to 2 ** 63 - 1
+    self._counts = np.zeros((65 - sub_bits) * self._half + self._half, dtype=np.int64)
+    self._n = 0
+    self._sum = 0
+    self._min = None
+    self._max = None
+
+  def record(self, value, count=1):
+    '''
+    Adds count samples of value.
+    '''
+    if value < 0:
+      raise ValueError('Negative values cannot be recorded: {}'.format(value))
+    self._counts[self._bucket(value)] += count
+    self._n += count
+    self._sum += value * count
+    self._min = value if self._min is None else min(self._min, value)
+    self._max = value if self._max is None else max(self._max, value)
+
+  def merge(self, other):
+    '''
+    Adds the samples of other, a LogHistogram with the same sub_bits.
+    '''
+    if other._sub_bits != self._sub_bits:
+      raise ValueError('Histograms of {} and {} sub bits cannot be merged'.format(self._sub_bits, other._sub_bits))
+    self._counts += other._counts
+    self._n += other._n
+    self._sum += other._sum
+    for value in (other._min, other._max):
+      if value is not None:
+        self._min = value if self._min is None else min(self._min, value)
+        self._max = value if self._max is None else max(self._max, value)
+    return self
+
+  def count(self):
+    return self._n
+
+  def state(self):
+    '''
+    Returns the counts and running statistics, see load_state(). Missing
+    min and max are -1.
+    '''
+    return {
+      'counts': self._counts,
+      'n': np.int64(self._n),
+      'sum': np.int64(self._sum),
+      'min': np.int64(self._min if self._min is not None else -1),
+      'max': np.int64(self._max if self._max is not None else -1),
+    }
+
+  def load_state(self, state):
+    '''
+    Restores a state() of a histogram with the same sub_bits.
+    '''
+    if len(state['counts']) != len(self._counts):
+      raise ValueError('State of {} buckets for a histogram of {}'.format(len(state['counts']), len(self._counts)))
+    self._counts[:] = state['counts']
+    self._n = state['n'].item()
+    self._sum = state['sum'].item()
+    self._min = state['min'].item() if self._n else None
+    self._max = state['max'].item() if self._n else None
+
+  def mean(self):
+    return self._sum / self._n if self._n else None
+
+  def min(self):
+    return self._min
+
+  def max(self):
+    return self._max
+
+  def percentile(self, q):
+    '''
+    Returns the value below which a fraction q of the samples fall, as the
+    middle of its bucket, or None when there are no samples.
+    '''
+    if self._n == 0:
+      return None
+    rank = max(1, int(np.ceil(q * self._n)))
+    b = int(np.searchsorted(np.cumsum(self._counts), rank))
+    low, high = self._bounds(b)
+    return min(max((low + high) / 2, self._min), self._max)
+
+  def _bucket(self, value):
+    value = int(value)
+    e = value.bit_length() - self._sub_bits
+    if e <= 0:
+      return value
+    return e * self._half + (value >> e)
+
+  def _bounds(self, b):
+    # Lowest and highest values of bucket b
+    if b < 2 * self._half:
+      return b, b
+    e = b // self._half - 1
+    mantissa = b - e * self._half
+    return mantissa << e, ((mantissa + 1) << e) - 1
+
+class ThroughputSeries:
+  '''
+  Number of events per tick in consecutive buckets of ticks.
+
+  There are at most max_buckets buckets: when a tick falls beyond them, the
+  bucket width doubles and pairs of buckets are added up, so memory is
+  bounded on runs of any length. Series merge by widening the finer one and
+  count the runs they hold, so rates are per run: merging replications
+  averages their throughput rather than adding it up.
+  '''
+  def __init__(self, max_buckets=1024):
+    if max_buckets % 2 != 0:
+      raise ValueError('The number of buckets must be even: {}'.format(max_buckets))
+    self._width = 1
+    self._counts = np.zeros(max_buckets, dtype=np.int64)
+    self._last_tick = -1
+    self._runs = 1
+
+  def record(self, tick, count=1):
+    '''
+    Adds count events on tick.
+    '''
+    while tick // self._width >= len(self._counts):
+      self._widen()
+    self._counts[tick // self._width] += count
+    self._last_tick = max(self._last_tick, tick)
+
+  def merge(self, other):
+    '''
+    Adds the events of other, a ThroughputSeries with as many buckets.
+    '''
+    if len(other._counts) != len(self._counts):
+      raise ValueError('Series of {} and {} buckets cannot be merged'.format(len(self._counts), len(other._counts)))
+    while self._width < other._width:
+      self._widen()
+    counts = other._counts
+    width = other._width
+    while width < self._width:
+      counts = np.concatenate((counts.reshape(-1, 2).sum(axis=1), np.zeros(len(counts) // 2, dtype=np.int64)))
+      width *= 2
+    self._counts += counts
+    self._last_tick = max(self._last_tick, other._last_tick)
+    self._runs += other._runs
+    return self
+
+  def total(self):
+    '''
+    Returns the number of events of all the runs.
+    '''
+    return int(self._counts.sum())
+
+  def runs(self):
+    '''
+    Returns the number of runs merged in the series.
+    '''
+    return self._runs
+
+  def state(self):
+    '''
+    Returns the bucket width, counts and last tick, see load_state().
+    '''
+    return {'width': np.int64(self._width), 'counts': self._counts, 'last_tick': np.int64(self._last_tick), 'runs': np.int64(self._runs)}
+
+  def load_state(self, state):
+    '''
+    Restores a state() of a series with as many buckets.
+    '''
+    if len(state['counts']) != len(self._counts):
+      raise ValueError('State of {} buckets for a series of {}'.format(len(state['counts']), len(self._counts)))
+    self._width = state['width'].item()
+    self._counts[:] = state['counts']
+    self._last_tick = state['last_tick'].item()
+    self._runs = state['runs'].item()
+
+  def ticks(self):
+    '''
+    Returns the number of ticks up to the last recorded one.
+    '''
+    return self._last_tick + 1
+
+  def width(self):
+    '''
+    Returns the number of ticks of each bucket.
+    '''
+    return self._width
+
+  def rates(self):
+    '''
+    Returns two arrays: the first tick of each bucket up to the last recorded
+    tick and its number of events per tick and run.
+    '''
+    n = self._last_tick // self._width + 1
+    return np.arange(n) * self._width, self._counts[:n] / (self._width * self._runs)
+
+  def _widen(self):
+    self._counts = np.concatenate((self._counts.reshape(-1, 2).sum(axis=1), np.zeros(len(self._counts) // 2, dtype=np.int64)))
+    self._width *= 2
+
+class Metrics:
+  '''
+  Streaming metrics of a run, all in bounded memory and mergeable across
+  replications:
+  - wait_time: ticks from the arrival of a task to its assignment.
+  - completion_time: ticks from the arrival of a task to the tick its agent is
+    idle again.
+  - throughput: tasks completed on each tick.
+  '''
+  PERCENTILES = (0.5, 0.9, 0.99)
+
+  def __init__(self, sub_bits=7, max_buckets=1024):
+    self._wait_time = LogHistogram(sub_bits)
+    self._completion_time = LogHistogram(sub_bits)
+    self._throughput = ThroughputSeries(max_buckets)
+
+  def wait_time(self):
+    return self._wait_time
+
+  def completion_time(self):
+    return self._completion_time
+
+  def throughput(self):
+    return self._throughput
+
+  def record_assignment(self, wait):
+    self._wait_time.record(wait)
+
+  def record_completion(self, completion, tick):
+    self._completion_time.record(completion)
+    self._throughput.record(tick)
+
+  def merge(self, other):
+    '''
+    Adds the samples of other, which must have the same resolution.
+    '''
+    self._wait_time.merge(other._wait_time)
+    self._completion_time.merge(other._completion_time)
+    self._throughput.merge(other._throughput)
+    return self
+
+  def state(self):
+    '''
+    Returns the states of the histograms and the series, see load_state().
+    '''
+    state = checkpoint.nest('wait_time', self._wait_time.state())
+    state.update(checkpoint.nest('completion_time', self._completion_time.state()))
+    state.update(checkpoint.nest('throughput', self._throughput.state()))
+    return state
+
+  def load_state(self, state):
+    '''
+    Restores a state() of Metrics with the same resolution.
+    '''
+    self._wait_time.load_state(checkpoint.section(state, 'wait_time'))
+    self._completion_time.load_state(checkpoint.section(state, 'completion_time'))
+    self._throughput.load_state(checkpoint.section(state, 'throughput'))
+
+  def summary(self):
+    '''
+    Returns a flat dict with the mean, max and percentiles of the wait and
+    completion times, and the mean and peak throughput.
+    '''
+    result = dict()
+    for name, histogram in (('wait_time', self._wait_time), ('completion_time', self._completion_time)):
+      result[name + '_mean'] = histogram.mean()
+      result[name + '_max'] = histogram.max()
+      for q in Metrics.PERCENTILES:
+        result['{}_p{}'.format(name, int(q * 100))] = histogram.percentile(q)
+    _, rates = self._throughput.rates()
+    result['throughput_mean'] = self._throughput.total() / (self._throughput.ticks() * self._throughput.runs()) if len(rates) else None
+    result['throughput_max'] = float(rates.max()) if len(rates) else None
+    return result
+
+def merge_metrics(metrics):
+  '''
+  Returns a new Metrics with the samples of all the given ones.
+  '''
+  metrics = list(metrics)
+  merged = copy.deepcopy(metrics[0])
+  for m in metrics[1:]:
+    merged.merge(m)
+  return merged
+
+if __name__ == '__main__':
+  # Merging identical replications leaves their statistics unchanged
+  metrics = Metrics()
+  for tick, completion in enumerate([3, 5, 5, 8, 13, 2, 0, 7]):
+    metrics.record_assignment(completion // 2)
+    metrics.record_completion(completion, 2 * tick)
+  merged = merge_metrics([metrics] * 4)
+  assert merged.throughput().runs() == 4
+  assert merged.summary() == metrics.summary(), (merged.summary(), metrics.summary())
+  print(merged.summary())
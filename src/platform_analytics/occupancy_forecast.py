@@ -0,0 +1,115 @@
+import numpy as np
+
+class OccupancyForecast:
+  '''
+  Forecast of the edge occupancy on each of the next horizon ticks, built
+  from the paths the agents follow.
+
+  Loads live in a ring buffer of NumPy arrays indexed by (tick % horizon,
+  edge offset) (see Warehouse.edge_offset()), so memory only depends on the
+  horizon and the warehouse size. The slot of the current tick holds the
+  edges agents traverse from it to the next one, i.e. their next moves, and
+  the forecast beyond the horizon is an empty warehouse.
+
+  Paths are added when they are assigned and removed when they are replaced.
+  advance() is called once per tick with the agents about to move, so its
+  cost is proportional to them.
+  '''
+  def __init__(self, w, horizon):
+    self._w = w
+    rows, cols = w.shape()
+    self._horizon = horizon
+    self._now = 0
+    self._load = np.zeros((horizon, 2 * rows * cols), dtype=np.int32)
+
+  def now(self):
+    '''
+    Returns the current tick.
+    '''
+    return self._now
+
+  def horizon(self):
+    '''
+    Returns the number of ticks, from the current one, that are forecast.
+    '''
+    return self._horizon
+
+  def load(self, n_i, n_j, tick):
+    '''
+    Returns the number of agents that will traverse the edge from tick to
+    tick + 1.
+    '''
+    if tick >= self._now + self._horizon:
+      return 0
+    return self._load.item(tick % self._horizon, self._w.edge_offset(n_i, n_j))
+
+  def edge_cost(self, n_i, n_j, tick):
+    '''
+    Returns the forecast cost of traversing the edge from tick to tick + 1.
+    '''
+    return self._w.get_edge_cost_at(n_i, n_j, self.load(n_i, n_j, tick))
+
+  def add(self, source, path):
+    '''
+    Adds the traffic of an agent at source that follows path (which excludes
+    source) from the current tick on.
+    '''
+    self._update(source, path, 1)
+
+  def remove(self, source, path):
+    '''
+    Removes the traffic added by add(source, path) on the current tick.
+    '''
+    self._update(source, path, -1)
+
+  def advance(self, agents):
+    '''
+    Moves the forecast one tick forward. agents are the assigned agents before
+    they move on the current tick.
+    '''
+    slot = self._now % self._horizon
+    for agent in agents:
+      edge = agent.next_move()
+      if edge:
+        self._load[slot, self._w.edge_offset(*edge)] -= 1
+      # The slot is reused for the tick that enters the horizon
+      edge = agent.path(self._horizon - 1, self._horizon + 1)
+      if len(edge) == 2:
+        self._load[slot, self._w.edge_offset(*edge)] += 1
+    self._now += 1
+
+  def state(self):
+    '''
+    Returns the current tick and the loads, see load_state().
+    '''
+    return {'now': np.int64(self._now), 'load': self._load}
+
+  def load_state(self, state):
+    '''
+    Restores a state() of a forecast of the same warehouse and horizon.
+    '''
+    if state['load'].shape != self._load.shape:
+      raise ValueError('Loads of shape {} for a forecast of shape {}'.format(state['load'].shape, self._load.shape))
+    self._now = state['now'].item()
+    self._load[:] = state['load']
+
+  def check(self, agents):
+    '''
+    Compares the forecast against a full recompute from the agents' paths.
+    Raises RuntimeError on mismatch.
+    '''
+    expected = OccupancyForecast(self._w, self._horizon)
+    expected._now = self._now
+    for agent in agents:
+      expected.add(agent.pos(), agent.path())
+    if not np.array_equal(self._load, expected._load):
+      slot, e = np.argwhere(self._load != expected._load)[0]
+      raise RuntimeError('Edge offset {} has a forecast load of {} on tick {} but {} agents traverse it'.format(e, self._load[slot, e], self._now + (slot - self._now) % self._horizon, expected._load[slot, e]))
+
+  def _update(self, source, path, sign):
+    n = min(len(path), self._horizon)
+    if n == 0:
+      return
+    slots = np.arange(self._now, self._now + n) % self._horizon
+    edges = [self._w.edge_offset(n_i, n_j) for n_i, n_j in zip([source] + path[:n-1], path[:n])]
+    np.add.at(self._load, (slots, edges), sign)
@@ -0,0 +1,111 @@
+from collections import OrderedDict
+
+import numpy as np
+
+import checkpoint
+
+# Arrays of the state of each entry: the task node, the version and edges it
+# was tagged with and its (dist, pred) tree, all as offsets
+_ENTRY_STATE = ('key', 'version', 'edges', 'dist_nodes', 'dist', 'pred_nodes', 'pred')
+
+class PathCache:
+  '''
+  Bounded LRU cache of shortest-path trees.
+
+  Each entry is tagged with the warehouse version at the time it was computed
+  and the edges its search scanned. A lookup drops the entry when any of those
+  edges changed its cost afterwards, so only trees crossing modified edges are
+  invalidated.
+  '''
+  def __init__(self, capacity=128):
+    self._capacity = capacity
+    self._entries = OrderedDict()
+    self._hits = 0
+    self._misses = 0
+    self._evictions = 0
+    self._invalidations = 0
+
+  def get(self, w, key, accept=None):
+    '''
+    Returns the value stored for key when it is still valid in Warehouse w and
+    accept(value) is True (when given). Otherwise returns None.
+    '''
+    entry = self._entries.get(key)
+    if entry is None:
+      self._misses += 1
+      return None
+    version, edges, value = entry
+    if w.edges_changed_since(edges, version):
+      del self._entries[key]
+      self._invalidations += 1
+      self._misses += 1
+      return None
+    if accept is not None and not accept(value):
+      self._misses += 1
+      return None
+    self._entries.move_to_end(key)
+    self._hits += 1
+    return value
+
+  def put(self, w, key, value, edges):
+    '''
+    Stores value for key. edges are the keys (see Warehouse.edge_key()) of the
+    edges that value depends on.
+    '''
+    self._entries[key] = (w.version(), edges, value)
+    self._entries.move_to_end(key)
+    if len(self._entries) > self._capacity:
+      self._entries.popitem(last=False)
+      self._evictions += 1
+
+  def stats(self):
+    '''
+    Returns a dict with the hit, miss, eviction and invalidation counters.
+    '''
+    return {
+      'hits': self._hits,
+      'misses': self._misses,
+      'evictions': self._evictions,
+      'invalidations': self._invalidations,
+      'size': len(self._entries),
+    }
+
+  def state(self, w):
+    '''
+    Returns the entries, from the least to the most recently used, and the
+    counters, see load_state(). Entries are (dist, pred) trees of Warehouse w
+    keyed by node, as WarehouseManager stores them.
+    '''
+    entries = []
+    for key, (version, edges, (dist, pred)) in self._entries.items():
+      entries.append({
+        'key': np.int64(w.node_offset(key)),
+        'version': np.int64(version),
+        'edges': w.edge_key_offsets(edges),
+        'dist_nodes': np.array([w.node_offset(n) for n in dist], dtype=np.int64),
+        'dist': np.array(list(dist.values()), dtype=np.float64),
+        'pred_nodes': np.array([w.node_offset(n) for n in pred], dtype=np.int64),
+        'pred': np.array([w.node_offset(n) if n is not None else -1 for n in pred.values()], dtype=np.int64),
+      })
+    state = checkpoint.pack(entries, _ENTRY_STATE)
+    state.update(hits=np.int64(self._hits), misses=np.int64(self._misses), evictions=np.int64(self._evictions), invalidations=np.int64(self._invalidations))
+    return state
+
+  def load_state(self, state, w):
+    '''
+    Restores a state() of a cache of trees of Warehouse w.
+    '''
+    self._entries = OrderedDict()
+    for entry in checkpoint.unpack(state, _ENTRY_STATE):
+      nodes = [w.node_from_offset(o) for o in entry['dist_nodes'].tolist()]
+      dist = dict(zip(nodes, entry['dist'].tolist()))
+      nodes = [w.node_from_offset(o) for o in entry['pred_nodes'].tolist()]
+      pred = dict(zip(nodes, [w.node_from_offset(o) if o >= 0 else None for o in entry['pred'].tolist()]))
+      self._entries[w.node_from_offset(entry['key'].item())] = (entry['version'].item(), w.edge_keys_from_offsets(entry['edges']), (dist, pred))
+    self._hits = state['hits'].item()
+    self._misses = state['misses'].item()
+    self._evictions = state['evictions'].item()
+    self._invalidations = state['invalidations'].item()
+
+  def __len__(self):
+    return len(self._entries)
@@ -0,0 +1,169 @@
+import heapq
+from itertools import count
+
+from profiling import count_search
+
+def dijkstra_to_targets(w, source, targets, stop_after=None):
+  '''
+  Runs a single Dijkstra search on Warehouse w from source and stops as soon as
+  every node in targets is settled (or the graph is exhausted). When stop_after
+  is given, it stops once that many targets are settled: nodes are settled by
+  increasing distance, so those are the closest ones.
+
+  Edges are undirected and their cost is symmetric, so the distance from source
+  to a target is also the cost of going from that target to source.
+
+  Returns (dist, pred): dist maps every settled node to its distance and pred
+  maps every reached node to the next node on its way back to source.
+  '''
+  remaining = set(targets)
+  n_left = len(remaining) if stop_after is None else min(stop_after, len(remaining))
+  dist = dict()
+  pred = {source: None}
+  best = {source: 0}
+  tie = count()
+  heap = [(0, next(tie), source)]
+  while heap and n_left > 0:
+    d, _, n = heapq.heappop(heap)
+    if n in dist:
+      continue
+    dist[n] = d
+    if n in remaining:
+      remaining.discard(n)
+      n_left -= 1
+      if n_left == 0:
+        break
+    for m in w.neighbors(n):
+      if m in dist:
+        continue
+      d_m = d + w.get_edge_cost(n, m)
+      if m not in best or d_m < best[m]:
+        best[m] = d_m
+        pred[m] = n
+        heapq.heappush(heap, (d_m, next(tie), m))
+  count_search('dijkstra_to_targets', len(dist))
+  return dist, pred
+
+def path_to_source(pred, node):
+  '''
+  Walks the predecessor tree returned by dijkstra_to_targets() from node to the
+  search source. The result excludes node and ends with the source.
+  '''
+  path = []
+  n = pred[node]
+  while n is not None:
+    path.append(n)
+    n = pred[n]
+  return path
+
+def astar_path(w, source, target, heuristic, max_cost=None, algorithm='astar'):
+  '''
+  Runs A* on Warehouse w from source to target. heuristic(n) must be a
+  consistent lower bound of the cost from n to target.
+
+  Returns (path, cost) where path goes from source to target, both included.
+  When max_cost is given, the search stops and returns None as soon as no path
+  cheaper than max_cost can be found. Raises ValueError when target cannot be
+  reached. The search is profiled under the name algorithm (see
+  profiling.count_search()).
+  '''
+  g = {source: 0}
+  pred = {source: None}
+  closed = set()
+  tie = count()
+  # Ties in f are broken in favor of the deepest node, which on a grid avoids
+  # expanding the whole rectangle between source and target.
+  heap = [(heuristic(source), 0, next(tie), source)]
+  while heap:
+    f, _, _, n = heapq.heappop(heap)
+    if n in closed:
+      continue
+    if max_cost is not None and f >= max_cost:
+      count_search(algorithm, len(closed))
+      return None
+    if n == target:
+      count_search(algorithm, len(closed))
+      path = [n]
+      while pred[path[-1]] is not None:
+        path.append(pred[path[-1]])
+      return path[::-1], g[n]
+    closed.add(n)
+    for m in w.neighbors(n):
+      if m in closed:
+        continue
+      g_m = g[n] + w.get_edge_cost(n, m)
+      if m not in g or g_m < g[m]:
+        g[m] = g_m
+        pred[m] = n
+        heapq.heappush(heap, (g_m + heuristic(m), -g_m, next(tie), m))
+  count_search(algorithm, len(closed))
+  raise ValueError('Node {} is not reachable from {}'.format(target, source))
+
+def l_path(w, source, target):
+  '''
+  Returns the canonical L-shaped path from source to target on the grid of
+  Warehouse w: first along the row of source and then along the column of
+  target. The result excludes source and ends with target.
+
+  When all the edges have the same cost it is a shortest path.
+  '''
+  r_s, c_s = w.node_index(source)
+  r_t, c_t = w.node_index(target)
+  step = 1 if c_t > c_s else -1
+  path = [w.node_id(r_s, c) for c in range(c_s + step, c_t + step, step)] if c_t != c_s else []
+  step = 1 if r_t > r_s else -1
+  path += [w.node_id(r, c_t) for r in range(r_s + step, r_t + step, step)] if r_t != r_s else []
+  return path
+
+def space_time_astar_path(w, source, target, heuristic, start_tick, last_tick, edge_cost=None, reservations=None, max_cost=None):
+  '''
+  Runs A* on Warehouse w over (node, tick) states from source on start_tick.
+  Agents do not wait, so a path takes one tick per hop.
+
+  edge_cost(n_i, n_j, tick) is the cost of traversing an edge from tick to
+  tick + 1, w.get_edge_cost() by default. When a ReservationTable is given, a
+  move is only taken when the next node has room on the next tick, target is
+  only accepted when the agent can stay there from the tick it arrives on,
+  and paths must end by last_tick. Otherwise the states after last_tick are
+  merged with the ones on it, so edge_cost must not depend on the tick from
+  last_tick on.
+
+  Returns (path, cost) as astar_path() does, or None when there is no such
+  path or, given max_cost, none cheaper than max_cost.
+  '''
+  if edge_cost is None:
+    edge_cost = lambda n_i, n_j, tick: w.get_edge_cost(n_i, n_j)
+  g = {(source, start_tick): 0}
+  pred = {(source, start_tick): None}
+  closed = set()
+  tie = count()
+  heap = [(heuristic(source), 0, next(tie), source, start_tick)]
+  while heap:
+    f, _, _, n, t = heapq.heappop(heap)
+    if (n, t) in closed:
+      continue
+    if max_cost is not None and f >= max_cost:
+      count_search('space_time_astar', len(closed))
+      return None
+    if n == target and (reservations is None or reservations.can_park(n, t)):
+      count_search('space_time_astar', len(closed))
+      state = (n, t)
+      path = []
+      while state is not None:
+        path.append(state[0])
+        state = pred[state]
+      return path[::-1], g[(n, t)]
+    closed.add((n, t))
+    if t == last_tick and reservations is not None:
+      continue
+    t_m = min(t + 1, last_tick)
+    for m in w.neighbors(n):
+      if (m, t_m) in closed or (reservations is not None and not reservations.is_free(m, t_m)):
+        continue
+      g_m = g[(n, t)] + edge_cost(n, m, t)
+      if (m, t_m) not in g or g_m < g[(m, t_m)]:
+        g[(m, t_m)] = g_m
+        pred[(m, t_m)] = (n, t)
+        heapq.heappush(heap, (g_m + heuristic(m), -g_m, next(tie), m, t_m))
+  count_search('space_time_astar', len(closed))
+  return None
@@ -0,0 +1,100 @@
+import networkx as nx
+
+from path_search import astar_path, space_time_astar_path
+import profiling
+
+class DijkstraPlanner:
+  '''
+  Plans with networkx's Dijkstra using the warehouse edge costs. When a
+  max_cost is given, it runs astar_path() with a zero heuristic instead, i.e.
+  a Dijkstra that stops as soon as no path cheaper than max_cost is left.
+  When a ReservationTable or an OccupancyForecast is given, it plans with
+  space_time_plan() instead.
+  '''
+  def __init__(self):
+    self._w = None
+    self._weight_fn = None
+
+  def plan(self, w, source, target, max_cost=None, reservations=None, forecast=None):
+    '''
+    Returns the path (without source) and the cost of going from source to
+    target given a Warehouse w. Returns None when max_cost is given and the
+    path is not cheaper (the search stops as soon as that is known), or when
+    reservations leave no room for a path. The path is priced with forecast
+    when it is given.
+    '''
+    if reservations is not None or forecast is not None:
+      return space_time_plan(w, source, target, max_cost, reservations, forecast)
+    if max_cost is not None:
+      result = astar_path(w, source, target, lambda n: 0, max_cost, algorithm='dijkstra')
+      if result is None:
+        return None
+      return result[0][1:], result[1]
+    if w is not self._w:
+      # The weight function only depends on the warehouse, build it once
+      self._w = w
+      self._weight_fn = lambda u, v, d: w.get_edge_cost(u, v)
+    if profiling.active() is None:
+      path = nx.dijkstra_path(w.graph(), source, target, weight=self._weight_fn)
+    else:
+      # networkx weighs the edges of every node it expands
+      expanded = set()
+      path = nx.dijkstra_path(w.graph(), source, target, weight=lambda u, v, d: expanded.add(u) or self._weight_fn(u, v, d))
+      profiling.count_search('dijkstra', len(expanded))
+    return path[1:], w.path_cost(path)
+
+class AStarPlanner:
+  '''
+  Plans with A* using the Manhattan distance scaled by the edge base cost as
+  heuristic. Occupancy can only increase an edge cost, so the heuristic never
+  overestimates and the paths are optimal. When a ReservationTable or an
+  OccupancyForecast is given, it plans with space_time_plan() instead.
+  '''
+  def plan(self, w, source, target, max_cost=None, reservations=None, forecast=None):
+    '''
+    Returns the path (without source) and the cost of going from source to
+    target given a Warehouse w. Returns None when max_cost is given and the
+    path is not cheaper (the search stops as soon as that is known), or when
+    reservations leave no room for a path. The path is priced with forecast
+    when it is given.
+    '''
+    if reservations is not None or forecast is not None:
+      return space_time_plan(w, source, target, max_cost, reservations, forecast)
+    base_cost = w.edge_base_cost()
+    result = astar_path(w, source, target, lambda n: base_cost * w.manhattan_distance(n, target), max_cost)
+    if result is None:
+      return None
+    return result[0][1:], result[1]
+
+def space_time_plan(w, source, target, max_cost, reservations=None, forecast=None):
+  '''
+  Plans a path over (node, tick) states with the same heuristic as
+  AStarPlanner. When a ReservationTable is given, the path respects the node
+  capacities. When an OccupancyForecast is given, every edge is priced with
+  the occupancy forecast for the tick the agent would traverse it. The
+  result has the form of plan(). An agent already at target stays there at
+  no cost.
+  '''
+  if source == target:
+    return [], 0
+  if reservations is not None and not reservations.can_reach(target):
+    return None
+  if reservations is not None:
+    start_tick = reservations.now()
+    last_tick = start_tick + reservations.horizon() - 1
+  else:
+    # The forecast is the same on every tick beyond the horizon
+    start_tick = forecast.now()
+    last_tick = start_tick + forecast.horizon()
+  base_cost = w.edge_base_cost()
+  result = space_time_astar_path(w, source, target, lambda n: base_cost * w.manhattan_distance(n, target), start_tick, last_tick,
+                                 forecast.edge_cost if forecast is not None else None, reservations, max_cost)
+  if result is None:
+    return None
+  return result[0][1:], result[1]
+
+# Planners that can be selected by name, e.g. from the Simulator configuration.
+PLANNERS = {
+  'dijkstra': DijkstraPlanner,
+  'astar': AStarPlanner,
+}
@@ -1,5 +1,17 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import os
+from statistics import NormalDist
+
 import pandas as pd 
-import matplotlib.pyplot as plt
+
+from results_store import OPTION_COLUMNS, ResultsStore, code_version
+from visualization import plot_metric_vs_demand
+
+try:
+  from scipy.stats import t as _student_t
+except ImportError:
+  _student_t = None
 
 SIMULATION_CASES = {
   'si_a10_atm': {
@@ -185,146 +197,104 @@ SIMULATION_CASES = {
   },
 }
 
-RESULTS = {
-  'si_a10_atm': {'cost': 3971.0, 'processed_ticks': 644, 'only_wip_ticks': 438, 'average_path_length': 7.281437125748503},
-  'si_a10_atf': {'cost': 6413.0, 'processed_ticks': 990, 'only_wip_ticks': 6, 'average_path_length': 8.054},
-  'si_a10_ats': {'cost': 2077.0, 'processed_ticks': 580, 'only_wip_ticks': 480, 'average_path_length': 6.484158415841584},
-  'se_a10_atm': {'cost': 5340.400000000071, 'processed_ticks': 644, 'only_wip_ticks': 438, 'average_path_length': 7.281437125748503},
-  'se_a10_atf': {'cost': 7390.400000000745, 'processed_ticks': 990, 'only_wip_ticks': 6, 'average_path_length': 8.054},
-  'se_a10_ats': {'cost': 3111.8999999999182, 'processed_ticks': 580, 'only_wip_ticks': 480, 'average_path_length': 6.484158415841584},
-  'sh_a10_atm': {'cost': 5340.400000000071, 'processed_ticks': 644, 'only_wip_ticks': 438, 'average_path_length': 7.281437125748503},
-  'sh_a10_atf': {'cost': 13894.0, 'processed_ticks': 989, 'only_wip_ticks': 5, 'average_path_length': 8.109},
-  'sh_a10_ats': {'cost': 8659.0, 'processed_ticks': 579, 'only_wip_ticks': 479, 'average_path_length': 6.46039603960396},
-  'si_a25_atm': {'cost': 4244.0, 'processed_ticks': 282, 'only_wip_ticks': 76, 'average_path_length': 7.738522954091817},
-  'si_a25_atf': {'cost': 6315.0, 'processed_ticks': 992, 'only_wip_ticks': 8, 'average_path_length': 7.817},
-  'si_a25_ats': {'cost': 2827.0, 'processed_ticks': 278, 'only_wip_ticks': 178, 'average_path_length': 7.56039603960396},
-  'se_a25_atm': {'cost': 5500.200000000128, 'processed_ticks': 282, 'only_wip_ticks': 76, 'average_path_length': 7.738522954091817},
-  'se_a25_atf': {'cost': 7185.700000000685, 'processed_ticks': 992, 'only_wip_ticks': 8, 'average_path_length': 7.817},
-  'se_a25_ats': {'cost': 4062.5999999998776, 'processed_ticks': 278, 'only_wip_ticks': 178, 'average_path_length': 7.56039603960396},
-  'sh_a25_atm': {'cost': 5500.200000000128, 'processed_ticks': 282, 'only_wip_ticks': 76, 'average_path_length': 7.738522954091817},
-  'sh_a25_atf': {'cost': 13321.0, 'processed_ticks': 992, 'only_wip_ticks': 8, 'average_path_length': 7.817},
-  'sh_a25_ats': {'cost': 10933.0, 'processed_ticks': 280, 'only_wip_ticks': 180, 'average_path_length': 7.7247524752475245}
-}
-
-
-def plot_utilitarian_cost_vs_demand(df):
-  fig = plt.figure()
-  ax1 = fig.add_subplot(211)
-
-  x = df[(df.n_agents==10) & (df.occupancy_cost==0)].sort_values(by=['lam'], ascending=True).lam
-  y = df[(df.n_agents==10) & (df.occupancy_cost==0)].sort_values(by=['lam'], ascending=True).cost
-  ax1.plot(x, y, color='b', alpha=0.5, label='Inelastic')
-  x = df[(df.n_agents==10) & (df.occupancy_cost==0.1)].sort_values(by=['lam'], ascending=True).lam
-  y = df[(df.n_agents==10) & (df.occupancy_cost==0.1)].sort_values(by=['lam'], ascending=True).cost
-  ax1.plot(x, y, color='r', alpha=0.5, label='Elastic')
-  x = df[(df.n_agents==10) & (df.occupancy_cost==1)].sort_values(by=['lam'], ascending=True).lam
-  y = df[(df.n_agents==10) & (df.occupancy_cost==1)].sort_values(by=['lam'], ascending=True).cost
-  ax1.plot(x, y, color='g', alpha=0.5, label='Highly elastic')
-  ax1.grid()
-  plt.legend()
-  # plt.xlabel('Lambda')
-  plt.ylabel('Cost')
-  plt.title('Utilitarian cost - 10 agents', size=10)
+# Columns the replications are grouped by
+GROUP_COLUMNS = ['n_agents', 'occupancy_cost', 'lam']
+# File name, metric, y label and title of each figure
+FIGURES = [
+  ('utilitarian_cost_demand.png', 'cost', 'Cost', 'Utilitarian cost'),
+  ('average_path_length_demand.png', 'average_path_length', 'Number of nodes', 'Number of nodes'),
+  ('ticks_wip_demand.png', 'only_wip_ticks', 'Number of ticks to process WIP only', 'Number of ticks to process WIP only'),
+]
 
-  ax2 = fig.add_subplot(212)
-  x = df[(df.n_agents==25) & (df.occupancy_cost==0)].sort_values(by=['lam'], ascending=True).lam
-  y = df[(df.n_agents==25) & (df.occupancy_cost==0)].sort_values(by=['lam'], ascending=True).cost
-  ax2.plot(x, y, color='b', alpha=0.5, label='Inelastic')
-  x = df[(df.n_agents==25) & (df.occupancy_cost==0.1)].sort_values(by=['lam'], ascending=True).lam
-  y = df[(df.n_agents==25) & (df.occupancy_cost==0.1)].sort_values(by=['lam'], ascending=True).cost
-  ax2.plot(x, y, color='r', alpha=0.5, label='Elastic')
-  x = df[(df.n_agents==25) & (df.occupancy_cost==1)].sort_values(by=['lam'], ascending=True).lam
-  y = df[(df.n_agents==25) & (df.occupancy_cost==1)].sort_values(by=['lam'], ascending=True).cost
-  ax2.plot(x, y, color='g', alpha=0.5, label='Highly elastic')
-  ax2.grid()
-  plt.legend()
-  plt.xlabel('Lambda')
-  plt.ylabel('Cost')
-  plt.title('Utilitarian cost - 25 agents', size=10)
+def load_results(store, version=None, **options):
+  '''
+  Returns a DataFrame with a row per replication of the SIMULATION_CASES in
+  store. Only the results of the given code version are used, by default the
+  current one, and of the Simulator options given as keyword arguments. A
+  ValueError is raised when a case has results with different options.
 
-  plt.show()
+  Rows are matched to the cases by their properties, as cases with the same
+  properties share their results.
+  '''
+  cases = pd.DataFrame(SIMULATION_CASES).T.infer_objects()
+  properties = [name for name in cases.columns if name != 'description']
+  df = store.load(version if version is not None else code_version())
+  for name, value in options.items():
+    df = df[df[name] == value]
+  if not df.empty:
+    df = df[df.set_index(properties).index.isin(cases.set_index(properties).index)]
+  if df.empty:
+    raise ValueError('No results of the simulation cases in {}, run simulation_sample.py first'.format(store.path()))
 
-def plot_average_path_length_vs_demand(df):
-  fig = plt.figure()
-  ax1 = fig.add_subplot(211)
+  option_columns = [name for name in OPTION_COLUMNS if name in df.columns]
+  if option_columns and df.groupby(properties)[option_columns].nunique(dropna=False).gt(1).any(axis=None):
+    raise ValueError('Cases have results with different options {}, select them with keyword arguments'.format(option_columns))
+  return df.reset_index(drop=True)
 
-  x = df[(df.n_agents==10) & (df.occupancy_cost==0)].sort_values(by=['lam'], ascending=True).lam
-  y = df[(df.n_agents==10) & (df.occupancy_cost==0)].sort_values(by=['lam'], ascending=True).average_path_length
-  ax1.plot(x, y, color='b', alpha=0.5, label='Inelastic')
-  x = df[(df.n_agents==10) & (df.occupancy_cost==0.1)].sort_values(by=['lam'], ascending=True).lam
-  y = df[(df.n_agents==10) & (df.occupancy_cost==0.1)].sort_values(by=['lam'], ascending=True).average_path_length
-  ax1.plot(x, y, color='r', alpha=0.5, label='Elastic')
-  x = df[(df.n_agents==10) & (df.occupancy_cost==1)].sort_values(by=['lam'], ascending=True).lam
-  y = df[(df.n_agents==10) & (df.occupancy_cost==1)].sort_values(by=['lam'], ascending=True).average_path_length
-  ax1.plot(x, y, color='g', alpha=0.5, label='Highly elastic')
-  ax1.grid()
-  plt.legend()
-  # plt.xlabel('Lambda')
-  plt.ylabel('Number of nodes')
-  plt.title('Number of nodes - 10 agents', size=10)
+def summarize(df, metrics=None, confidence=0.95):
+  '''
+  Groups the replications by GROUP_COLUMNS and returns a DataFrame indexed by
+  them, with columns (metric, statistic): the mean, the half width of its
+  confidence interval and the number of replications. The interval uses
+  Student's t distribution when SciPy is installed and the normal one
+  otherwise, and is NaN for a single replication.
+  '''
+  metrics = list(metrics) if metrics is not None else [metric for _, metric, _, _ in FIGURES]
+  grouped = df.groupby(GROUP_COLUMNS)[metrics]
+  n = grouped.count()
+  if _student_t is not None:
+    quantile = _student_t.ppf((1 + confidence) / 2, n.where(n > 1) - 1)
+  else:
+    quantile = NormalDist().inv_cdf((1 + confidence) / 2)
+  ci = quantile * grouped.std() / n.pow(0.5)
+  return pd.concat({'mean': grouped.mean(), 'ci': ci, 'n': n}, axis=1).swaplevel(axis=1).sort_index(axis=1)
 
-  ax2 = fig.add_subplot(212)
-  x = df[(df.n_agents==25) & (df.occupancy_cost==0)].sort_values(by=['lam'], ascending=True).lam
-  y = df[(df.n_agents==25) & (df.occupancy_cost==0)].sort_values(by=['lam'], ascending=True).average_path_length
-  ax2.plot(x, y, color='b', alpha=0.5, label='Inelastic')
-  x = df[(df.n_agents==25) & (df.occupancy_cost==0.1)].sort_values(by=['lam'], ascending=True).lam
-  y = df[(df.n_agents==25) & (df.occupancy_cost==0.1)].sort_values(by=['lam'], ascending=True).average_path_length
-  ax2.plot(x, y, color='r', alpha=0.5, label='Elastic')
-  x = df[(df.n_agents==25) & (df.occupancy_cost==1)].sort_values(by=['lam'], ascending=True).lam
-  y = df[(df.n_agents==25) & (df.occupancy_cost==1)].sort_values(by=['lam'], ascending=True).average_path_length
-  ax2.plot(x, y, color='g', alpha=0.5, label='Highly elastic')
-  ax2.grid()
-  plt.legend()
-  plt.xlabel('Lambda')
-  plt.ylabel('Number of nodes')
-  plt.title('Number of nodes - 25 agents', size=10)
-
-  plt.show()
-
-def plot_wip_vs_demand(df):
-  fig = plt.figure()
-  ax1 = fig.add_subplot(211)
-
-  x = df[(df.n_agents==10) & (df.occupancy_cost==0)].sort_values(by=['lam'], ascending=True).lam
-  y = df[(df.n_agents==10) & (df.occupancy_cost==0)].sort_values(by=['lam'], ascending=True).only_wip_ticks
-  ax1.plot(x, y, color='b', alpha=0.5, label='Inelastic')
-  x = df[(df.n_agents==10) & (df.occupancy_cost==0.1)].sort_values(by=['lam'], ascending=True).lam
-  y = df[(df.n_agents==10) & (df.occupancy_cost==0.1)].sort_values(by=['lam'], ascending=True).only_wip_ticks
-  ax1.plot(x, y, color='r', alpha=0.5, label='Elastic')
-  x = df[(df.n_agents==10) & (df.occupancy_cost==1)].sort_values(by=['lam'], ascending=True).lam
-  y = df[(df.n_agents==10) & (df.occupancy_cost==1)].sort_values(by=['lam'], ascending=True).only_wip_ticks
-  ax1.plot(x, y, color='g', alpha=0.5, label='Highly elastic')
-  ax1.grid()
-  plt.legend()
-  # plt.xlabel('Lambda')
-  plt.ylabel('Number of ticks to process WIP only')
-  plt.title('Number of ticks to process WIP only - 10 agents', size=10)
-
-  ax2 = fig.add_subplot(212)
-  x = df[(df.n_agents==25) & (df.occupancy_cost==0)].sort_values(by=['lam'], ascending=True).lam
-  y = df[(df.n_agents==25) & (df.occupancy_cost==0)].sort_values(by=['lam'], ascending=True).only_wip_ticks
-  ax2.plot(x, y, color='b', alpha=0.5, label='Inelastic')
-  x = df[(df.n_agents==25) & (df.occupancy_cost==0.1)].sort_values(by=['lam'], ascending=True).lam
-  y = df[(df.n_agents==25) & (df.occupancy_cost==0.1)].sort_values(by=['lam'], ascending=True).only_wip_ticks
-  ax2.plot(x, y, color='r', alpha=0.5, label='Elastic')
-  x = df[(df.n_agents==25) & (df.occupancy_cost==1)].sort_values(by=['lam'], ascending=True).lam
-  y = df[(df.n_agents==25) & (df.occupancy_cost==1)].sort_values(by=['lam'], ascending=True).only_wip_ticks
-  ax2.plot(x, y, color='g', alpha=0.5, label='Highly elastic')
-  ax2.grid()
-  plt.legend()
-  plt.xlabel('Lambda')
-  plt.ylabel('Number of ticks to process WIP only')
-  plt.title('Number of ticks to process WIP only - 25 agents', size=10)
-
-  plt.show()
+def render_figures(summary, output, workers=None):
+  '''
+  Renders the FIGURES of a summary (see summarize()) to files in the output
+  directory, in a process pool of workers processes (by default one per
+  figure, up to the number of CPUs). Returns their paths.
+  '''
+  os.makedirs(output, exist_ok=True)
+  metrics = summary.columns.unique(0)
+  jobs = [(os.path.join(output, name), summary[metric].unstack('occupancy_cost'), ylabel, title)
+          for name, metric, ylabel, title in FIGURES if metric in metrics]
+  workers = workers if workers is not None else min(len(jobs), os.cpu_count() or 1)
+  if workers > 1:
+    # Imported before the workers start so that forked ones share it
+    import matplotlib.figure
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+      return list(executor.map(plot_metric_vs_demand, *zip(*jobs)))
+  return [plot_metric_vs_demand(*job) for job in jobs]
 
 def main():
-  # Loads the data
-  df = pd.concat([pd.DataFrame(SIMULATION_CASES).T, pd.DataFrame(RESULTS).T], axis=1)
+  parser = argparse.ArgumentParser(description='Summarizes and plots the results of the simulation cases.')
+  parser.add_argument('--store', default='results', help='Directory of the results store.')
+  parser.add_argument('--code-version', default=None, help='Code version of the results, by default the current one.')
+  parser.add_argument('--confidence', type=float, default=0.95, help='Confidence level of the intervals across replications.')
+  parser.add_argument('--output', default='figures', help='Directory the figures are written to.')
+  parser.add_argument('--workers', type=int, default=None, help='Processes rendering the figures, by default one per figure.')
+  # Same options and defaults as simulation_sample.py, to select its results
+  parser.add_argument('--backend', default='networkx', help='Warehouse backend: networkx or grid.')
+  parser.add_argument('--bidding', default='per_agent', help='Bidding mode: per_agent or reverse.')
+  parser.add_argument('--closed-form', action='store_true', help='Inelastic cases (occupancy cost 0) bid in closed form, with Manhattan distances.')
+  parser.add_argument('--path-cache', type=int, default=0, help='Search trees cached by reverse bids and batch assignments, 0 disables it.')
+  parser.add_argument('--planner', default='dijkstra', help='Agent planner: dijkstra or astar.')
+  parser.add_argument('--workload', default='legacy', help='Workload generator: legacy or vectorized.')
+  parser.add_argument('--engine', default='tick', help='Simulation engine: tick or event.')
+  parser.add_argument('--assignment', default='greedy', help='Task assignment: greedy or batch.')
+  parser.add_argument('--spatial-index', type=int, default=0, help='Bucket size of the idle agents index, 0 disables it.')
+  parser.add_argument('--node-capacity', type=int, default=-1, help='Agents a node can hold, -1 for unlimited.')
+  parser.add_argument('--replan-period', type=int, default=0, help='Ticks between re-plannings of busy agents, 0 disables it.')
+  parser.add_argument('--forecast-horizon', type=int, default=0, help='Ticks of traffic forecast bids are priced with, 0 disables it.')
+  args = parser.parse_args()
 
-  plot_utilitarian_cost_vs_demand(df)
-  plot_average_path_length_vs_demand(df)
-  plot_wip_vs_demand(df)
+  # Loads the data
+  df = load_results(ResultsStore(args.store), args.code_version, **{name: getattr(args, name) for name in OPTION_COLUMNS})
+  summary = summarize(df, confidence=args.confidence)
+  print(summary.to_string())
+  for path in render_figures(summary, args.output, args.workers):
+    print(path)
 
 if __name__ == '__main__':
-  main()
\ No newline at end of file
+  main()
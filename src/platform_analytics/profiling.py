@@ -0,0 +1,111 @@
+import functools
+import json
+import time
+from collections import Counter
+
+# Profiler that timed() and count() report to, None when profiling is off
+_active = None
+
+class Profiler:
+  '''
+  Monotonic timers and counters of the simulation hot path.
+
+  Functions decorated with timed() and the searches (see count_search())
+  report to the profiler that is active, i.e. the innermost one whose with
+  block is running. When none is, they only check a module global, so
+  profiling costs close to nothing when it is off.
+
+  Timers are inclusive: the time of tick() includes the time of the
+  _update_weights() it calls.
+  '''
+  def __init__(self):
+    # Name -> [calls, seconds]
+    self._timers = dict()
+    self._counters = Counter()
+    self._previous = None
+
+  def __enter__(self):
+    global _active
+    self._previous = _active
+    _active = self
+    return self
+
+  def __exit__(self, *exc):
+    global _active
+    _active = self._previous
+    self._previous = None
+    return False
+
+  def add_time(self, name, seconds):
+    timer = self._timers.get(name)
+    if timer is None:
+      self._timers[name] = [1, seconds]
+    else:
+      timer[0] += 1
+      timer[1] += seconds
+
+  def count(self, name, n=1):
+    self._counters[name] += n
+
+  def merge(self, other):
+    '''
+    Adds the timers and counters of other.
+    '''
+    for name, (calls, seconds) in other._timers.items():
+      timer = self._timers.setdefault(name, [0, 0.])
+      timer[0] += calls
+      timer[1] += seconds
+    self._counters.update(other._counters)
+    return self
+
+  def report(self):
+    '''
+    Returns a dict with the calls, total and mean time of every timer and the
+    value of every counter, ready to be dumped as JSON.
+    '''
+    timers = {name: {'calls': calls, 'total_s': seconds, 'mean_us': 1e6 * seconds / calls}
+              for name, (calls, seconds) in sorted(self._timers.items())}
+    return {'timers': timers, 'counters': dict(sorted(self._counters.items()))}
+
+  def to_json(self, **kwargs):
+    return json.dumps(self.report(), **kwargs)
+
+def active():
+  '''
+  Returns the active Profiler or None.
+  '''
+  return _active
+
+def timed(name):
+  '''
+  Decorator that adds the time of every call to the timer name of the active
+  Profiler.
+  '''
+  def decorator(f):
+    @functools.wraps(f)
+    def wrapper(*args, **kwargs):
+      if _active is None:
+        return f(*args, **kwargs)
+      profiler = _active
+      start = time.perf_counter()
+      try:
+        return f(*args, **kwargs)
+      finally:
+        profiler.add_time(name, time.perf_counter() - start)
+    return wrapper
+  return decorator
+
+def count(name, n=1):
+  '''
+  Adds n to the counter name of the active Profiler.
+  '''
+  if _active is not None:
+    _active.count(name, n)
+
+def count_search(algorithm, nodes_expanded):
+  '''
+  Counts one search of algorithm and the nodes it expanded.
+  '''
+  if _active is not None:
+    _active.count(algorithm + '.searches')
+    _active.count(algorithm + '.nodes_expanded', nodes_expanded)
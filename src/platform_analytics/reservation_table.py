@@ -0,0 +1,146 @@
+import numpy as np
+
+class ReservationTable:
+  '''
+  Space-time reservation table of a warehouse.
+
+  It counts the agents that will be at every node and traversing every edge
+  on each of the next horizon ticks. Counts live in two ring buffers of NumPy
+  arrays indexed by (tick % horizon, node offset) and (tick % horizon, edge
+  offset) (see Warehouse.node_offset() and Warehouse.edge_offset()), so every
+  query is O(1).
+
+  Agents stay at the last node of their path once they reach it, so they are
+  counted there (parked) from that tick on. An agent is parked at its node
+  when the table is created and every reservation moves it to the end of a
+  new path.
+
+  Node capacities are read from the warehouse, where -1 means unlimited.
+  '''
+  def __init__(self, w, agent_nodes, horizon=None):
+    self._w = w
+    rows, cols = w.shape()
+    n_nodes = rows * cols
+    self._horizon = horizon if horizon is not None else 2 * (rows + cols)
+    self._now = 0
+    self._nodes = np.zeros((self._horizon, n_nodes), dtype=np.int32)
+    self._edges = np.zeros((self._horizon, 2 * n_nodes), dtype=np.int32)
+    self._parked = np.zeros(n_nodes, dtype=np.int32)
+    capacity = np.array([w.node_capacity(n) for n in w.graph().nodes], dtype=np.int64)
+    offsets = np.array([self._w.node_offset(n) for n in w.graph().nodes], dtype=np.int64)
+    self._capacity = np.empty(n_nodes, dtype=np.int64)
+    self._capacity[offsets] = np.where(capacity < 0, np.iinfo(np.int64).max, capacity)
+    for n in agent_nodes:
+      self._parked[self._w.node_offset(n)] += 1
+
+  def now(self):
+    '''
+    Returns the current tick.
+    '''
+    return self._now
+
+  def horizon(self):
+    '''
+    Returns the number of ticks, from the current one, that can be reserved.
+    '''
+    return self._horizon
+
+  def node_reservations(self, n, tick):
+    '''
+    Returns the number of agents that will be at n on tick.
+    '''
+    i = self._w.node_offset(n)
+    return self._nodes.item(tick % self._horizon, i) + self._parked.item(i)
+
+  def edge_reservations(self, n_i, n_j, tick):
+    '''
+    Returns the number of agents that will traverse the edge from tick to
+    tick + 1.
+    '''
+    return self._edges.item(tick % self._horizon, self._w.edge_offset(n_i, n_j))
+
+  def is_free(self, n, tick):
+    '''
+    Returns True when one more agent fits in n on tick.
+    '''
+    i = self._w.node_offset(n)
+    return self._nodes.item(tick % self._horizon, i) + self._parked.item(i) < self._capacity.item(i)
+
+  def can_park(self, n, tick):
+    '''
+    Returns True when one more agent fits in n from tick on.
+    '''
+    i = self._w.node_offset(n)
+    slots = (np.arange(tick, self._now + self._horizon) % self._horizon)
+    return int(self._nodes[slots, i].max(initial=0)) + self._parked.item(i) < self._capacity.item(i)
+
+  def can_reach(self, n):
+    '''
+    Returns True when one more agent fits in n from the last tick of the
+    horizon on. Room from a tick on implies room from the later ones, so when
+    it is False no agent can move to n and stay there.
+    '''
+    return self.can_park(n, self._now + self._horizon - 1)
+
+  def reserve(self, source, path):
+    '''
+    Reserves path (which excludes source) for an agent parked at source from
+    the current tick on. Raises ValueError when it is longer than the horizon.
+    '''
+    if not path:
+      return
+    if len(path) >= self._horizon:
+      raise ValueError('Path of {} nodes does not fit in a horizon of {} ticks'.format(len(path), self._horizon))
+    nodes = [self._w.node_offset(n) for n in [source] + path]
+    slots = np.arange(self._now, self._now + len(path)) % self._horizon
+    # The agent is in transit until it parks at the end of the path
+    self._parked[nodes[0]] -= 1
+    self._parked[nodes[-1]] += 1
+    np.add.at(self._nodes, (slots, nodes[:-1]), 1)
+    np.add.at(self._nodes, (slots, nodes[-1]), -1)
+    edges = [self._w.edge_offset(n_i, n_j) for n_i, n_j in zip([source] + path[:-1], path)]
+    np.add.at(self._edges, (slots, edges), 1)
+
+  def advance(self, n_ticks=1):
+    '''
+    Moves the current tick n_ticks forward and frees the slots of the ticks
+    left behind.
+    '''
+    slots = np.arange(self._now, self._now + min(n_ticks, self._horizon)) % self._horizon
+    self._nodes[slots] = 0
+    self._edges[slots] = 0
+    self._now += n_ticks
+
+  def state(self):
+    '''
+    Returns the current tick and the counts, see load_state().
+    '''
+    return {'now': np.int64(self._now), 'nodes': self._nodes, 'edges': self._edges, 'parked': self._parked}
+
+  def load_state(self, state):
+    '''
+    Restores a state() of a table of the same warehouse and horizon.
+    '''
+    if state['nodes'].shape != self._nodes.shape:
+      raise ValueError('Reservations of shape {} for a table of shape {}'.format(state['nodes'].shape, self._nodes.shape))
+    self._now = state['now'].item()
+    self._nodes[:] = state['nodes']
+    self._edges[:] = state['edges']
+    self._parked[:] = state['parked']
+
+  def check(self, agents=None):
+    '''
+    Checks that the reservations of the current tick respect the node
+    capacities and, when agents are given, that they match the agents' nodes.
+    Raises RuntimeError otherwise.
+    '''
+    expected = self._nodes[self._now % self._horizon] + self._parked
+    over = np.flatnonzero(expected > self._capacity)
+    if len(over) > 0:
+      raise RuntimeError('Node offset {} holds {} agents but its capacity is {}'.format(over[0], expected[over[0]], self._capacity[over[0]]))
+    if agents is None:
+      return
+    counts = np.bincount([self._w.node_offset(agent.pos()) for agent in agents], minlength=len(self._parked))
+    if not np.array_equal(counts, expected):
+      i = np.flatnonzero(counts != expected)[0]
+      raise RuntimeError('Node offset {} holds {} agents but {} were reserved'.format(i, counts[i], expected[i]))
@@ -0,0 +1,134 @@
+import glob
+import hashlib
+import json
+import numbers
+import os
+import uuid
+
+import pandas as pd
+
+# Modules that do not take part in the simulation, so editing them does not
+# change the code version
+ANALYSIS_MODULES = ('benchmark.py', 'process_results.py', 'results_store.py', 'simulation_sample.py')
+# Simulator options that do not change the results
+RESULT_NEUTRAL_OPTIONS = ('debug', 'history_path', 'profile', 'store_paths', 'trace', 'trace_dir', 'trace_path')
+# Columns of a row besides the case properties, the options and the result
+KEY_COLUMNS = ('key', 'case', 'replication', 'seed', 'code_version')
+# Simulator options that change the results, i.e. the options a row is
+# selected by besides its case
+OPTION_COLUMNS = ('backend', 'bidding', 'planner', 'closed_form', 'path_cache', 'workload', 'engine', 'assignment',
+                  'spatial_index', 'node_capacity', 'replan_period', 'forecast_horizon')
+
+def code_version(directory=None):
+  '''
+  Returns a hash of the source of the simulation modules, i.e. every module
+  of the package but the ANALYSIS_MODULES.
+  '''
+  directory = directory if directory is not None else os.path.dirname(os.path.abspath(__file__))
+  h = hashlib.sha256()
+  for path in sorted(glob.glob(os.path.join(directory, '*.py'))):
+    if os.path.basename(path) in ANALYSIS_MODULES:
+      continue
+    h.update(os.path.basename(path).encode())
+    with open(path, 'rb') as f:
+      h.update(f.read())
+  return h.hexdigest()[:16]
+
+def result_key(properties, seed, options, version):
+  '''
+  Returns the key of a replication: a hash of the case properties (but its
+  description), the seed, the Simulator options that change the results and
+  the code version.
+  '''
+  config = {
+    'properties': {name: value for name, value in properties.items() if name != 'description'},
+    'seed': seed,
+    'options': {name: value for name, value in options.items() if name not in RESULT_NEUTRAL_OPTIONS},
+    'code_version': version,
+  }
+  return hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()[:32]
+
+class ResultsStore:
+  '''
+  Results of the simulation cases on disk, in Parquet files with one row per
+  replication.
+
+  A sweep writes each replication as it finishes to a file named after its
+  key (see result_key()). Files are written to a temporary name and then
+  renamed, so a sweep that is interrupted leaves no partial rows and its
+  finished replications are kept. compact() then gathers those files in a
+  single part of the parts directory, so loading hundreds of thousands of rows
+  reads a few files instead of one per row.
+
+  A row holds the key, the case, the replication, the seed and the code
+  version, the properties of the case, the Simulator options and the scalar
+  values of the result.
+  '''
+  def __init__(self, path):
+    self._path = path
+    self._parts = os.path.join(path, 'parts')
+    os.makedirs(self._parts, exist_ok=True)
+
+  def path(self):
+    return self._path
+
+  def keys(self):
+    '''
+    Returns the set of keys that have a result.
+    '''
+    keys = set(os.path.splitext(os.path.basename(path))[0] for path in self._loose_files())
+    for path in self._part_files():
+      keys.update(pd.read_parquet(path, columns=['key']).key)
+    return keys
+
+  def write(self, key, case, replication, seed, version, properties, options, result):
+    '''
+    Stores the result of a replication. Values of the result that are not
+    scalars, e.g. its Metrics, are left out.
+    '''
+    row = {'key': key, 'case': case, 'replication': replication, 'seed': seed, 'code_version': version}
+    row.update(properties)
+    row.update(options)
+    row.update({name: value for name, value in result.items() if value is None or isinstance(value, (numbers.Number, str))})
+    ResultsStore._write(pd.DataFrame([row]), os.path.join(self._path, key + '.parquet'))
+
+  def load(self, code_version=None, keys=None):
+    '''
+    Returns a DataFrame with every stored row, or only those of a code
+    version or of some keys.
+    '''
+    frames = [pd.read_parquet(path) for path in self._part_files() + self._loose_files()]
+    if not frames:
+      return pd.DataFrame(columns=list(KEY_COLUMNS))
+    df = pd.concat(frames, ignore_index=True)
+    # A key written again after a compaction is in a part and in a file
+    df = df.drop_duplicates('key', keep='last')
+    if code_version is not None:
+      df = df[df.code_version == code_version]
+    if keys is not None:
+      df = df[df.key.isin(keys)]
+    return df.reset_index(drop=True)
+
+  def compact(self):
+    '''
+    Moves the rows written one file at a time to a new part.
+    '''
+    files = self._loose_files()
+    if not files:
+      return
+    df = pd.concat([pd.read_parquet(path) for path in files], ignore_index=True)
+    ResultsStore._write(df, os.path.join(self._parts, 'part-{}.parquet'.format(uuid.uuid4().hex)))
+    for path in files:
+      os.remove(path)
+
+  def _loose_files(self):
+    return sorted(glob.glob(os.path.join(self._path, '*.parquet')))
+
+  def _part_files(self):
+    # Oldest first, so load() keeps the latest row of a key
+    return sorted(glob.glob(os.path.join(self._parts, '*.parquet')), key=os.path.getmtime)
+
+  def _write(df, path):
+    tmp = path + '.tmp'
+    df.to_parquet(tmp, index=False)
+    os.replace(tmp, path)
@@ -1,6 +1,11 @@
-from simulator import Simulator
+import argparse
+import json
 import logging
 
+from metrics import merge_metrics
+from results_store import ResultsStore
+from sweep import average_path_length, run_sweep
+
 SIMULATION_CASES = {
   'si_a10_atm': {
     'description': 'Standard 10x10 grid map. Inelastic to traffic. 10 agents. Standard task arrival time.',
@@ -185,37 +190,56 @@ SIMULATION_CASES = {
   },
 }
 
-def average_path_length(agents_paths):
-  num_paths = len(agents_paths)
-  num_hops = sum([len(agent_path[1]) for agent_path in agents_paths])
-  return num_hops / num_paths
-
 def main():
+  parser = argparse.ArgumentParser(description='Runs all the simulation cases.')
+  parser.add_argument('--workers', type=int, default=1, help='Number of worker processes.')
+  parser.add_argument('--replications', type=int, default=1, help='Number of runs of each case.')
+  parser.add_argument('--seed', type=int, default=0, help='Root seed the replication seeds derive from.')
+  parser.add_argument('--backend', default='networkx', help='Warehouse backend: networkx or grid.')
+  parser.add_argument('--bidding', default='per_agent', help='Bidding mode: per_agent or reverse.')
+  parser.add_argument('--closed-form', action='store_true', help='Inelastic cases (occupancy cost 0) bid in closed form, with Manhattan distances.')
+  parser.add_argument('--path-cache', type=int, default=0, help='Search trees cached by reverse bids and batch assignments, 0 disables it.')
+  parser.add_argument('--planner', default='dijkstra', help='Agent planner: dijkstra or astar.')
+  parser.add_argument('--workload', default='legacy', help='Workload generator: legacy or vectorized.')
+  parser.add_argument('--engine', default='tick', help='Simulation engine: tick or event.')
+  parser.add_argument('--assignment', default='greedy', help='Task assignment: greedy or batch.')
+  parser.add_argument('--spatial-index', type=int, default=0, help='Bucket size of the idle agents index, 0 disables it.')
+  parser.add_argument('--node-capacity', type=int, default=-1, help='Agents a node can hold, -1 for unlimited.')
+  parser.add_argument('--replan-period', type=int, default=0, help='Ticks between re-plannings of busy agents, 0 disables it.')
+  parser.add_argument('--forecast-horizon', type=int, default=0, help='Ticks of traffic forecast bids are priced with, 0 disables it.')
+  parser.add_argument('--store-paths', action='store_true', help='Keep the path of every assignment, not only their statistics.')
+  parser.add_argument('--profile', default=None, help='Profiles the runs and writes their reports to this JSON file.')
+  parser.add_argument('--trace', type=int, default=0, help='Records of the event trace of each run, 0 disables it.')
+  parser.add_argument('--trace-dir', default='traces', help='Directory of the trace files, one per case and seed.')
+  parser.add_argument('--store', default='results', help='Directory of the results store. Stored replications are not run again.')
+  parser.add_argument('--no-store', action='store_true', help='Runs every replication and does not store the results.')
+  args = parser.parse_args()
+
   logging.basicConfig(level=logging.INFO,    
                       handlers=[logging.FileHandler("sim.log"), logging.StreamHandler()])
   
+  store = ResultsStore(args.store) if not args.no_store else None
   results = dict()
-
-  for key in SIMULATION_CASES:
-    properties = SIMULATION_CASES[key]
-    logging.info('Case: {}. Properties: {}'.format(key, properties))
-
-    # rows, cols, node_capacity=-1, edge_base_cost=1., occupancy_cost=0., n_agents=10, n_tasks=100, lam=1.
-    sim = Simulator(properties['rows'], properties['cols'],
-                    properties['edge_base_cost'], properties['occupancy_cost'],
-                    properties['n_agents'], properties['n_tasks'],
-                    properties['lam'])
-    logging.info('\tStarting simulation...')
-    sim.run()
-    logging.info('\tSimulation finished!')
-
-    results[key] = dict()
-    results[key]['cost'] = sim.utilitarian_cost()
-    results[key]['processed_ticks'] = sim.processed_ticks()
-    results[key]['only_wip_ticks'] = sim.only_wip_ticks()
-    results[key]['average_path_length'] = average_path_length(sim.task_assingments())
+  metrics = dict()
+  profiles = dict()
+  for key, replication, seed, result in run_sweep(SIMULATION_CASES, args.replications, args.workers, args.seed, store,
+                                                  backend=args.backend, bidding=args.bidding, closed_form=args.closed_form, path_cache=args.path_cache, planner=args.planner, workload=args.workload, engine=args.engine, assignment=args.assignment, spatial_index=args.spatial_index, node_capacity=args.node_capacity, replan_period=args.replan_period, forecast_horizon=args.forecast_horizon, store_paths=args.store_paths, profile=args.profile is not None, trace=args.trace, trace_dir=args.trace_dir if args.trace > 0 else None):
+    # Results read from the store have no Metrics
+    if 'metrics' in result:
+      metrics.setdefault(key, []).append(result.pop('metrics'))
+    if 'profile' in result:
+      profiles.setdefault(key, []).append(result.pop('profile'))
+    if args.replications == 1:
+      results[key] = result
+    else:
+      results.setdefault(key, []).append(result)
 
   logging.info(results)
+  if args.replications > 1:
+    logging.info({key: merge_metrics(case_metrics).summary() for key, case_metrics in metrics.items()})
+  if args.profile is not None:
+    with open(args.profile, 'w') as f:
+      json.dump(profiles, f, indent=2)
 
 if __name__ == '__main__':
-  main()
\ No newline at end of file
+  main()
@@ -1,26 +1,139 @@
 from collections import Counter
-import logging
+import heapq
+import json
 
+import numpy as np
+
+import checkpoint
 from agent import Agent
-from task_creator import create_tasks_arrivals, sample_nodes, set_seed
+from event_trace import ARRIVAL, EventTrace
+from task_creator import create_tasks_arrivals, draw_nodes, draw_tasks_arrivals, random_state, sample_nodes, set_random_state, set_seed
+from grid_warehouse import GridWarehouse
+from planner import PLANNERS
+from profiling import Profiler, timed
 from warehouse import Warehouse
 from warehouse_manager import WarehouseManager
 
+# Warehouse implementations that can be selected with the backend argument.
+WAREHOUSE_BACKENDS = {
+  'networkx': Warehouse,
+  'grid': GridWarehouse,
+}
+
 class Simulator:
-  def __init__(self, rows, cols, edge_base_cost=1., occupancy_cost=0., n_agents=10, n_tasks=100, lam=1., seed=0):
-    set_seed(s=seed)
+  '''
+  Runs a WarehouseManager over a demand of tasks.
+
+  The workload argument selects how the demand and the agents' nodes are drawn:
+  - 'legacy': one sample at a time from the global random generators.
+  - 'vectorized': whole arrays at once from a numpy.random.Generator.
+
+  The engine argument selects how run() advances time:
+  - 'tick': one tick at a time.
+  - 'event': a discrete-event engine over a heap of (tick, event) entries for
+    task arrivals and agent path completions. It jumps straight between the
+    ticks where a task can be assigned and lets the manager charge the cost of
+    the skipped ticks at once. Metrics are the same as with 'tick'.
+
+  The assignment argument selects how the pending tasks of a tick are given
+  to agents: 'greedy' processes them one at a time in arrival order and
+  'batch' hands them all to the manager to be solved as a single assignment.
+  Both price the tasks with the same path costs, greedy giving each task to
+  its cheapest idle agent and batch minimizing their total.
+
+  When node_capacity is not -1, every node holds at most that many agents on
+  any tick (see WarehouseManager). It requires per agent bidding without
+  closed form and greedy assignment. A RuntimeError is raised when the pending
+  tasks can never be assigned, i.e. no arrivals are left, every agent is idle
+  and none of them can reach the tasks.
+
+  The path cache (path_cache greater than 0) holds the search trees of
+  reverse bids and batch assignments, so it is rejected with per agent
+  bidding and greedy assignment, where no search would use it.
+
+  When replan_period is greater than 0, agents are rerouted around congestion
+  every replan_period ticks (see WarehouseManager). Rerouting changes when
+  agents become idle, so it requires the 'tick' engine.
+
+  metrics() returns the Metrics of the run: the distributions of the wait and
+  completion times of the tasks and the throughput per tick.
 
-    self._w = Warehouse(rows, cols, node_capacity=-1, edge_base_cost=edge_base_cost, occupancy_cost=occupancy_cost)
-    self._w_manager = WarehouseManager(self._w, n_agents)
-    nodes = self._w_manager.nodes()
+  When profile is True, run() is profiled: profile() returns the time spent
+  in bids, ticks and edge cost updates and the nodes expanded by every kind
+  of search (see profiling.py).
 
-    num_tasks_per_iteration = create_tasks_arrivals(n_tasks, lam)
-    self._task_arrivals = []
-    for x in num_tasks_per_iteration:
-      self._task_arrivals.append([sample_nodes(nodes)] * x)
+  When forecast_horizon is greater than 0, bids price edges with the traffic
+  forecast for the tick agents would reach them (see WarehouseManager).
+
+  Task assignments are kept in a TaskHistory: only their statistics when
+  store_paths is False, and memory-mapped to files named after history_path
+  when it is given.
+
+  When trace is greater than 0, task arrivals and the events of the manager
+  are recorded in an EventTrace of that many records, memory-mapped to
+  trace_path when it is given (see event_trace.py). trace() returns it.
+
+  run() can stop at a given tick and go on with another call, and in between
+  checkpoint() writes the whole state of the simulation (the warehouse, the
+  agents, the manager and its components, the pending tasks and the global
+  random generators) to a snapshot of NumPy arrays. Simulator.resume() builds
+  the simulator again from its arguments and restores the snapshot, so the
+  resumed run is the same as one that was never interrupted. Profiler timings
+  are not part of the snapshot.
+  '''
+  # Event kinds of the 'event' engine
+  _ARRIVAL = 0
+  _AGENT_IDLE = 1
+
+  def __init__(self, rows, cols, edge_base_cost=1., occupancy_cost=0., n_agents=10, n_tasks=100, lam=1., seed=0, backend='networkx', bidding='per_agent', debug=False, planner='dijkstra', closed_form=False, path_cache=0, workload='legacy', engine='tick', assignment='greedy', spatial_index=0, node_capacity=-1, replan_period=0, forecast_horizon=0, store_paths=True, history_path=None, profile=False, trace=0, trace_path=None):
+    # Arguments a checkpoint rebuilds the simulator with
+    self._config = {name: value for name, value in locals().items() if name != 'self'}
+    if engine not in ('tick', 'event'):
+      raise ValueError('Unknown engine: {}'.format(engine))
+    self._engine = engine
+    if assignment not in ('greedy', 'batch'):
+      raise ValueError('Unknown assignment: {}'.format(assignment))
+    self._assignment = assignment
+    if engine == 'event' and replan_period > 0:
+      raise ValueError('Re-planned agents need the tick engine')
+    if node_capacity != -1 and (assignment != 'greedy' or bidding != 'per_agent' or closed_form):
+      raise ValueError('Node capacity is only enforced with greedy assignment and per agent bidding, without closed form')
+    if path_cache > 0 and bidding == 'per_agent' and assignment == 'greedy':
+      raise ValueError('The path cache only serves reverse bids and batch assignments')
+    set_seed(s=seed)
+    self._trace = EventTrace(trace, trace_path) if trace > 0 else None
+
+    self._w = WAREHOUSE_BACKENDS[backend](rows, cols, node_capacity=node_capacity, edge_base_cost=edge_base_cost, occupancy_cost=occupancy_cost)
+    manager_options = dict(bidding=bidding, debug=debug, planner=PLANNERS[planner](), closed_form=closed_form, path_cache=path_cache, spatial_index=spatial_index, replan_period=replan_period, forecast_horizon=forecast_horizon, store_paths=store_paths, history_path=history_path, trace=self._trace)
+    if workload == 'vectorized':
+      rng = np.random.default_rng(seed)
+      nodes = list(self._w.graph().nodes)
+      agent_nodes = [nodes[i] for i in draw_nodes(rng, len(nodes), n_agents, replace=False).tolist()]
+      self._w_manager = WarehouseManager(self._w, n_agents, agent_nodes=agent_nodes, **manager_options)
+      num_tasks_per_iteration = draw_tasks_arrivals(rng, n_tasks, lam)
+      self._arrival_nodes = [nodes[i] for i in draw_nodes(rng, len(nodes), len(num_tasks_per_iteration)).tolist()]
+      self._arrival_counts = num_tasks_per_iteration.tolist()
+    elif workload == 'legacy':
+      self._w_manager = WarehouseManager(self._w, n_agents, **manager_options)
+      nodes = self._w_manager.nodes()
+      self._arrival_counts = create_tasks_arrivals(n_tasks, lam)
+      self._arrival_nodes = [sample_nodes(nodes) for x in self._arrival_counts]
+    else:
+      raise ValueError('Unknown workload: {}'.format(workload))
+    # Index of the next tick of arrivals (all the tasks of a tick share a node)
+    self._next_arrival = 0
+    # Tasks waiting for an agent and their arrival ticks, in the same order
+    self._tasks_to_process = []
+    self._pending_ticks = []
+    # Heap of (tick, event kind, sequence) of the 'event' engine
+    self._events = []
+    self._n_events = 0
+    if engine == 'event':
+      self._schedule_arrival(self._next_arrival)
 
     self._processed_ticks = 0
     self._only_wip_ticks = 0
+    self._profiler = Profiler() if profile else None
 
   def processed_ticks(self):
     return self._processed_ticks
@@ -34,29 +147,239 @@ class Simulator:
   def task_assingments(self):
     return self._w_manager.task_assingments()
 
-  def run(self):
-    i = 0
-    tasks_to_process = []
-    while ( len(self._w_manager.assigned_agents()) > 0 or len(self._task_arrivals) > 0 or len(tasks_to_process) > 0 ):
-      logging.debug('\t\tRunning the {}-th iteration.'.format(i))
-      i += 1
-      # Pick new tasks and add those to the pool
-      if self._task_arrivals:
-        tasks_to_process = tasks_to_process + self._task_arrivals.pop(0)
-      else:
-        # When there are no more tasks but we still need to process.
-        self._only_wip_ticks += 1
-
-      # Try to assign as many tasks as possible
-      task_index = 0
-      for task in tasks_to_process:
-        logging.debug('\t\tTrying to process: {}'.format(task))
-        if not self._w_manager.process_task(task):
+  def metrics(self):
+    return self._w_manager.metrics()
+
+  def cache_stats(self):
+    return self._w_manager.cache_stats()
+
+  def trace(self):
+    '''
+    Returns the EventTrace of the run, or None when trace is 0.
+    '''
+    return self._trace
+
+  def profile(self):
+    '''
+    Returns the report of the Profiler of the runs, or None when profile is
+    False.
+    '''
+    return self._profiler.report() if self._profiler is not None else None
+
+  def finished(self):
+    '''
+    Returns True when the run is over: every task arrived and was completed.
+    '''
+    return not self._is_running()
+
+  def run(self, until=None):
+    '''
+    Runs the simulation until it is over or, when until is given, until
+    until ticks were processed (the 'event' engine may go past it when it
+    skips ticks). Another call goes on from there.
+    '''
+    if self._profiler is None:
+      self._run(until)
+    else:
+      with self._profiler:
+        self._run(until)
+    if self._trace is not None:
+      self._trace.flush()
+
+  def checkpoint(self, path):
+    '''
+    Writes the state of the simulation to a snapshot file at path, between
+    two run() calls, see Simulator.resume().
+    '''
+    checkpoint.save(path, self.state())
+
+  def resume(path):
+    '''
+    Returns the Simulator saved by checkpoint() at path. It is built again
+    from the same arguments, so the files of history_path and trace_path are
+    rewritten from the snapshot.
+    '''
+    state = checkpoint.load(path)
+    if 'checkpoint_version' not in state:
+      raise ValueError('Not a simulator checkpoint: {}'.format(path))
+    if state['checkpoint_version'].item() != checkpoint.FORMAT_VERSION:
+      raise ValueError('Unknown checkpoint version {} in {}'.format(state['checkpoint_version'].item(), path))
+    sim = Simulator(**json.loads(state['config'].item()))
+    sim.load_state(state)
+    return sim
+
+  def state(self):
+    '''
+    Returns the state of the simulation as a dict of NumPy arrays, see
+    checkpoint.py. The demand is drawn again from the arguments, so only the
+    tasks that did not arrive yet are saved as an index.
+    '''
+    state = {
+      'checkpoint_version': np.int64(checkpoint.FORMAT_VERSION),
+      'config': np.array(json.dumps(self._config)),
+      'next_arrival': np.int64(self._next_arrival),
+      'tasks_to_process': np.array([self._w.node_offset(task) for task in self._tasks_to_process], dtype=np.int64),
+      'pending_ticks': np.array(self._pending_ticks, dtype=np.int64),
+      'events': np.array(self._events, dtype=np.int64).reshape(-1, 3),
+      'n_events': np.int64(self._n_events),
+      'processed_ticks': np.int64(self._processed_ticks),
+      'only_wip_ticks': np.int64(self._only_wip_ticks),
+    }
+    state.update(checkpoint.nest('random', random_state()))
+    state.update(checkpoint.nest('manager', self._w_manager.state()))
+    if self._trace is not None:
+      state.update(checkpoint.nest('trace', self._trace.state()))
+    return state
+
+  def load_state(self, state):
+    '''
+    Restores a state() of a simulator built with the same arguments.
+    '''
+    config = json.loads(state['config'].item())
+    if config != self._config:
+      raise ValueError('State of a simulator built with other arguments: {}'.format(config))
+    self._next_arrival = state['next_arrival'].item()
+    self._tasks_to_process = [self._w.node_from_offset(o) for o in state['tasks_to_process'].tolist()]
+    self._pending_ticks = state['pending_ticks'].tolist()
+    self._events = [tuple(event) for event in state['events'].tolist()]
+    self._n_events = state['n_events'].item()
+    self._processed_ticks = state['processed_ticks'].item()
+    self._only_wip_ticks = state['only_wip_ticks'].item()
+    set_random_state(checkpoint.section(state, 'random'))
+    self._w_manager.load_state(checkpoint.section(state, 'manager'))
+    if self._trace is not None:
+      self._trace.load_state(checkpoint.section(state, 'trace'))
+
+  @timed('Simulator.run')
+  def _run(self, until):
+    if self._engine == 'event':
+      self._run_events(until)
+      return
+    while self._is_running() and (until is None or self._processed_ticks < until):
+      self._step()
+      self._processed_ticks += 1
+
+  def _is_running(self):
+    return len(self._w_manager.assigned_agents()) > 0 or self._next_arrival < len(self._arrival_counts) or len(self._tasks_to_process) > 0
+
+  def _step(self):
+    '''
+    Runs one tick.
+    '''
+    self._tasks_to_process = self._assign(self._take_arrivals(self._tasks_to_process))
+    # Tick the system
+    self._w_manager.tick()
+
+  def _take_arrivals(self, tasks_to_process):
+    # Pick new tasks and add those to the pool
+    if self._next_arrival < len(self._arrival_counts):
+      tasks_to_process = tasks_to_process + [self._arrival_nodes[self._next_arrival]] * self._arrival_counts[self._next_arrival]
+      self._pending_ticks = self._pending_ticks + [self._next_arrival] * self._arrival_counts[self._next_arrival]
+      self._trace_arrival(self._next_arrival)
+      self._next_arrival += 1
+    else:
+      # When there are no more tasks but we still need to process.
+      self._only_wip_ticks += 1
+    return tasks_to_process
+
+  def _trace_arrival(self, b):
+    if self._trace is not None and self._arrival_counts[b] > 0:
+      self._trace.record(b, ARRIVAL, node=self._w.node_offset(self._arrival_nodes[b]), cost=self._arrival_counts[b])
+
+  def _assign(self, tasks_to_process):
+    if self._assignment == 'batch':
+      task_index = self._w_manager.process_tasks(tasks_to_process, self._pending_ticks)
+      self._pending_ticks = self._pending_ticks[task_index:]
+      return tasks_to_process[task_index:]
+    # Try to assign as many tasks as possible
+    task_index = 0
+    for task, arrival_tick in zip(tasks_to_process, self._pending_ticks):
+      if not self._w_manager.process_task(task, arrival_tick):
+        break
+      task_index += 1
+    tasks_to_process = tasks_to_process[task_index:]
+    self._pending_ticks = self._pending_ticks[task_index:]
+    if tasks_to_process and not self._w_manager.assigned_agents() and self._next_arrival >= len(self._arrival_counts):
+      raise RuntimeError('Tasks {} cannot be reached without exceeding a node capacity'.format(tasks_to_process))
+    return tasks_to_process
+
+  def _run_events(self, until):
+    '''
+    Runs the 'event' engine, where the processed ticks are the current tick.
+    '''
+    while self._is_running() and (until is None or self._processed_ticks < until):
+      tick = self._processed_ticks
+      decision_tick = self._next_decision_tick(tick, self._tasks_to_process)
+      if decision_tick > tick:
+        self._tasks_to_process = self._skip(tick, decision_tick, self._tasks_to_process)
+        tick = self._processed_ticks = decision_tick
+        # The events up to decision_tick were consumed, so it is processed
+        # right away unless the run is over.
+        if not self._is_running():
           break
-        task_index += 1
-      tasks_to_process = tasks_to_process[task_index:]
-      # Tick the system
+
+      tasks_to_process = self._take_arrivals(self._tasks_to_process)
+      # Agents are appended to the assigned list when they get a task
+      n_assigned = len(self._w_manager.assigned_agents())
+      self._tasks_to_process = self._assign(tasks_to_process)
+      for agent in self._w_manager.assigned_agents()[n_assigned:]:
+        self._push_event(tick + agent.remaining_ticks(), Simulator._AGENT_IDLE)
       self._w_manager.tick()
+      self._processed_ticks = tick + 1
 
-    self._processed_ticks += i
+  def _push_event(self, tick, kind):
+    # The sequence breaks the ties in push order
+    heapq.heappush(self._events, (tick, kind, self._n_events))
+    self._n_events += 1
+
+  def _schedule_arrival(self, b):
+    '''
+    Pushes the arrival event of the first tick from b on with tasks, if any.
+    '''
+    while b < len(self._arrival_counts) and self._arrival_counts[b] == 0:
+      b += 1
+    if b < len(self._arrival_counts):
+      self._push_event(b, Simulator._ARRIVAL)
+
+  def _next_decision_tick(self, tick, tasks_to_process):
+    '''
+    Returns the first tick from tick on where there are both tasks to process
+    and idle agents, consuming the events before it. When there is no such tick
+    it returns the tick where the run ends.
+    '''
+    events = self._events
+    # Drops the events that already happened
+    while events and events[0][0] < tick:
+      _, kind, _ = heapq.heappop(events)
+      if kind == Simulator._ARRIVAL:
+        self._schedule_arrival(self._next_arrival)
+
+    has_tasks = len(tasks_to_process) > 0
+    has_idle_agents = len(self._w_manager.unassigned_agents()) > 0
+    last_tick = tick
+    while not (has_tasks and has_idle_agents):
+      if not events:
+        # Only work in progress and empty arrival ticks are left
+        return max(last_tick, len(self._arrival_counts))
+      last_tick, kind, _ = heapq.heappop(events)
+      if kind == Simulator._ARRIVAL:
+        has_tasks = True
+        self._schedule_arrival(last_tick + 1)
+      else:
+        has_idle_agents = True
+    return max(tick, last_tick)
 
+  def _skip(self, tick, end_tick, tasks_to_process):
+    '''
+    Advances from tick to end_tick where no task can be assigned: arrivals are
+    queued and agents follow their paths. Returns the tasks to process.
+    '''
+    last_arrival = min(end_tick, len(self._arrival_counts))
+    for b in range(self._next_arrival, last_arrival):
+      tasks_to_process = tasks_to_process + [self._arrival_nodes[b]] * self._arrival_counts[b]
+      self._pending_ticks = self._pending_ticks + [b] * self._arrival_counts[b]
+      self._trace_arrival(b)
+    self._only_wip_ticks += (end_tick - tick) - max(0, last_arrival - self._next_arrival)
+    self._next_arrival = max(self._next_arrival, last_arrival)
+    self._w_manager.advance(end_tick - tick)
+    return tasks_to_process
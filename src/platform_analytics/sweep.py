@@ -0,0 +1,110 @@
+from concurrent.futures import ProcessPoolExecutor
+import logging
+import os
+
+import numpy as np
+
+from simulator import Simulator
+
+def average_path_length(task_history):
+  '''
+  Returns the average number of nodes of the assigned paths, from the
+  statistics the TaskHistory keeps as it goes.
+  '''
+  return task_history.average_path_length()
+
+def replication_seed(root_seed, replication):
+  '''
+  Returns the seed of a replication. It only depends on the root seed and the
+  replication index, so results do not depend on the number of workers nor on
+  the scheduling order, and all the cases share their random numbers. Both
+  are hashed by a SeedSequence, so replications of different root seeds do
+  not share their streams as root_seed + replication would.
+  '''
+  return int(np.random.SeedSequence([root_seed, replication]).generate_state(1)[0])
+
+def run_case(key, properties, seed, options):
+  '''
+  Runs one replication of a simulation case and returns (key, seed, result).
+  A trace_dir option is turned into the trace_path <trace_dir>/<key>-<seed>.trace.
+  '''
+  logging.info('Case: {}. Seed: {}. Properties: {}'.format(key, seed, properties))
+  options = dict(options)
+  trace_dir = options.pop('trace_dir', None)
+  if trace_dir is not None:
+    os.makedirs(trace_dir, exist_ok=True)
+    options['trace_path'] = os.path.join(trace_dir, '{}-{}.trace'.format(key, seed))
+  sim = Simulator(properties['rows'], properties['cols'],
+                  properties['edge_base_cost'], properties['occupancy_cost'],
+                  properties['n_agents'], properties['n_tasks'],
+                  properties['lam'], seed=seed, **options)
+  sim.run()
+  logging.info('\tCase {} with seed {} finished!'.format(key, seed))
+
+  result = dict()
+  result['cost'] = sim.utilitarian_cost()
+  result['processed_ticks'] = sim.processed_ticks()
+  result['only_wip_ticks'] = sim.only_wip_ticks()
+  result['average_path_length'] = average_path_length(sim.task_assingments())
+  result.update(sim.metrics().summary())
+  # Mergeable with the metrics of other replications, see merge_metrics()
+  result['metrics'] = sim.metrics()
+  if sim.profile() is not None:
+    result['profile'] = sim.profile()
+  return key, seed, result
+
+def run_sweep(cases, replications=1, workers=1, root_seed=0, store=None, **options):
+  '''
+  Runs every case in cases (a dict like SIMULATION_CASES) replications times.
+  When workers is greater than 1 the runs are spread in a process pool.
+  Extra keyword arguments are forwarded to Simulator.
+
+  When store (a ResultsStore) is given, replications whose key (see
+  result_key()) is in it are not run again: their result is read from it,
+  without Metrics. The others are written to it as they finish, and compacted
+  at the end (see ResultsStore.compact()).
+
+  Returns a list of (key, replication, seed, result) sorted by case (in the
+  order of cases) and then by replication.
+  '''
+  if store is not None:
+    # Imported here so the workers do not import pandas
+    from results_store import KEY_COLUMNS, code_version, result_key
+  version = code_version() if store is not None else None
+  jobs = []
+  for key in cases:
+    for replication in range(0, replications):
+      seed = replication_seed(root_seed, replication)
+      jobs.append((key, replication, seed, result_key(cases[key], seed, options, version) if store is not None else None))
+
+  stored = store.keys() if store is not None else set()
+  pending = [job for job in jobs if job[3] not in stored]
+  logging.info('{} replications to run, {} already stored'.format(len(pending), len(jobs) - len(pending)))
+  args = ([key for key, _, _, _ in pending],
+          [cases[key] for key, _, _, _ in pending],
+          [seed for _, _, seed, _ in pending],
+          [options] * len(pending))
+  results = dict()
+  if workers > 1 and len(pending) > 1:
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+      # map() yields in submission order whatever order the jobs finish in
+      _collect(pending, executor.map(run_case, *args), cases, options, store, version, results)
+  else:
+    _collect(pending, map(run_case, *args), cases, options, store, version, results)
+
+  if store is not None:
+    store.compact()
+    rows = store.load(keys=[store_key for _, _, _, store_key in jobs if store_key in stored]).set_index('key')
+    for key, replication, seed, store_key in jobs:
+      if store_key in stored:
+        # Stored values come back as NumPy scalars, convert them to Python's like the computed ones
+        results[(key, replication)] = {name: value.item() if hasattr(value, 'item') else value for name, value in rows.loc[store_key].items()
+                                       if name not in KEY_COLUMNS and name not in cases[key] and name not in options}
+  return [(key, replication, seed, results[(key, replication)]) for key, replication, seed, _ in jobs]
+
+def _collect(jobs, outputs, cases, options, store, version, results):
+  # Keeps the outputs of the jobs and stores them as soon as they are done
+  for (key, replication, seed, store_key), (_, _, result) in zip(jobs, outputs):
+    if store is not None:
+      store.write(store_key, key, replication, seed, version, cases[key], options, result)
+    results[(key, replication)] = result
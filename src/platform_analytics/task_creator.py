@@ -6,6 +6,31 @@ def set_seed(s=0):
   np.random.seed(s)
   random.seed(s)
 
+def random_state():
+  '''
+  Returns the state of the global random generators that set_seed() seeds as
+  a dict of NumPy arrays, see set_random_state().
+  '''
+  _, keys, pos, has_gauss, cached_gaussian = np.random.get_state()
+  version, internal, gauss_next = random.getstate()
+  return {
+    'numpy_keys': keys,
+    'numpy_pos': np.int64(pos),
+    'numpy_gauss': np.array([has_gauss, cached_gaussian], dtype=np.float64),
+    'random_version': np.int64(version),
+    'random_internal': np.array(internal, dtype=np.uint64),
+    'random_gauss': np.array([gauss_next is not None, gauss_next or 0.], dtype=np.float64),
+  }
+
+def set_random_state(state):
+  '''
+  Restores a random_state() of the global random generators.
+  '''
+  has_gauss, cached_gaussian = state['numpy_gauss'].tolist()
+  np.random.set_state(('MT19937', state['numpy_keys'], state['numpy_pos'].item(), int(has_gauss), cached_gaussian))
+  has_gauss, gauss_next = state['random_gauss'].tolist()
+  random.setstate((state['random_version'].item(), tuple(state['random_internal'].tolist()), gauss_next if has_gauss else None))
+
 def create_tasks_arrivals(n_tasks=10, lam=1.):
   '''
   Returns a list of samples of a Poisson distribution with lambda = lam 
@@ -26,6 +51,42 @@ def create_tasks_arrivals(n_tasks=10, lam=1.):
 def sample_nodes(nodes):
   return random.sample(nodes, 1)[0]
 
+def draw_tasks_arrivals(rng, n_tasks=10, lam=1.):
+  '''
+  Vectorized version of create_tasks_arrivals() that draws from a
+  numpy.random.Generator rng. Returns an array of samples of a Poisson
+  distribution with lambda = lam whose sum is exactly n_tasks: the last sample
+  is trimmed to the remaining tasks.
+  '''
+  if n_tasks <= 0:
+    return np.zeros(0, dtype=np.int64)
+  if lam <= 0:
+    raise ValueError('lam must be positive to draw {} tasks'.format(n_tasks))
+  # The expected number of samples plus a margin, so one draw almost always
+  # suffices.
+  expected = n_tasks / lam
+  size = int(expected + 4. * math.sqrt(expected)) + 1
+  samples = []
+  total = 0
+  while total < n_tasks:
+    samples.append(rng.poisson(lam=lam, size=size))
+    total += int(samples[-1].sum())
+  arrivals = np.concatenate(samples)
+  acc_tasks = np.cumsum(arrivals)
+  last = int(np.searchsorted(acc_tasks, n_tasks))
+  arrivals = arrivals[:last+1]
+  arrivals[last] -= acc_tasks[last] - n_tasks
+  return arrivals
+
+def draw_nodes(rng, n_nodes, size, replace=True):
+  '''
+  Returns an array of size indices in [0, n_nodes) drawn from a
+  numpy.random.Generator rng, with or without replacement.
+  '''
+  if replace:
+    return rng.integers(0, n_nodes, size=size)
+  return rng.choice(n_nodes, size=size, replace=False)
+
 if __name__ == "__main__":
   set_seed(0)
 
@@ -0,0 +1,203 @@
+import math
+
+import numpy as np
+
+class _Column:
+  '''
+  Growable 1-D array that lives in memory or, when path is given, in a
+  memory-mapped file that is extended as it grows.
+  '''
+  def __init__(self, dtype, path=None, size=1024):
+    self._dtype = np.dtype(dtype)
+    self._path = path
+    self._size = 0
+    self._data = self._allocate(size, 'w+')
+
+  def __len__(self):
+    return self._size
+
+  def values(self):
+    '''
+    Returns a view of the stored values.
+    '''
+    return self._data[:self._size]
+
+  def extend(self, values):
+    n = len(values)
+    if self._size + n > len(self._data):
+      self._grow(max(2 * len(self._data), self._size + n))
+    self._data[self._size:self._size + n] = values
+    self._size += n
+
+  def reset(self, values):
+    '''
+    Replaces the stored values.
+    '''
+    self._size = 0
+    self.extend(values)
+
+  def flush(self):
+    if self._path is not None:
+      self._data.flush()
+
+  def _allocate(self, size, mode):
+    if self._path is None:
+      return np.zeros(size, dtype=self._dtype)
+    # r+ extends the file to the requested shape
+    return np.memmap(self._path, dtype=self._dtype, mode=mode, shape=(size,))
+
+  def _grow(self, size):
+    if self._path is None:
+      data = self._allocate(size, 'w+')
+      data[:self._size] = self._data[:self._size]
+      self._data = data
+    else:
+      self._data.flush()
+      self._data = self._allocate(size, 'r+')
+
+class TaskHistory:
+  '''
+  History of the task assignments of a WarehouseManager.
+
+  Paths are kept as node offsets (see Warehouse.node_offset()) in a flat
+  int32 buffer, and each assignment as the offset of its path in it, the index
+  of the agent in the AgentPool and the cost of its bid, so an assignment
+  takes a few bytes instead of a tuple of node names. When spill_path is
+  given, the arrays are memory-mapped to files named after it
+  (<spill_path>.nodes, .offsets, .agents and .costs), so long runs do not
+  grow the process memory.
+
+  Path length (in nodes, including the agent's node) and cost statistics are
+  kept on every append. When store_paths is False only those statistics are
+  kept.
+
+  Indexing and iterating yield (agent name, path) tuples, as the list it
+  replaces did.
+  '''
+  def __init__(self, w, names, store_paths=True, spill_path=None):
+    self._w = w
+    self._names = names
+    self._store_paths = store_paths
+    self._n_tasks = 0
+    self._length_sum = 0
+    self._length_squares = 0
+    self._cost_sum = 0.
+    self._cost_squares = 0.
+    if store_paths:
+      files = (lambda suffix: '{}.{}'.format(spill_path, suffix)) if spill_path is not None else (lambda suffix: None)
+      self._nodes = _Column(np.int32, files('nodes'))
+      self._offsets = _Column(np.int64, files('offsets'))
+      self._offsets.extend([0])
+      self._agents = _Column(np.int32, files('agents'))
+      self._costs = _Column(np.float64, files('costs'))
+
+  def append(self, agent, path, cost):
+    '''
+    Records that agent got a mission along path (which starts at its node)
+    with the given cost.
+    '''
+    n = len(path)
+    cost = float(cost)
+    self._n_tasks += 1
+    self._length_sum += n
+    self._length_squares += n * n
+    self._cost_sum += cost
+    self._cost_squares += cost * cost
+    if self._store_paths:
+      self._nodes.extend([self._w.node_offset(node) for node in path])
+      self._offsets.extend([len(self._nodes)])
+      self._agents.extend([agent.index()])
+      self._costs.extend([cost])
+
+  def __len__(self):
+    return self._n_tasks
+
+  def __getitem__(self, i):
+    if not self._store_paths:
+      raise ValueError('Paths are not stored, only their statistics')
+    if i < 0:
+      i += self._n_tasks
+    if not 0 <= i < self._n_tasks:
+      raise IndexError('Task assignment index out of range: {}'.format(i))
+    offsets = self._offsets.values()
+    nodes = self._nodes.values()[offsets[i]:offsets[i + 1]].tolist()
+    return (self._names(self._agents.values().item(i)), [self._w.node_from_offset(o) for o in nodes])
+
+  def __iter__(self):
+    for i in range(0, len(self)):
+      yield self[i]
+
+  def stores_paths(self):
+    return self._store_paths
+
+  def path_lengths(self):
+    '''
+    Returns an array with the number of nodes of every path.
+    '''
+    if not self._store_paths:
+      raise ValueError('Paths are not stored, only their statistics')
+    return np.diff(self._offsets.values())
+
+  def costs(self):
+    '''
+    Returns an array with the cost of every assignment.
+    '''
+    if not self._store_paths:
+      raise ValueError('Paths are not stored, only their statistics')
+    return self._costs.values()
+
+  def average_path_length(self):
+    return self._length_sum / self._n_tasks
+
+  def path_length_std(self):
+    return TaskHistory._std(self._n_tasks, self._length_sum, self._length_squares)
+
+  def average_cost(self):
+    return self._cost_sum / self._n_tasks
+
+  def cost_std(self):
+    return TaskHistory._std(self._n_tasks, self._cost_sum, self._cost_squares)
+
+  def state(self):
+    '''
+    Returns the running sums and, when paths are stored, the arrays of the
+    assignments, see load_state().
+    '''
+    state = {
+      'n_tasks': np.int64(self._n_tasks),
+      'length_sum': np.int64(self._length_sum),
+      'length_squares': np.int64(self._length_squares),
+      'cost_sum': np.float64(self._cost_sum),
+      'cost_squares': np.float64(self._cost_squares),
+    }
+    if self._store_paths:
+      state.update(nodes=self._nodes.values(), offsets=self._offsets.values(), agents=self._agents.values(), costs=self._costs.values())
+    return state
+
+  def load_state(self, state):
+    '''
+    Restores a state() of a history that stores paths alike. Memory-mapped
+    arrays are written back to their files.
+    '''
+    if self._store_paths != ('nodes' in state):
+      raise ValueError('State of a history that {} paths'.format('stores' if 'nodes' in state else 'does not store'))
+    self._n_tasks = state['n_tasks'].item()
+    self._length_sum = state['length_sum'].item()
+    self._length_squares = state['length_squares'].item()
+    self._cost_sum = state['cost_sum'].item()
+    self._cost_squares = state['cost_squares'].item()
+    if self._store_paths:
+      for name, column in (('nodes', self._nodes), ('offsets', self._offsets), ('agents', self._agents), ('costs', self._costs)):
+        column.reset(state[name])
+
+  def flush(self):
+    '''
+    Writes the memory-mapped arrays to their files.
+    '''
+    if self._store_paths:
+      for column in (self._nodes, self._offsets, self._agents, self._costs):
+        column.flush()
+
+  def _std(n, total, squares):
+    # Population standard deviation from the running sums
+    return math.sqrt(max(squares / n - (total / n) ** 2, 0.))
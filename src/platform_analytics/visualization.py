@@ -0,0 +1,117 @@
+import numpy as np
+
+# Largest warehouse, in nodes, plot() draws as a graph. Larger ones are drawn
+# as a heat map.
+GRAPH_MAX_NODES = 400
+# Label and color of the lines of each occupancy cost
+ELASTICITIES = {0.: ('Inelastic', 'b'), 0.1: ('Elastic', 'r'), 1.: ('Highly elastic', 'g')}
+
+def plot(w, path=None):
+  '''
+  Plots a warehouse: its graph when it has up to GRAPH_MAX_NODES nodes and a
+  heat map of its edge occupancy otherwise. Shows the figure or, when path is
+  given, saves it there without a display.
+  '''
+  rows, cols = w.shape()
+  if rows * cols <= GRAPH_MAX_NODES:
+    plot_graph(w, path)
+  else:
+    plot_heatmap(w, path=path)
+
+def plot_graph(w, path=None):
+  '''
+  Draws the graph of a warehouse with networkx, nodes at their (row, col).
+  '''
+  import networkx as nx
+  fig, ax = _figure(path)
+  rows, cols = w.shape()
+  pos = {w.node_from_offset(offset): w.node_index(w.node_from_offset(offset)) for offset in range(0, rows * cols)}
+  nx.draw(w.graph(), pos=pos, ax=ax, with_labels=True, font_weight='bold')
+  _show(fig, path)
+
+def edge_raster(w, values=None):
+  '''
+  Returns an image of values by edge offset (see Warehouse.edge_offset()), by
+  default the edge occupancy, of (2 rows - 1, 2 cols - 1) pixels: nodes are
+  at even coordinates and edges between their end points. Node pixels take
+  the largest value of their edges.
+  '''
+  rows, cols = w.shape()
+  values = w.edge_occupancies() if values is None else np.asarray(values)
+  # Value of the row (0) and column (1) edge that starts at each node
+  edges = values.reshape(rows, cols, 2).astype(np.float64)
+  row_edges = edges[:, :-1, 0]
+  col_edges = edges[:-1, :, 1]
+  nodes = np.zeros((rows, cols))
+  np.maximum(nodes[:, :-1], row_edges, out=nodes[:, :-1])
+  np.maximum(nodes[:, 1:], row_edges, out=nodes[:, 1:])
+  np.maximum(nodes[:-1, :], col_edges, out=nodes[:-1, :])
+  np.maximum(nodes[1:, :], col_edges, out=nodes[1:, :])
+
+  raster = np.zeros((2 * rows - 1, 2 * cols - 1))
+  raster[0::2, 0::2] = nodes
+  raster[0::2, 1::2] = row_edges
+  raster[1::2, 0::2] = col_edges
+  return raster
+
+def plot_heatmap(w, values=None, path=None, title='Edge occupancy'):
+  '''
+  Draws values by edge offset, by default the edge occupancy, as a raster
+  image (see edge_raster()). It is a single image whatever the size of the
+  warehouse, so it scales to grids nx.draw cannot handle.
+  '''
+  fig, ax = _figure(path)
+  image = ax.imshow(edge_raster(w, values), cmap='inferno', interpolation='nearest')
+  fig.colorbar(image, ax=ax)
+  ax.set_title(title, size=10)
+  ax.set_xlabel('Column')
+  ax.set_ylabel('Row')
+  rows, cols = w.shape()
+  # Pixels are half a node apart
+  ax.xaxis.set_major_formatter(lambda x, pos: '{:g}'.format(x / 2))
+  ax.yaxis.set_major_formatter(lambda y, pos: '{:g}'.format(y / 2))
+  _show(fig, path)
+
+def plot_metric_vs_demand(path, table, ylabel, title):
+  '''
+  Plots a metric against lam, with a subplot per number of agents and a line
+  per occupancy cost in a band of its confidence interval, and saves it to
+  path. table is a metric of process_results.summarize() with
+  occupancy_cost unstacked.
+  '''
+  n_agents = table.index.unique('n_agents')
+  fig, _ = _figure(path, figsize=(6.4, 2.4 * max(len(n_agents), 2)), subplot=False)
+  for i, n in enumerate(n_agents):
+    ax = fig.add_subplot(len(n_agents), 1, i + 1)
+    rows = table.loc[n]
+    for cost in rows['mean'].columns:
+      label, color = ELASTICITIES.get(cost, ('Occupancy cost {}'.format(cost), None))
+      mean = rows['mean'][cost].dropna()
+      ci = rows['ci'][cost].reindex(mean.index).fillna(0)
+      line, = ax.plot(mean.index, mean, color=color, alpha=0.5, label=label)
+      ax.fill_between(mean.index, mean - ci, mean + ci, color=line.get_color(), alpha=0.15)
+    ax.grid()
+    ax.legend()
+    ax.set_ylabel(ylabel)
+    ax.set_title('{} - {} agents'.format(title, n), size=10)
+  ax.set_xlabel('Lambda')
+  fig.tight_layout()
+  _show(fig, path)
+  return path
+
+def _figure(path, figsize=None, subplot=True):
+  # Figures saved to a file are drawn without pyplot, so they need no display
+  if path is None:
+    import matplotlib.pyplot as plt
+    fig = plt.figure(figsize=figsize)
+  else:
+    from matplotlib.figure import Figure
+    fig = Figure(figsize=figsize)
+  return fig, fig.add_subplot() if subplot else None
+
+def _show(fig, path):
+  if path is None:
+    import matplotlib.pyplot as plt
+    plt.show()
+  else:
+    fig.savefig(path)
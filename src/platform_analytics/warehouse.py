@@ -1,5 +1,5 @@
 import networkx as nx
-import matplotlib.pyplot as plt
+import numpy as np
 
 class Warehouse:
   '''
@@ -8,7 +8,15 @@ class Warehouse:
   Edges have a weight of a x + b where a is the congestion scale, x is the number
   of agents traversing the edge and b is a base cost.
 
-  TODO: involve node capacity.
+  The set of occupied edges and the flow cost (the sum of the cost of those
+  edges) are kept up to date on every occupancy change, so reading them does
+  not require a scan of the graph.
+
+  Every change of an edge cost bumps a warehouse version which is also stamped
+  on the edge, so cached results can tell whether the edges they used changed.
+
+  Node capacity is enforced over time by a ReservationTable (see
+  reservation_table.py), not by the warehouse itself.
   '''
   def __init__(self, rows, cols, node_capacity=-1, edge_base_cost=1., occupancy_cost=0.):
     self._rows = rows
@@ -16,11 +24,20 @@ class Warehouse:
     self._edge_base_cost = edge_base_cost
     self._occupancy_cost = occupancy_cost
     self._graph = nx.Graph()
+    self._node_index = dict()
+    # Nodes by offset (see node_offset())
+    self._nodes = []
+    self._occupied_edges = set()
+    self._occupied_weight = 0.
+    self._total_occupancy = 0
+    self._version = 0
     # Add nodes
     for i in range(0, rows):
       for j in range(0, cols+1):
         name = Warehouse._get_node_name(i, j)
         self._graph.add_node(name)
+        self._node_index[name] = (i, j)
+        self._nodes.append(name)
         self._graph.nodes[name]['capacity'] = node_capacity
         self._graph.nodes[name]['available_capacity'] = node_capacity
 
@@ -31,6 +48,7 @@ class Warehouse:
         self._graph.add_edge(Warehouse._get_node_name(i, j), Warehouse._get_node_name(i, j+1))
         self._graph.edges[e]['weight'] = self._edge_base_cost
         self._graph.edges[e]['occupancy'] = 0
+        self._graph.edges[e]['version'] = 0
   
     # Add column edges
     for i in range(0, rows-1):
@@ -39,6 +57,7 @@ class Warehouse:
         self._graph.add_edge(Warehouse._get_node_name(i, j), Warehouse._get_node_name(i+1, j))
         self._graph.edges[e]['weight'] = self._edge_base_cost
         self._graph.edges[e]['occupancy'] = 0
+        self._graph.edges[e]['version'] = 0
 
   def graph(self):
     '''
@@ -46,6 +65,65 @@ class Warehouse:
     '''
     return self._graph
 
+  def edge_base_cost(self):
+    return self._edge_base_cost
+
+  def occupancy_cost(self):
+    return self._occupancy_cost
+
+  def shape(self):
+    '''
+    Returns the number of rows and columns of nodes: (rows, cols + 1)
+    '''
+    return (self._rows, self._cols + 1)
+
+  def node_id(self, row, col):
+    '''
+    Returns the node at (row, col).
+    '''
+    return Warehouse._get_node_name(row, col)
+
+  def node_index(self, name):
+    '''
+    Returns a tuple of integers from a node name: (row, col)
+    '''
+    return self._node_index[name]
+
+  def manhattan_distance(self, n_i, n_j):
+    '''
+    Returns the number of hops between two nodes of the grid.
+    '''
+    (r_i, c_i), (r_j, c_j) = self._node_index[n_i], self._node_index[n_j]
+    return abs(r_i - r_j) + abs(c_i - c_j)
+
+  def node_offset(self, name):
+    '''
+    Returns a dense integer index of the node: row * (cols + 1) + col
+    '''
+    row, col = self._node_index[name]
+    return row * (self._cols + 1) + col
+
+  def node_from_offset(self, offset):
+    '''
+    Returns the node whose offset is offset.
+    '''
+    return self._nodes[offset]
+
+  def edge_offset(self, n_i, n_j):
+    '''
+    Returns a dense integer index of the edge, lower than twice the number of
+    nodes: 2 * (offset of its first end point) + 0 for row edges and + 1 for
+    column edges.
+    '''
+    a, b = sorted((self.node_offset(n_i), self.node_offset(n_j)))
+    return 2 * a + (0 if b - a == 1 else 1)
+
+  def neighbors(self, name):
+    '''
+    Returns an iterator over the adjacent nodes of name.
+    '''
+    return self._graph.neighbors(name)
+
   def node_capacity(self, name):
     '''
     Returns the node capacity.
@@ -56,21 +134,123 @@ class Warehouse:
     '''
     Clears the occupancy of all edges.
     '''
+    self._version += 1
     for e in self._graph.edges:
+      if self._graph.edges[e]['occupancy'] > 0:
+        self._graph.edges[e]['version'] = self._version
       self._graph.edges[e]['occupancy'] = 0
+    self._occupied_edges.clear()
+    self._occupied_weight = 0.
+    self._total_occupancy = 0
 
   def increase_edge_occupancy(self, edge):
     '''
     Increases by 1 the occupancy of an edge.
     '''
-    self._graph.edges[edge]['occupancy'] = self._graph.edges[edge]['occupancy'] + 1
+    e = self._graph.edges[edge]
+    e['occupancy'] = e['occupancy'] + 1
+    self._total_occupancy += 1
+    self._stamp(e)
+    if e['occupancy'] == 1:
+      self._occupied_edges.add(self.edge_key(*edge))
+      self._occupied_weight += e['weight']
 
   def decrease_edge_occupancy(self, edge):
     '''
-    Increases by 1 the occupancy of an edge.
+    Decreases by 1 the occupancy of an edge.
     '''
     e = self._graph.edges[edge]
-    e['occupancy'] = max(0, e['occupancy'] - 1)
+    if e['occupancy'] == 0:
+      return
+    e['occupancy'] = e['occupancy'] - 1
+    self._total_occupancy -= 1
+    self._stamp(e)
+    if e['occupancy'] == 0:
+      self._occupied_edges.discard(self.edge_key(*edge))
+      # Resets the accumulator when possible so it does not drift
+      self._occupied_weight = self._occupied_weight - e['weight'] if self._occupied_edges else 0.
+
+  def update_edges_occupancy(self, us, vs, delta):
+    '''
+    Adds delta (1 or -1) to the occupancy of the edges joining the nodes whose
+    offsets are us[k] and vs[k].
+    '''
+    update = self.increase_edge_occupancy if delta > 0 else self.decrease_edge_occupancy
+    for u, v in zip(us.tolist(), vs.tolist()):
+      update((self._nodes[u], self._nodes[v]))
+
+  def version(self):
+    '''
+    Returns a counter that increases every time an edge cost changes.
+    '''
+    return self._version
+
+  def edge_key(self, n_i, n_j):
+    '''
+    Returns a hashable key of the edge that does not depend on its direction.
+    '''
+    return (n_i, n_j) if n_i < n_j else (n_j, n_i)
+
+  def edge_key_offsets(self, keys):
+    '''
+    Returns an array with the offsets (see edge_offset()) of the edges whose
+    keys (see edge_key()) are keys.
+    '''
+    return np.array([self.edge_offset(*key) for key in keys], dtype=np.int64)
+
+  def edge_keys_from_offsets(self, offsets):
+    '''
+    Returns the keys of the edges whose offsets are offsets, as a list.
+    '''
+    keys = []
+    for offset in np.asarray(offsets).tolist():
+      a = offset // 2
+      keys.append(self.edge_key(self._nodes[a], self._nodes[a + (1 if offset % 2 == 0 else self._cols + 1)]))
+    return keys
+
+  def incident_edges(self, nodes):
+    '''
+    Returns the keys of all the edges incident to nodes.
+    '''
+    return [self.edge_key(*e) for e in self._graph.edges(nodes)]
+
+  def edges_changed_since(self, edges, version):
+    '''
+    Returns True when the cost of any of the edges (given as keys) changed
+    after version.
+    '''
+    return any(self._graph.edges[e]['version'] > version for e in edges)
+
+  def changed_edges(self, nodes, version):
+    '''
+    Returns the end points of the edges incident to nodes whose cost changed
+    after version.
+    '''
+    return [(u, v) for u, v, edge_version in self._graph.edges(nodes, data='version') if edge_version > version]
+
+  def _stamp(self, e):
+    # Occupancy only changes the cost when it is priced
+    if self._occupancy_cost != 0:
+      self._version += 1
+      e['version'] = self._version
+
+  def occupied_edges(self):
+    '''
+    Returns the set of edges with at least one agent, as (n_i, n_j) tuples.
+    '''
+    return self._occupied_edges
+
+  def flow_cost(self):
+    '''
+    Returns the sum of the cost of all the occupied edges.
+    '''
+    return self._occupied_weight + self._occupancy_cost * self._total_occupancy
+
+  def edge_occupancy(self, n_i, n_j):
+    '''
+    Returns the number of agents traversing the edge.
+    '''
+    return self._graph.edges[(n_i, n_j)]['occupancy']
 
   def path_cost(self, path):
     '''
@@ -82,14 +262,68 @@ class Warehouse:
       cost += self.get_edge_cost(path[i], path[i+1])
     return cost
 
-  def plot(self):
+  def edge_occupancies(self):
+    '''
+    Returns an array with the occupancy of every edge, indexed by edge offset
+    (see edge_offset()).
+    '''
+    rows, cols = self.shape()
+    occupancy = np.zeros(2 * rows * cols, dtype=np.int64)
+    for n_i, n_j in self._occupied_edges:
+      occupancy[self.edge_offset(n_i, n_j)] = self._graph.edges[(n_i, n_j)]['occupancy']
+    return occupancy
+
+  def state(self):
+    '''
+    Returns the edge occupancy and versions, indexed by edge offset, and the
+    running flow cost terms, see load_state().
+    '''
+    rows, cols = self.shape()
+    edge_version = np.zeros(2 * rows * cols, dtype=np.int64)
+    for n_i, n_j, version in self._graph.edges(data='version'):
+      edge_version[self.edge_offset(n_i, n_j)] = version
+    return {
+      'occupancy': self.edge_occupancies(),
+      'edge_version': edge_version,
+      'version': np.int64(self._version),
+      'occupied_weight': np.float64(self._occupied_weight),
+      'total_occupancy': np.int64(self._total_occupancy),
+    }
+
+  def load_state(self, state):
+    '''
+    Restores a state() of a warehouse of the same shape.
+    '''
+    rows, cols = self.shape()
+    if len(state['occupancy']) != 2 * rows * cols:
+      raise ValueError('State of {} edge offsets for a warehouse of {}'.format(len(state['occupancy']), 2 * rows * cols))
+    occupancy = state['occupancy'].tolist()
+    edge_version = state['edge_version'].tolist()
+    self._occupied_edges = set()
+    for n_i, n_j, e in self._graph.edges(data=True):
+      offset = self.edge_offset(n_i, n_j)
+      e['occupancy'] = occupancy[offset]
+      e['version'] = edge_version[offset]
+      if e['occupancy'] > 0:
+        self._occupied_edges.add(self.edge_key(n_i, n_j))
+    self._version = state['version'].item()
+    # Restored as is rather than summed again, so the costs keep their bits
+    self._occupied_weight = state['occupied_weight'].item()
+    self._total_occupancy = state['total_occupancy'].item()
+
+  def plot(self, path=None):
+    '''
+    Plots the warehouse, see visualization.plot().
+    '''
+    # Imported here so the simulation does not depend on matplotlib
+    import visualization
+    visualization.plot(self, path)
+
+  def get_edge_cost_at(self, n_i, n_j, occupancy):
     '''
-    Generates a matplotlib plot of the graph.
+    Returns the edge cost if it had occupancy agents traversing it.
     '''
-    plt.figure()
-    pos = {node_name: Warehouse._get_node_index(node_name) for node_name in self._graph.nodes}
-    nx.draw(self._graph, pos=pos, with_labels=True, font_weight='bold')
-    plt.show()
+    return self._graph.edges[(n_i, n_j)]['weight'] + self._occupancy_cost * occupancy
 
   def get_edge_cost(self, n_i, n_j):
     '''
@@ -1,29 +1,161 @@
 import sys
-import logging
-
-from agent import Agent
+from collections import Counter
+
+import numpy as np
+
+import checkpoint
+from agent_index import AgentIndex
+from agent_pool import AgentPool
+from assignment import linear_sum_assignment
+from dstar_lite import DStarLite
+from event_trace import ASSIGN, FINISH, NO_IDLE_AGENT, NODE_FULL, REROUTE, TICK, UNREACHABLE
+from occupancy_forecast import OccupancyForecast
+from metrics import Metrics
+from path_cache import PathCache
+from path_search import dijkstra_to_targets, l_path, path_to_source
+from profiling import timed
+from reservation_table import ReservationTable
+from task_history import TaskHistory
 from warehouse import Warehouse
 from task_creator import sample_nodes, set_seed
 
 class WarehouseManager:
   '''
   Manages a Warehouse and a set of Agents.
+
+  The bidding argument selects how agents' proposals are computed:
+  - 'per_agent': each unassigned agent plans its own path to the task with
+    planner (see planner.py), Dijkstra when it is None.
+  - 'reverse': a single search from the task node reaches every unassigned
+    agent and their paths are rebuilt from its predecessor tree. When
+    path_cache is greater than 0, up to that many trees are cached by task
+    node and reused while the edges they scanned keep their cost.
+
+  When spatial_index is greater than 0, unassigned agents are kept in an
+  AgentIndex with buckets of that size. Per agent bids then visit the agents
+  from the closest to the farthest ones and stop as soon as the Manhattan
+  lower bound of the remaining agents' costs is not below the best bid, and
+  each search is given the best bid so far as a cost bound. The winner is the
+  agent with the least cost (the first one found on ties). Reverse bids stop
+  at the first unassigned agent the search settles. Either way the winner is
+  one of the cheapest agents of per agent bids, and when debug is True every
+  indexed or reverse bid is checked against the per agent proposals.
+
+  When some node of the warehouse has a capacity (other than -1), agents'
+  paths are reserved in a ReservationTable of reservation_horizon ticks, bids
+  only propose paths that respect the capacities of the nodes on every tick,
+  and tick() checks the capacities (and, when debug is True, that agents'
+  nodes match the reservations). It requires
+  per agent bidding and greedy assignment; tasks that no idle agent can reach
+  stay pending.
+
+  When replan_period is greater than 0 and the warehouse is elastic to
+  traffic, every replan_period ticks the assigned agents are re-planned to
+  the end of their paths and rerouted when a cheaper path shows up. Each
+  agent keeps a DStarLite search for its mission, so a re-planning only
+  repairs the part of the search affected by the edges whose cost changed
+  since the previous one. It cannot be combined with node capacity.
+
+  When forecast_horizon is greater than 0 and the warehouse is elastic to
+  traffic, the manager keeps an OccupancyForecast of the next forecast_horizon
+  ticks from the assigned agents' paths and bids price every edge with the
+  occupancy forecast for the tick the agent would traverse it. It requires
+  per agent bidding and greedy assignment.
+
+  Agents are placed at random nodes unless agent_nodes gives their nodes.
+  Their state lives in an AgentPool, so all of them move in a single
+  vectorized step, and the assigned and unassigned agents are kept in
+  insertion ordered dicts (used as ordered sets).
+
+  Tasks can be assigned one at a time with process_task(), greedily, or in
+  batches with process_tasks(), which solves the agent x task assignment that
+  minimizes the total cost.
+
+  When closed_form is True and the warehouse is inelastic to traffic
+  (occupancy_cost == 0) every path cost is the Manhattan distance times the
+  edge base cost, so bids are computed in closed form for all the unassigned
+  agents at once and only the winner gets a (canonical L-shaped) path. The
+  winner is the same as with per agent bids, the first cheapest agent, and
+  when debug is True every bid is checked against the per agent proposals.
+
+  Task assignments are recorded in a TaskHistory. When store_paths is False
+  it only keeps path length and cost statistics, and when history_path is
+  given its arrays are memory-mapped to files named after it.
+
+  The wait (arrival to assignment) and completion (arrival to idle agent)
+  times of the tasks and the throughput are recorded in a Metrics object as
+  tasks are assigned and agents finish.
+
+  Edge occupancy is maintained by deltas: only the edges that agents leave and
+  enter are updated. When debug is True, every update is checked against a
+  full recompute of the occupancy.
+
+  When trace (an EventTrace) is given, assignments, tasks left waiting,
+  finished agents, reroutes and the cost of every tick are recorded in it.
+
+  state() returns the state of the manager, its warehouse and its agents as
+  NumPy arrays and load_state() restores it on a manager built alike, so a
+  run can be checkpointed (see Simulator.checkpoint()).
   '''
-  def __init__(self, w, n_agents=10):
+  BIDDING_MODES = ('per_agent', 'reverse')
+
+  def __init__(self, w, n_agents=10, bidding='per_agent', debug=False, planner=None, closed_form=False, path_cache=0, agent_nodes=None, spatial_index=0, reservation_horizon=None, replan_period=0, forecast_horizon=0, store_paths=True, history_path=None, trace=None):
+    if bidding not in WarehouseManager.BIDDING_MODES:
+      raise ValueError('Unknown bidding mode: {}'.format(bidding))
     self._w = w
+    self._bidding = bidding
+    self._closed_form = closed_form and w.occupancy_cost() == 0
+    self._path_cache = PathCache(path_cache) if path_cache > 0 else None
+    self._agent_index = AgentIndex(w, spatial_index) if spatial_index > 0 else None
+    self._debug = debug
+    self._trace = trace
     self._utilitarian_cost = 0.
 
-    nodes = self.nodes()
-    self._unassigned_agents = []
-    self._assigned_agents = []
-    for i in range(0, n_agents):
-      n = sample_nodes(nodes)
-      nodes.remove(n)
-      agent = Agent(WarehouseManager._agent_name(i), n)
+    if agent_nodes is None:
+      # Samples the agents' nodes one by one without replacement
+      agent_nodes = []
+      nodes = self.nodes()
+      for i in range(0, n_agents):
+        agent_nodes.append(sample_nodes(nodes))
+        nodes.remove(agent_nodes[-1])
+    self._pool = AgentPool(w)
+    self._unassigned_agents = dict()
+    self._assigned_agents = dict()
+    for i, n in enumerate(agent_nodes):
+      agent = self._pool.add(WarehouseManager._agent_name(i), n, planner)
       self._w.graph().nodes[n]['agents'] = [agent]
-      self._unassigned_agents.append(agent)
-
-    self._task_assingments = []
+      self._unassigned_agents[agent] = None
+    # Edge whose occupancy each agent holds, i.e. its last known next move,
+    # as node offsets by agent index (-1s when it holds none).
+    self._held_edges = np.full((len(self._pool), 2), -1, dtype=np.int64)
+    # Arrival tick of each agent's task and tick it will be idle again
+    self._arrival_ticks = np.zeros(len(self._pool), dtype=np.int64)
+    self._finish_ticks = np.zeros(len(self._pool), dtype=np.int64)
+    self._index_agents(self._unassigned_agents)
+
+    self._reservations = None
+    if any(w.node_capacity(n) >= 0 for n in w.graph().nodes):
+      if bidding != 'per_agent' or self._closed_form:
+        raise ValueError('Node capacity is only enforced with per agent bidding')
+      self._reservations = ReservationTable(w, agent_nodes, reservation_horizon)
+      self._reservations.check(self._unassigned_agents)
+
+    # Re-planning only pays off when occupancy changes the edge costs
+    self._replan_period = replan_period if w.occupancy_cost() != 0 else 0
+    if self._replan_period > 0 and self._reservations is not None:
+      raise ValueError('Agents cannot be re-planned under node capacity')
+    self._forecast = None
+    if forecast_horizon > 0 and w.occupancy_cost() != 0:
+      if bidding != 'per_agent':
+        raise ValueError('Occupancy forecasts are only used with per agent bidding')
+      self._forecast = OccupancyForecast(w, forecast_horizon)
+
+    # Agent -> DStarLite search of its mission
+    self._replanners = dict()
+    self._ticks = 0
+    self._metrics = Metrics()
+
+    self._task_assingments = TaskHistory(w, self._pool.name, store_paths, history_path)
 
   def warehouse(self):
     '''
@@ -41,17 +173,18 @@ class WarehouseManager:
     '''
     Returns the list of assigned agents.
     '''
-    return self._assigned_agents
+    return list(self._assigned_agents)
 
   def unassigned_agents(self):
     '''
     Returns the list of unassigned agents.
     '''
-    return self._unassigned_agents
+    return list(self._unassigned_agents)
 
   def task_assingments(self):
     '''
-    Returns the list of task assignments in the form of (agent, path)
+    Returns the TaskHistory of the task assignments, a sequence of
+    (agent, path) unless it only keeps statistics.
     '''
     return self._task_assingments
 
@@ -63,10 +196,90 @@ class WarehouseManager:
     '''
     return self._utilitarian_cost
 
-  def process_task(self, task):
+  def ticks(self):
+    '''
+    Returns the number of ticks elapsed.
+    '''
+    return self._ticks
+
+  def metrics(self):
+    '''
+    Returns the Metrics of the wait and completion times of the tasks and of
+    the throughput.
+    '''
+    return self._metrics
+
+  def cache_stats(self):
+    '''
+    Returns the path cache counters or None when there is no cache.
+    '''
+    return self._path_cache.stats() if self._path_cache is not None else None
+
+  def state(self):
+    '''
+    Returns the state of the manager, its warehouse and the components it
+    keeps as a dict of NumPy arrays (see checkpoint.py). The trace is left to
+    its owner.
+    '''
+    indices = lambda agents: np.array([agent.index() for agent in agents], dtype=np.int64)
+    state = {
+      'unassigned': indices(self._unassigned_agents),
+      'assigned': indices(self._assigned_agents),
+      'held_edges': self._held_edges,
+      'arrival_ticks': self._arrival_ticks,
+      'finish_ticks': self._finish_ticks,
+      'ticks': np.int64(self._ticks),
+      'utilitarian_cost': np.float64(self._utilitarian_cost),
+      'replanned': indices(self._replanners),
+    }
+    state.update(checkpoint.nest('w', self._w.state()))
+    state.update(checkpoint.nest('pool', self._pool.state()))
+    state.update(checkpoint.nest('metrics', self._metrics.state()))
+    state.update(checkpoint.nest('history', self._task_assingments.state()))
+    state.update(checkpoint.nest('replanners', checkpoint.pack([replanner.state() for replanner in self._replanners.values()], DStarLite.STATE)))
+    if self._agent_index is not None:
+      state.update(checkpoint.nest('agent_index', self._agent_index.state()))
+    if self._reservations is not None:
+      state.update(checkpoint.nest('reservations', self._reservations.state()))
+    if self._forecast is not None:
+      state.update(checkpoint.nest('forecast', self._forecast.state()))
+    if self._path_cache is not None:
+      state.update(checkpoint.nest('path_cache', self._path_cache.state(self._w)))
+    return state
+
+  def load_state(self, state):
+    '''
+    Restores a state() of a manager built with the same arguments.
+    '''
+    agents = self._pool.agents()
+    self._w.load_state(checkpoint.section(state, 'w'))
+    self._pool.load_state(checkpoint.section(state, 'pool'))
+    self._unassigned_agents = dict.fromkeys(agents[i] for i in state['unassigned'].tolist())
+    self._assigned_agents = dict.fromkeys(agents[i] for i in state['assigned'].tolist())
+    self._held_edges[:] = state['held_edges']
+    self._arrival_ticks[:] = state['arrival_ticks']
+    self._finish_ticks[:] = state['finish_ticks']
+    self._ticks = state['ticks'].item()
+    self._utilitarian_cost = state['utilitarian_cost'].item()
+    self._metrics.load_state(checkpoint.section(state, 'metrics'))
+    self._task_assingments.load_state(checkpoint.section(state, 'history'))
+    replanners = checkpoint.unpack(checkpoint.section(state, 'replanners'), DStarLite.STATE)
+    self._replanners = {agents[i]: DStarLite.from_state(self._w, replanner) for i, replanner in zip(state['replanned'].tolist(), replanners)}
+    if self._agent_index is not None:
+      self._agent_index.load_state(checkpoint.section(state, 'agent_index'), agents)
+    if self._reservations is not None:
+      self._reservations.load_state(checkpoint.section(state, 'reservations'))
+    if self._forecast is not None:
+      self._forecast.load_state(checkpoint.section(state, 'forecast'))
+    if self._path_cache is not None:
+      self._path_cache.load_state(checkpoint.section(state, 'path_cache'), self._w)
+
+  @timed('WarehouseManager.process_task')
+  def process_task(self, task, arrival_tick=None):
     '''
     Tries to process a task. When there are no available agents, it returns
-    False.
+    False. arrival_tick is the tick the task arrived on, the current one by
+    default.
 
     The assignment process follows:
     - A task is a node in graph to which an unassigned agent will be
@@ -80,70 +293,396 @@ class WarehouseManager:
       iteration.
     '''
     if not self._unassigned_agents:
-      logging.debug('All agents are busy. Try next time...')
+      self._trace_task(NO_IDLE_AGENT, task)
       return False
 
-    logging.debug('\t\tComputing agents\' costs for task: {}...'.format(task))
-    agent_path_bets = dict()
-    for agent in self._unassigned_agents:
-      agent_path_bets[agent] = dict()
-      path, cost = agent.path_and_cost_to(task, self._w)
-      agent_path_bets[agent]['path'] = path
-      agent_path_bets[agent]['cost'] = cost
-    logging.debug('\t\tFinished computing agents\' costs.')
+    if self._reservations is not None and not self._reservations.can_reach(task) and not any(agent.pos() == task for agent in self._unassigned_agents):
+      self._trace_task(NODE_FULL, task)
+      return False
 
-    logging.debug('\t\tFinding the best path...')
-    agent_path_bet = WarehouseManager._min_in_agents_path_bet(agent_path_bets)
-    logging.debug('\t\tBest path was found.')
+    if self._closed_form:
+      agent_path_bet = self._closed_form_bid(task)
+    elif self._bidding == 'reverse':
+      agent_path_bet = self._reverse_bid(task)
+    elif self._agent_index is not None:
+      agent_path_bet = self._indexed_bid(task)
+    else:
+      agent_path_bets = self._per_agent_bets(task)
+      agent_path_bet = WarehouseManager._min_in_agents_path_bet(agent_path_bets) if agent_path_bets else None
+    if self._debug and (self._closed_form or self._bidding == 'reverse' or self._agent_index is not None):
+      self._check_bid(task, agent_path_bet)
+
+    if agent_path_bet is None:
+      # No agent can reach the task without exceeding a node capacity
+      self._trace_task(UNREACHABLE, task)
+      return False
 
-    logging.debug('\t\tUpdate the agent assignment lists.')
-    self._unassigned_agents.remove(agent_path_bet[0])
-    self._assigned_agents.append(agent_path_bet[0])
+    del self._unassigned_agents[agent_path_bet[0]]
+    self._assigned_agents[agent_path_bet[0]] = None
+    self._unindex_agents([agent_path_bet[0]])
 
-    logging.debug('\t\tAssigns the mission to the agent.')
     agent_path_bet[0].assign_mission(agent_path_bet[1]['path'])
+    if self._reservations is not None:
+      self._reservations.reserve(agent_path_bet[0].pos(), agent_path_bet[1]['path'])
+    if self._forecast is not None:
+      self._forecast.add(agent_path_bet[0].pos(), agent_path_bet[1]['path'])
 
-    logging.debug('\t\tUpdate edge costs.')
-    self._update_weights()
+    self._update_weights([agent_path_bet[0]])
+    self._record_assignment(agent_path_bet[0], task, agent_path_bet[1]['cost'], arrival_tick)
 
-    logging.debug('\t\tRecord task solution: {}'.format((agent_path_bet[0].name(), [agent_path_bet[0].pos()] + agent_path_bet[1]['path'])))
-    self._task_assingments.append((agent_path_bet[0].name(), [agent_path_bet[0].pos()] + agent_path_bet[1]['path']))
+    self._task_assingments.append(agent_path_bet[0], [agent_path_bet[0].pos()] + agent_path_bet[1]['path'], agent_path_bet[1]['cost'])
     return True
 
+  @timed('WarehouseManager.process_tasks')
+  def process_tasks(self, tasks, arrival_ticks=None):
+    '''
+    Processes a batch of tasks at once and returns how many of them were
+    assigned. When there are more tasks than unassigned agents, only the first
+    ones (in tasks order) are considered. arrival_ticks are the ticks the
+    tasks arrived on, the current one by default.
+
+    The cost of every unassigned agent for every task is computed in one pass,
+    with one reverse search per distinct task node (or in closed form for
+    inelastic warehouses). The agent x task matrix is then solved as a linear
+    sum assignment, and the warehouse is updated once for all the new missions.
+
+    Costs are the same true path costs that per agent bids propose, so the
+    result compares with process_task() called for each task in order, which
+    gives every task to its cheapest agent. Unlike it, all the costs are priced
+    with the traffic before the batch, not after the earlier assignments.
+    '''
+    if self._reservations is not None:
+      raise ValueError('Node capacity is only enforced with greedy assignment')
+    if self._forecast is not None:
+      raise ValueError('Occupancy forecasts are only used with greedy assignment')
+    agents = list(self._unassigned_agents)
+    if tasks and not agents:
+      self._trace_task(NO_IDLE_AGENT, tasks[0])
+    tasks = tasks[:len(agents)]
+    if not tasks:
+      return 0
+
+    nodes = list(dict.fromkeys(tasks))
+    if self._closed_form:
+      positions = np.array([self._w.node_index(agent.pos()) for agent in agents])
+      targets = np.array([self._w.node_index(node) for node in nodes])
+      node_costs = self._w.edge_base_cost() * (np.abs(positions[:, 0, None] - targets[None, :, 0]) + np.abs(positions[:, 1, None] - targets[None, :, 1]))
+    else:
+      positions = [agent.pos() for agent in agents]
+      trees = [self._reverse_tree(node, positions, lambda tree: all(n in tree[0] for n in positions)) for node in nodes]
+      node_costs = np.array([[tree[0].get(n, np.inf) for tree in trees] for n in positions])
+    node_columns = {node: j for j, node in enumerate(nodes)}
+    columns = [node_columns[task] for task in tasks]
+    rows, cols = linear_sum_assignment(node_costs[:, columns])
+
+    assigned_agents = []
+    for row, col in sorted(zip(rows.tolist(), cols.tolist()), key=lambda pair: pair[1]):
+      agent = agents[row]
+      if self._closed_form:
+        path = l_path(self._w, agent.pos(), tasks[col])
+      else:
+        path = path_to_source(trees[columns[col]][1], agent.pos())
+      agent.assign_mission(path)
+      self._record_assignment(agent, tasks[col], node_costs[row, columns[col]], arrival_ticks[col] if arrival_ticks is not None else None)
+      assigned_agents.append(agent)
+      self._task_assingments.append(agent, [agent.pos()] + path, node_costs[row, columns[col]])
+
+    for agent in assigned_agents:
+      del self._unassigned_agents[agent]
+      self._assigned_agents[agent] = None
+    self._unindex_agents(assigned_agents)
+
+    self._update_weights(assigned_agents)
+    return len(assigned_agents)
+
+  @timed('WarehouseManager.tick')
   def tick(self):
     '''
     Evolves all the assigned agents (unassigned agents will remain still).
     Moves to the unassigned list those agents that finished their work.
     Update the weights in the graph for the next iteration.
     '''
-    logging.debug('\t\tTicking agents...')
-    for agent in self._assigned_agents:
-      agent.tick(self._w)
-    logging.debug('\t\tFinished agents.')
-
-    logging.debug('\t\tUpdating the assigned and unassigned agent lists...')
-    self._unassigned_agents = self._unassigned_agents + [agent for agent in self._assigned_agents if not agent.is_assigned()]
-    self._assigned_agents = [agent for agent in self._assigned_agents if agent.is_assigned()]
-
-    logging.debug('\t\tUpdate total costs.')
+    moved_agents = list(self._assigned_agents)
+    if self._forecast is not None:
+      self._forecast.advance(moved_agents)
+    # Only assigned agents have paths, the pool moves them all at once
+    finished_agents = self._pool.tick()
+    self._check_reservations(1)
+    self._finish(finished_agents)
     self._update_cost()
+    self._update_weights(moved_agents)
 
-    logging.debug('\t\tUpdate edge costs.')
-    self._update_weights()
+    self._ticks += 1
+    if self._replan_period > 0 and self._ticks % self._replan_period == 0:
+      self._replan()
 
-  def _update_weights(self):
-    # Clears all edge occupation
-    self._w.clear_edges_occupancy()
-    # Updates traffic based on edge occupation
+  @timed('WarehouseManager.advance')
+  def advance(self, n_ticks):
+    '''
+    Same as calling tick() n_ticks times in a row, with no task processed in
+    between, but without ticking one at a time: the utilitarian cost of each
+    skipped tick is computed from the edges the agents traverse in it.
+    Agents that may be re-planned, or whose moves feed a forecast, are ticked
+    one at a time.
+    '''
+    if self._replan_period > 0 or self._forecast is not None:
+      for i in range(0, n_ticks):
+        self.tick()
+      return
+    moved_agents = list(self._assigned_agents)
+    # Per skipped tick: agents per edge and the edge end points
+    traversals = [Counter() for i in range(0, n_ticks)]
+    edges = dict()
+    for agent in moved_agents:
+      n_i = agent.pos()
+      for step, n_j in enumerate(agent.path(0, n_ticks)):
+        key = self._w.edge_key(n_i, n_j)
+        traversals[step][key] += 1
+        edges[key] = (n_i, n_j)
+        n_i = n_j
+    # Agents become idle in the order tick() would have found them
+    finished_agents = self._pool.advance(n_ticks)
+    self._check_reservations(n_ticks)
+    self._ticks += n_ticks
+
+    for step, step_traversals in enumerate(traversals):
+      # Same as the flow cost: weight of the occupied edges plus the priced
+      # occupancy.
+      weight = sum(self._w.get_edge_cost_at(*edges[key], 0) for key in step_traversals)
+      cost = weight + self._w.occupancy_cost() * sum(step_traversals.values())
+      self._utilitarian_cost += cost
+      if self._trace is not None:
+        self._trace.record(self._ticks - n_ticks + step, TICK, cost=cost)
+
+    self._finish(finished_agents)
+    self._update_weights(moved_agents)
+
+  def _record_assignment(self, agent, task, cost, arrival_tick):
+    i = agent.index()
+    self._arrival_ticks[i] = arrival_tick if arrival_tick is not None else self._ticks
+    self._finish_ticks[i] = self._ticks + agent.remaining_ticks()
+    self._metrics.record_assignment(self._ticks - self._arrival_ticks.item(i))
+    if self._trace is not None:
+      self._trace.record(self._ticks, ASSIGN, i, self._w.node_offset(task), cost)
+
+  def _trace_task(self, event, task):
+    # Records why a task was left waiting
+    if self._trace is not None:
+      self._trace.record(self._ticks, event, node=self._w.node_offset(task))
+
+  @timed('WarehouseManager._finish')
+  def _finish(self, agents):
+    # Moves the agents that finished their missions to the unassigned ones
+    for agent in agents:
+      finish_tick = self._finish_ticks.item(agent.index())
+      # The task is completed on the tick before the agent is idle
+      self._metrics.record_completion(finish_tick - self._arrival_ticks.item(agent.index()), finish_tick - 1)
+      if self._trace is not None:
+        self._trace.record(finish_tick - 1, FINISH, agent.index(), self._w.node_offset(agent.pos()), finish_tick - self._arrival_ticks.item(agent.index()))
+      del self._assigned_agents[agent]
+      self._unassigned_agents[agent] = None
+      self._replanners.pop(agent, None)
+    self._index_agents(agents)
+
+  @timed('WarehouseManager._replan')
+  def _replan(self):
+    '''
+    Re-plans every assigned agent to the end of its path with its DStarLite
+    search, leaving its own traffic out of the costs. An agent is rerouted
+    when the new path is cheaper than what remains of its current one and not
+    longer in hops, so agents never arrive later than planned at assignment
+    and cannot be trapped going back and forth. Reroutes move the traffic at
+    once, so the next agents plan with it.
+    '''
     for agent in self._assigned_agents:
-      edge = agent.next_move()
-      if edge: self._w.increase_edge_occupancy(edge)
+      remaining = agent.path()
+      goal = remaining[-1]
+      replanner = self._replanners.get(agent)
+      if replanner is None or replanner.goal() != goal:
+        replanner = DStarLite(self._w, goal)
+        self._replanners[agent] = replanner
+      own_edge = self._held_edge(agent)
+      if own_edge: self._w.decrease_edge_occupancy(own_edge)
+      path, cost = replanner.plan(agent.pos())
+      current_cost = self._w.path_cost([agent.pos()] + remaining)
+      if own_edge: self._w.increase_edge_occupancy(own_edge)
+      if len(path) <= len(remaining) and cost < current_cost - 1e-9:
+        if self._forecast is not None:
+          self._forecast.remove(agent.pos(), remaining)
+          self._forecast.add(agent.pos(), path)
+        agent.assign_mission(path)
+        self._finish_ticks[agent.index()] = self._ticks + agent.remaining_ticks()
+        self._update_weights([agent])
+        if self._trace is not None:
+          self._trace.record(self._ticks, REROUTE, agent.index(), self._w.node_offset(goal), cost)
+
+  def _per_agent_bets(self, task):
+    '''
+    Returns the proposal of every unassigned agent that can reach task, as a
+    dict of agent to its path and cost.
+    '''
+    agent_path_bets = dict()
+    for agent in self._unassigned_agents:
+      result = agent.path_and_cost_to(task, self._w, reservations=self._reservations, forecast=self._forecast)
+      if result is None:
+        continue
+      agent_path_bets[agent] = dict()
+      path, cost = result
+      agent_path_bets[agent]['path'] = path
+      agent_path_bets[agent]['cost'] = cost
+    return agent_path_bets
 
-  def _update_cost(self):
-    logging.debug('\t\tUpdating the assigned and unassigned agent lists...')
+  def _check_bid(self, task, agent_path_bet):
+    '''
+    Compares a bid against the proposals of every unassigned agent. The bid
+    has to cost as much as the cheapest proposal and its agent has to be one
+    of the cheapest ones. Raises RuntimeError otherwise.
+    '''
+    bets = self._per_agent_bets(task)
+    if not bets:
+      if agent_path_bet is not None:
+        raise RuntimeError('Task {} was bid by {} but no agent can reach it'.format(task, agent_path_bet[0].name()))
+      return
+    cost = min(bet['cost'] for bet in bets.values())
+    tolerance = 1e-9 * max(1., cost)
+    cheapest = [agent for agent, bet in bets.items() if bet['cost'] <= cost + tolerance]
+    if agent_path_bet is None:
+      raise RuntimeError('Task {} was not bid but {} can reach it with cost {}'.format(task, cheapest[0].name(), cost))
+    if abs(agent_path_bet[1]['cost'] - cost) > tolerance or agent_path_bet[0] not in cheapest:
+      raise RuntimeError('Task {} was bid by {} with cost {} but the cheapest proposal is {} with cost {}'.format(task, agent_path_bet[0].name(), agent_path_bet[1]['cost'], cheapest[0].name(), cost))
+
+  def _reverse_bid(self, task):
+    '''
+    Runs one search from task that stops once every unassigned agent is
+    settled. Returns the agent with the least cost and its proposal in the same
+    form as _min_in_agents_path_bet().
+    '''
+    targets = [agent.pos() for agent in self._unassigned_agents]
+    # Agents outside a cached tree are at least as far as any node inside it,
+    # so the tree answers the bid as long as it reached one of the agents.
+    dist, pred = self._reverse_tree(task, targets, lambda tree: any(n in tree[0] for n in targets), 1 if self._agent_index is not None else None)
+    best_agent = None
+    for agent in self._unassigned_agents:
+      if agent.pos() in dist and (best_agent is None or dist[agent.pos()] < dist[best_agent.pos()]):
+        best_agent = agent
+    return best_agent, {'path': path_to_source(pred, best_agent.pos()), 'cost': dist[best_agent.pos()]}
+
+  def _reverse_tree(self, task, targets, accept, stop_after=None):
+    '''
+    Returns the (dist, pred) tree of a search from task that settles all
+    targets, or only the stop_after closest ones. A cached tree is used when
+    accept(tree) is True.
+    '''
+    tree = None
+    if self._path_cache is not None:
+      tree = self._path_cache.get(self._w, task, accept)
+    if tree is None:
+      tree = dijkstra_to_targets(self._w, task, targets, stop_after)
+      if self._path_cache is not None:
+        self._path_cache.put(self._w, task, tree, self._w.incident_edges(tree[0]))
+    return tree
+
+  def _indexed_bid(self, task):
+    '''
+    Visits the unassigned agents by rings of buckets around task and stops
+    once no agent left can beat the best bid. Every edge costs at least the
+    edge base cost, so base cost times the Manhattan distance is a lower bound
+    of an agent's cost. Returns the agent with the least cost and its proposal
+    in the same form as _min_in_agents_path_bet().
+    '''
+    base_cost = self._w.edge_base_cost()
+    best = None
+    best_cost = None
+    for lower_bound, agents in self._agent_index.rings(task):
+      if best is not None and base_cost * lower_bound >= best_cost:
+        break
+      hops = [self._w.manhattan_distance(agent.pos(), task) for agent in agents]
+      for i in sorted(range(0, len(agents)), key=hops.__getitem__):
+        if best is not None and base_cost * hops[i] >= best_cost:
+          break
+        result = agents[i].path_and_cost_to(task, self._w, best_cost, self._reservations, self._forecast)
+        if result is not None:
+          best_cost = result[1]
+          best = agents[i], {'path': result[0], 'cost': result[1]}
+    return best
+
+  def _closed_form_bid(self, task):
+    '''
+    Computes every unassigned agent's cost as its Manhattan distance to task
+    times the edge base cost. Returns the agent with the least cost and its
+    proposal in the same form as _min_in_agents_path_bet().
+    '''
+    agents = list(self._unassigned_agents)
+    positions = np.array([self._w.node_index(agent.pos()) for agent in agents])
+    row, col = self._w.node_index(task)
+    costs = self._w.edge_base_cost() * (np.abs(positions[:, 0] - row) + np.abs(positions[:, 1] - col))
+    i = int(np.argmin(costs))
+    agent = agents[i]
+    return agent, {'path': l_path(self._w, agent.pos(), task), 'cost': float(costs[i])}
+
+  @timed('WarehouseManager._check_reservations')
+  def _check_reservations(self, n_ticks):
+    # Moves the reservations along with the agents and checks they agree
+    if self._reservations is not None:
+      self._reservations.advance(n_ticks)
+      self._reservations.check(self._pool.agents() if self._debug else None)
+
+  def _index_agents(self, agents):
+    if self._agent_index is not None:
+      for agent in agents:
+        self._agent_index.add(agent)
+
+  def _unindex_agents(self, agents):
+    if self._agent_index is not None:
+      for agent in agents:
+        self._agent_index.remove(agent)
+
+  def _held_edge(self, agent):
+    u, v = self._held_edges[agent.index()].tolist()
+    return (self._w.node_from_offset(u), self._w.node_from_offset(v)) if v >= 0 else None
+
+  @timed('WarehouseManager._update_weights')
+  def _update_weights(self, agents):
+    # Moves the traffic of each agent from the edge it held to its next move,
+    # all the agents at once
+    indices = np.fromiter((agent.index() for agent in agents), dtype=np.int64, count=len(agents))
+    held = self._held_edges[indices]
+    edges = self._pool.next_moves(indices)
+    changed = np.any(held != edges, axis=1)
+    released = held[changed & (held[:, 1] >= 0)]
+    taken = edges[changed & (edges[:, 1] >= 0)]
+    self._w.update_edges_occupancy(released[:, 0], released[:, 1], -1)
+    self._w.update_edges_occupancy(taken[:, 0], taken[:, 1], 1)
+    self._held_edges[indices] = edges
+    if self._debug:
+      self._check_weights()
+      if self._forecast is not None:
+        self._forecast.check(self._assigned_agents)
+
+  def _check_weights(self):
+    '''
+    Compares the warehouse occupancy and flow cost against a full recompute
+    from the assigned agents' next moves. Raises RuntimeError on mismatch.
+    '''
+    expected = Counter(frozenset(agent.next_move()) for agent in self._assigned_agents if agent.next_move())
+    flow_cost = 0.
+    n_occupied = 0
     for e in self._w.graph().edges:
-      if self._w.graph().edges[e]['occupancy'] > 0:
-        self._utilitarian_cost += self._w.get_edge_cost(*e)
+      if self._w.edge_occupancy(*e) != expected[frozenset(e)]:
+        raise RuntimeError('Edge {} has occupancy {} but {} agents traverse it'.format(e, self._w.edge_occupancy(*e), expected[frozenset(e)]))
+      if expected[frozenset(e)] > 0:
+        flow_cost += self._w.get_edge_cost(*e)
+        n_occupied += 1
+    if n_occupied != len(self._w.occupied_edges()) or abs(flow_cost - self._w.flow_cost()) > 1e-9 * max(1., flow_cost):
+      raise RuntimeError('Occupied edges index is out of sync: {} edges with cost {} but {} indexed with cost {}'.format(n_occupied, flow_cost, len(self._w.occupied_edges()), self._w.flow_cost()))
+
+  @timed('WarehouseManager._update_cost')
+  def _update_cost(self):
+    # The warehouse keeps the cost of its occupied edges up to date
+    cost = self._w.flow_cost()
+    self._utilitarian_cost += cost
+    if self._trace is not None:
+      self._trace.record(self._ticks, TICK, cost=cost)
 
   def _agent_name(i):
     return 'a_{}'.format(i)
@@ -155,7 +694,7 @@ class WarehouseManager:
       if v['cost'] < cost:
         cost = v['cost']
         key = k
-    return k, agent_path_bets[k]
+    return key, agent_path_bets[key]
 
 
 if __name__ == '__main__':